@@ -4,15 +4,16 @@ Fantasy Dashboard Telegram Bot
 """
 
 import os
-import json
 import logging
 from dotenv import load_dotenv
 
 # Загрузка .env
 load_dotenv()
 from datetime import datetime
+from pathlib import Path
 from telegram import Update, WebAppInfo, KeyboardButton, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from storage import JSONStore
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,22 +25,13 @@ logger = logging.getLogger(__name__)
 # Конфигурация
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 WEBAPP_URL = os.getenv('WEBAPP_URL', 'https://your-domain.com')
-DATA_FILE = 'data.json'
+DATA_FILE = Path(__file__).parent / 'data.json'  # Тот же файл, что у server.py
 
 # ===== РАБОТА С ДАННЫМИ =====
 
 def load_data() -> dict:
-    """Загрузить данные из JSON"""
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return get_default_data()
-
-def save_data(data: dict):
-    """Сохранить данные в JSON"""
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    """Загрузить данные (из памяти, диск — только если файл изменился)"""
+    return store.read()
 
 def get_default_data() -> dict:
     """Данные по умолчанию"""
@@ -65,6 +57,9 @@ def get_default_data() -> dict:
         "quests": []
     }
 
+# Общее хранилище с server.py: изменения — через store.transaction()
+store = JSONStore(DATA_FILE, default=get_default_data)
+
 # ===== КЛАВИАТУРЫ =====
 
 def get_main_keyboard() -> ReplyKeyboardMarkup:
@@ -148,15 +143,14 @@ async def add_quest(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     quest_name = ' '.join(context.args)
-    data = load_data()
     
-    data['quests'].append({
-        "name": quest_name,
-        "status": "active",
-        "date": datetime.now().strftime("%Y-%m-%d")
-    })
+    with store.transaction() as data:
+        data['quests'].append({
+            "name": quest_name,
+            "status": "active",
+            "date": datetime.now().strftime("%Y-%m-%d")
+        })
     
-    save_data(data)
     await update.message.reply_text(f"📜 Квест добавлен: ⏳ *{quest_name}*", parse_mode='Markdown')
 
 async def complete_quest(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -166,20 +160,21 @@ async def complete_quest(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     quest_name = ' '.join(context.args).lower()
-    data = load_data()
     
     found = False
-    for quest in data['quests']:
-        if quest['name'].lower() == quest_name and quest['status'] == 'active':
-            quest['status'] = 'done'
-            quest['date'] = datetime.now().strftime("%Y-%m-%d")
-            found = True
-            break
+    with store.transaction() as data:
+        for quest in data['quests']:
+            if quest['name'].lower() == quest_name and quest['status'] == 'active':
+                quest['status'] = 'done'
+                quest['date'] = datetime.now().strftime("%Y-%m-%d")
+                found = True
+                break
+        
+        if found:
+            # Увеличиваем XP
+            data['xp']['current'] += 1
     
     if found:
-        # Увеличиваем XP
-        data['xp']['current'] += 1
-        save_data(data)
         await update.message.reply_text(
             f"✅ Квест завершён: *{quest['name']}*\n⭐ +1 XP!",
             parse_mode='Markdown'
@@ -195,9 +190,8 @@ async def set_hp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         value = int(context.args[0])
-        data = load_data()
-        data['hp']['current'] = max(0, min(value, data['hp']['max']))
-        save_data(data)
+        with store.transaction() as data:
+            data['hp']['current'] = max(0, min(value, data['hp']['max']))
         await update.message.reply_text(f"❤️ Здоровье установлено: {data['hp']['current']}/{data['hp']['max']}")
     except ValueError:
         await update.message.reply_text("⚠️ Укажи число: /hp 85")
@@ -210,9 +204,8 @@ async def set_mana(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         value = int(context.args[0])
-        data = load_data()
-        data['mana']['used'] = max(0, min(value, data['mana']['max']))
-        save_data(data)
+        with store.transaction() as data:
+            data['mana']['used'] = max(0, min(value, data['mana']['max']))
         pct = round(data['mana']['used'] / data['mana']['max'] * 100)
         await update.message.reply_text(f"💙 Контекст: {data['mana']['used']:,}/{data['mana']['max']:,} ({pct}%)")
     except ValueError:
@@ -220,9 +213,8 @@ async def set_mana(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def level_up(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /level - повысить уровень"""
-    data = load_data()
-    data['character']['level'] += 1
-    save_data(data)
+    with store.transaction() as data:
+        data['character']['level'] += 1
     await update.message.reply_text(
         f"🎉 *LEVEL UP!*\n\nТеперь ты ⭐ Уровень {data['character']['level']}!",
         parse_mode='Markdown'
@@ -235,14 +227,13 @@ async def add_knowledge(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     name = ' '.join(context.args)
-    data = load_data()
     
-    data['knowledge'].append({
-        "name": name,
-        "icon": "📜"
-    })
+    with store.transaction() as data:
+        data['knowledge'].append({
+            "name": name,
+            "icon": "📜"
+        })
     
-    save_data(data)
     await update.message.reply_text(f"📜 Свиток добавлен: *{name}*", parse_mode='Markdown')
 
 async def add_spell(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -259,17 +250,16 @@ async def add_spell(update: Update, context: ContextTypes.DEFAULT_TYPE):
             raise ValueError("Неверный формат")
         
         name, icon, category, level, desc = parts
-        data = load_data()
         
-        data['spells'].append({
-            "name": name.strip(),
-            "icon": icon.strip(),
-            "category": category.strip(),
-            "level": int(level.strip()),
-            "desc": desc.strip()
-        })
+        with store.transaction() as data:
+            data['spells'].append({
+                "name": name.strip(),
+                "icon": icon.strip(),
+                "category": category.strip(),
+                "level": int(level.strip()),
+                "desc": desc.strip()
+            })
         
-        save_data(data)
         await update.message.reply_text(
             f"✨ Заклинание добавлено: {icon} *{name}* (Lv.{level})",
             parse_mode='Markdown'
@@ -4,27 +4,206 @@ Fantasy Dashboard - PC Bridge
 """
 
 import asyncio
+import base64
+import ctypes
+import ctypes.util
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import multiprocessing
 import os
+import re
+import signal
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
 import aiohttp
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from datetime import datetime
 
+# Необязательные кодеки протокола (сжатие кадров и MessagePack)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Необязательные библиотеки для превью (картинки и первая страница PDF)
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
 # Конфигурация
 VPS_URL = os.getenv('VPS_URL', 'wss://fd.xn--80abjdwkmbdfs.xn--p1ai/ws/pc-bridge')
 BRIDGE_SECRET = os.getenv('BRIDGE_SECRET', 'fantasy-bridge-2026')
 FILES_ROOT = Path(os.getenv('FILES_ROOT', 'C:/BRANDONLINE'))
+BRIDGE_ID = os.getenv('BRIDGE_ID', socket.gethostname())  # имя этого PC на VPS
+BRIDGE_ROOTS = [p for p in os.getenv('BRIDGE_ROOTS', '').split(';') if p]  # папки, которые обслуживает (пусто — все)
 RECONNECT_DELAY = 5  # секунд
+HEARTBEAT_INTERVAL = 15  # секунд между ping к VPS
+MAX_CONCURRENT = int(os.getenv('BRIDGE_CONCURRENCY', '4'))  # параллельных запросов
+FS_WORKERS = int(os.getenv('FS_WORKERS', '8'))  # потоков для файловых операций (запросы + фоновые сканы)
+FS_QUEUE_LIMIT = int(os.getenv('FS_QUEUE_LIMIT', '64'))  # операций в очереди, дальше — ждут места
+
+# Постраничные листинги
+LISTING_PAGE_LIMIT = 200  # элементов на страницу по умолчанию
+LISTING_MAX_LIMIT = 1000
+LISTING_SCAN_TTL = 10  # секунд — следующие страницы берутся из того же прохода по папке
+LISTING_SCAN_CACHE = 8  # папок
+STREAM_CHUNK_SIZE = 256 * 1024  # байт в одном бинарном кадре
+STREAM_WINDOW = 8  # кадров в полёте без подтверждения от VPS
+MAX_STREAMS = int(os.getenv('BRIDGE_STREAMS', '4'))  # одновременных потоковых скачиваний (вне очереди запросов)
+STREAM_STALL_TIMEOUT = 60  # секунд без подтверждений от VPS — поток прекращается
+MAX_STREAM_SIZE = int(os.getenv('BRIDGE_MAX_STREAM_SIZE', str(2_000_000_000)))
+
+# Наблюдение за изменениями файлов
+WATCH_PATHS = [p for p in os.getenv('WATCH_PATHS', 'Загрузки').split(';') if p]  # всегда под наблюдением
+WATCH_MAX_DIRS = 512  # недавно открытых папок под наблюдением
+WATCH_POLL_INTERVAL = 1.0  # секунд (опрос, если нет inotify)
+WATCH_COALESCE = 0.3  # секунд — склейка пачки событий в одно уведомление
+
+# Снимок папки клиентов (вкладка «Душа»)
+SOUL_ROOT = os.getenv('SOUL_ROOT', 'КЛИЕНТЫ')
+SOUL_SCAN_INTERVAL = 60  # секунд между инкрементальными проходами
+
+# Полнотекстовый поиск по архиву
+SEARCH_ROOT = os.getenv('SEARCH_ROOT', '')  # относительно FILES_ROOT, пусто — весь корень
+SEARCH_INDEX_FILE = Path(os.getenv('SEARCH_INDEX_FILE', str(Path(__file__).parent / 'search_index.db')))
+SEARCH_SCAN_INTERVAL = 300  # секунд между инкрементальными проходами
+SEARCH_MAX_FILE_SIZE = 5_000_000  # байт — больше не извлекаем текст, только имя
+SEARCH_MAX_TEXT = 200_000  # символов текста одного файла в индексе
+SEARCH_BATCH = 200  # изменений в одной транзакции
+
+# Кэш извлечённого текста docx/odt
+TEXT_CACHE_DIR = Path(os.getenv('TEXT_CACHE_DIR', str(Path(__file__).parent / 'text_cache')))
+TEXT_CACHE_MAX_BYTES = int(os.getenv('TEXT_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', '2'))  # процессов для разбора документов и превью
 
-print(f"""
+# Превью картинок и PDF
+THUMB_CACHE_DIR = Path(os.getenv('THUMB_CACHE_DIR', str(Path(__file__).parent / 'thumb_cache')))
+THUMB_CACHE_MAX_BYTES = int(os.getenv('THUMB_CACHE_MAX_BYTES', str(100 * 1024 * 1024)))
+THUMB_SIZES = (64, 128, 256, 512, 1024)  # px по длинной стороне; запрошенный размер округляется вверх
+THUMB_QUALITY = 80
+THUMB_MAX_SOURCE = 200_000_000  # байт — больше не открываем
+THUMB_HASH_MEMO = 4096  # путей с запомненным хэшем содержимого
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff'}
+
+# Возможности протокола, о которых bridge сообщает при авторизации
+FEATURES = ['stream', 'watch', 'soul', 'page']
+
+# Сжатие кадров: VPS выбирает из предложенного, старый VPS — обычный JSON
+CODEC_MARKER = 0  # первый байт бинарного кадра-сообщения (у чанков потока там длина id, она > 0)
+CODEC_COMPRESSED = 1
+CODEC_MSGPACK = 2
+COMPRESS_MIN_SIZE = 1024  # байт — меньшие кадры не сжимаем
+CODECS = {
+    'compression': (['zstd'] if zstandard else []) + ['zlib'],
+    'encoding': (['msgpack'] if msgpack else []) + ['json'],
+}
+
+# Приоритеты действий (меньше — раньше): листинги не ждут тяжёлых скачиваний
+ACTION_PRIORITY = {
+    'list': 1,
+    'search': 1,
+    'stat': 1,
+    'open': 1,
+    'read': 2,
+    'thumbnail': 2,
+    'save_to_downloads': 3,
+    'download': 4,
+}
+DEFAULT_PRIORITY = 2
+
+# Процессы пула разбора документов (spawn на Windows) импортируют модуль заново — без баннера
+if __name__ != '__mp_main__':
+    print(f"""
 ========================================
   Fantasy Dashboard - PC Bridge
 ========================================
 VPS: {VPS_URL}
 Root: {FILES_ROOT}
+Bridge ID: {BRIDGE_ID}
 ========================================
 """)
 
+class FsExecutor:
+    """Отдельный ограниченный пул потоков для диска: медленный диск не останавливает event loop"""
+    
+    def __init__(self, workers: int = FS_WORKERS, queue_limit: int = FS_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fs')
+        self.slots = None  # asyncio.Semaphore, создаётся в event loop
+        self.in_flight = 0  # отправлено в пул (выполняются + ждут потока)
+        self.waiting = 0  # ждут места в очереди
+        self.peak_depth = 0
+        self.completed = 0
+        self.wait_total = 0.0  # суммарное ожидание потока, секунд
+    
+    @property
+    def depth(self) -> int:
+        """Операций в очереди пула (без выполняющихся)"""
+        return max(self.in_flight - self.workers, 0)
+    
+    async def run(self, func, *args):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.workers + self.queue_limit)
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        
+        queued_at = time.monotonic()
+        
+        def call():
+            return time.monotonic(), func(*args)
+        
+        self.in_flight += 1
+        self.peak_depth = max(self.peak_depth, self.depth)
+        try:
+            started_at, result = await asyncio.get_running_loop().run_in_executor(self.pool, call)
+        finally:
+            self.in_flight -= 1
+            self.slots.release()
+        self.completed += 1
+        self.wait_total += started_at - queued_at
+        return result
+    
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'in_flight': self.in_flight,
+            'queue_depth': self.depth,
+            'waiting': self.waiting,
+            'peak_queue_depth': self.peak_depth,
+            'completed': self.completed,
+            'avg_wait_ms': round(self.wait_total / self.completed * 1000, 2) if self.completed else 0.0
+        }
+
+fs_io = FsExecutor()
+
+async def run_blocking(func, *args):
+    """Выполнить блокирующую файловую операцию вне event loop"""
+    return await fs_io.run(func, *args)
+
 async def handle_request(data: dict) -> dict:
     """Обработать запрос от VPS"""
     action = data.get('action')
@@ -32,15 +211,32 @@ async def handle_request(data: dict) -> dict:
     
     try:
         if action == 'list':
-            return await list_files(path)
+            if any(data.get(k) for k in ('limit', 'cursor', 'sort', 'order')):
+                return await run_blocking(
+                    list_and_watch, list_page, path, data.get('limit'), data.get('cursor') or '',
+                    data.get('sort') or 'name', data.get('order') or 'asc'
+                )
+            return await run_blocking(list_and_watch, list_files, path)
         elif action == 'read':
-            return await read_file(path)
+            return await run_blocking(read_file, path)
         elif action == 'download':
-            return await download_file(path)
+            return await run_blocking(download_file, path)
         elif action == 'open':
-            return await get_file_url(path)
+            return await run_blocking(get_file_url, path)
+        elif action == 'stat':
+            return await run_blocking(stat_path, path)
         elif action == 'save_to_downloads':
-            return await save_to_downloads(path)
+            return await run_blocking(save_to_downloads, path)
+        elif action == 'search':
+            return await run_blocking(
+                search_index.search, data.get('query', ''), path,
+                int(data.get('limit', 20)), int(data.get('offset', 0))
+            )
+        elif action == 'thumbnail':
+            return await run_blocking(
+                make_thumbnail, path, data.get('thumb_size') or data.get('size'),
+                data.get('format') or 'jpeg', data.get('etag') or ''
+            )
         elif action == 'ping':
             return {'status': 'ok', 'time': datetime.now().isoformat()}
         else:
@@ -61,7 +257,7 @@ def safe_path(relative_path: str) -> Path:
     
     return full
 
-async def list_files(path: str) -> dict:
+def list_files(path: str) -> dict:
     """Список файлов в папке"""
     target = safe_path(path)
     
@@ -71,27 +267,132 @@ async def list_files(path: str) -> dict:
     if not target.is_dir():
         return {'error': 'Not a directory', 'path': path}
     
+    # os.scandir: тип берётся из записи каталога, stat — один на элемент
     items = []
-    for item in sorted(target.iterdir(), key=lambda x: (not x.is_dir(), x.name.lower())):
-        try:
-            stat = item.stat()
+    with os.scandir(target) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+                stat = entry.stat()
+            except (PermissionError, OSError):
+                continue
             items.append({
-                'name': item.name,
-                'type': 'folder' if item.is_dir() else 'file',
-                'size': stat.st_size if item.is_file() else None,
+                'name': entry.name,
+                'type': 'folder' if is_dir else 'file',
+                'size': None if is_dir else stat.st_size,
                 'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                'extension': item.suffix.lower() if item.is_file() else None
+                'extension': None if is_dir else os.path.splitext(entry.name)[1].lower()
             })
-        except (PermissionError, OSError):
-            continue
+    items.sort(key=entry_sort_key)
     
     return {
         'path': path,
         'parent': str(Path(path).parent) if path else None,
+        'mtime': target.stat().st_mtime,
         'items': items
     }
 
-async def read_file(path: str) -> dict:
+def list_and_watch(list_func, path: str, *args) -> dict:
+    """Листинг и постановка папки под наблюдение — в одном вызове в потоке (resolve и inotify — не в event loop)"""
+    result = list_func(path, *args)
+    if 'error' not in result:
+        watcher.watch(path, result['mtime'])
+    return result
+
+# Последние проходы по папкам: путь -> (время, mtime папки, листинг)
+recent_listings = OrderedDict()
+recent_listings_lock = threading.Lock()
+
+def listing_sort_key(item: dict, sort: str) -> list:
+    """Ключ внутри группы (папки / файлы) — тот же, что на VPS, иначе курсоры не совпадут"""
+    if sort == 'mtime':
+        value = item.get('modified') or ''
+    elif sort == 'size':
+        value = item.get('size') or 0
+    else:
+        value = item['name'].lower()
+    return [value, item['name'].lower(), item['name']]
+
+def listing_group(item: dict) -> int:
+    return 0 if item['type'] == 'folder' else 1
+
+def encode_cursor(item: dict, sort: str, order: str) -> str:
+    raw = json.dumps([sort, order, listing_group(item), listing_sort_key(item, sort)], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, sort: str, order: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, cursor_order, group, key = json.loads(raw)
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError('Cursor belongs to another sort order')
+    return group, key
+
+def list_page(path: str, limit, cursor: str = '', sort: str = 'name', order: str = 'asc') -> dict:
+    """Страница листинга после курсора (сортировка name/mtime/size, папки впереди)"""
+    if sort not in ('name', 'mtime', 'size') or order not in ('asc', 'desc'):
+        return {'error': f'Unknown sort: {sort} {order}', 'path': path}
+    limit = max(1, min(int(limit or LISTING_PAGE_LIMIT), LISTING_MAX_LIMIT))
+    try:
+        start, after = decode_cursor(cursor, sort, order) if cursor else (0, None)
+    except ValueError as e:
+        return {'error': str(e), 'path': path}
+    
+    # Следующие страницы — из того же прохода, если папка не менялась
+    key = watcher.key(path)
+    listing = None
+    with recent_listings_lock:
+        cached = recent_listings.get(key)
+    if cached and time.monotonic() - cached[0] < LISTING_SCAN_TTL:
+        try:
+            if safe_path(path).stat().st_mtime == cached[1]:
+                listing = cached[2]
+        except OSError:
+            pass
+    if listing is None:
+        listing = list_files(path)
+        if 'error' in listing:
+            return listing
+        with recent_listings_lock:
+            recent_listings[key] = (time.monotonic(), listing['mtime'], listing)
+            recent_listings.move_to_end(key)
+            while len(recent_listings) > LISTING_SCAN_CACHE:
+                recent_listings.popitem(last=False)
+    
+    desc = order == 'desc'
+    sort_key = lambda item: listing_sort_key(item, sort)
+    select = heapq.nlargest if desc else heapq.nsmallest
+    items = listing['items']
+    groups = ([i for i in items if listing_group(i) == 0], [i for i in items if listing_group(i) == 1])
+    
+    page = []
+    more = False
+    for group in range(start, len(groups)):
+        candidates = groups[group]
+        if after is not None and group == start:
+            candidates = [i for i in candidates if (sort_key(i) < after if desc else sort_key(i) > after)]
+        need = limit - len(page)
+        chosen = select(need + 1, candidates, key=sort_key) if need else candidates[:1]
+        page.extend(chosen[:need])
+        if len(chosen) > need:
+            more = True
+            break
+    
+    return {
+        'path': path,
+        'parent': listing['parent'],
+        'mtime': listing['mtime'],
+        'items': page,
+        'total': len(items),
+        'sort': sort,
+        'order': order,
+        'limit': limit,
+        'next_cursor': encode_cursor(page[-1], sort, order) if more and page else None
+    }
+
+def read_file(path: str) -> dict:
     """Прочитать текстовый файл"""
     target = safe_path(path)
     
@@ -105,45 +406,56 @@ async def read_file(path: str) -> dict:
         return {'error': 'File too large (max 5MB)'}
     
     ext = target.suffix.lower()
-    text_ext = {'.txt', '.md', '.json', '.py', '.js', '.html', '.css', '.yaml', '.yml', '.xml', '.csv', '.log', '.bat', '.sh', '.ps1', '.ini', '.cfg', '.env', '.gitignore'}
     
-    # DOCX файлы
-    if ext == '.docx':
+    # DOCX / ODT файлы
+    if ext in DOCUMENT_PARSERS:
         try:
-            from docx import Document
-            doc = Document(target)
-            content = '\n\n'.join([p.text for p in doc.paragraphs])
-            return {'content': content, 'type': 'text', 'name': target.name, 'format': 'docx'}
+            content = extract_text(target)
+            return {'content': content, 'type': 'text', 'name': target.name, 'format': ext.lstrip('.')}
         except ImportError:
-            return {'error': 'python-docx not installed', 'type': 'binary'}
+            return {'error': f'{DOCUMENT_PARSERS[ext]} not installed', 'type': 'binary'}
         except Exception as e:
-            return {'error': f'Cannot read docx: {str(e)}', 'type': 'binary'}
-    
-    # ODT файлы
-    if ext == '.odt':
-        try:
-            from odf import text as odftext
-            from odf.opendocument import load
-            doc = load(target)
-            paragraphs = doc.getElementsByType(odftext.P)
-            content = '\n\n'.join([p.firstChild.data if p.firstChild else '' for p in paragraphs])
-            return {'content': content, 'type': 'text', 'name': target.name, 'format': 'odt'}
-        except ImportError:
-            return {'error': 'odfpy not installed', 'type': 'binary'}
-        except Exception as e:
-            return {'error': f'Cannot read odt: {str(e)}', 'type': 'binary'}
+            return {'error': f'Cannot read {ext.lstrip(".")}: {str(e)}', 'type': 'binary'}
     
     # Обычные текстовые файлы
-    if ext in text_ext or ext == '':
+    if ext in TEXT_EXTENSIONS or ext == '':
         try:
-            content = target.read_text(encoding='utf-8')
+            content = extract_text(target)
             return {'content': content, 'type': 'text', 'name': target.name}
         except UnicodeDecodeError:
             return {'error': 'Binary file', 'type': 'binary'}
     else:
         return {'error': 'Unsupported format', 'type': 'binary', 'extension': ext}
 
-async def download_file(path: str) -> dict:
+TEXT_EXTENSIONS = {'.txt', '.md', '.json', '.py', '.js', '.html', '.css', '.yaml', '.yml', '.xml', '.csv', '.log', '.bat', '.sh', '.ps1', '.ini', '.cfg', '.env', '.gitignore'}
+DOCUMENT_PARSERS = {'.docx': 'python-docx', '.odt': 'odfpy'}  # расширение -> пакет для извлечения текста
+
+def extract_text(target: Path) -> str:
+    """Текст файла: docx/odt (через кэш), иначе обычный текст (ошибки — исключениями)"""
+    if target.suffix.lower() in DOCUMENT_PARSERS:
+        return text_cache.get(target)
+    return target.read_text(encoding='utf-8')
+
+def parse_document(path: str) -> str:
+    """Разбор docx/odt — выполняется в процессе пула"""
+    target = Path(path)
+    ext = target.suffix.lower()
+    
+    if ext == '.docx':
+        from docx import Document
+        doc = Document(target)
+        return '\n\n'.join([p.text for p in doc.paragraphs])
+    
+    if ext == '.odt':
+        from odf import text as odftext
+        from odf.opendocument import load
+        doc = load(target)
+        paragraphs = doc.getElementsByType(odftext.P)
+        return '\n\n'.join([p.firstChild.data if p.firstChild else '' for p in paragraphs])
+    
+    raise ValueError(f'Not a document: {target.name}')
+
+def download_file(path: str) -> dict:
     """Скачать файл (вернуть содержимое в base64)"""
     import base64
     target = safe_path(path)
@@ -165,7 +477,38 @@ async def download_file(path: str) -> dict:
         'content': base64.b64encode(content).decode('ascii')
     }
 
-async def get_file_url(path: str) -> dict:
+def open_download(path: str):
+    """Проверить файл для потоковой отдачи: (target, size, mtime)"""
+    target = safe_path(path)
+    
+    if not target.exists():
+        raise FileNotFoundError('File not found')
+    
+    if not target.is_file():
+        raise IsADirectoryError('Not a file')
+    
+    size = target.stat().st_size
+    if size > MAX_STREAM_SIZE:
+        raise ValueError(f'File too large (max {MAX_STREAM_SIZE // 1_000_000}MB)')
+    
+    return target, size, target.stat().st_mtime
+
+def stat_path(path: str) -> dict:
+    """Размер и время изменения (для ETag/Range на VPS)"""
+    target = safe_path(path)
+    
+    if not target.exists():
+        return {'error': 'File not found'}
+    
+    stat = target.stat()
+    return {
+        'name': target.name,
+        'is_dir': target.is_dir(),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime
+    }
+
+def get_file_url(path: str) -> dict:
     """Получить информацию о файле для скачивания"""
     target = safe_path(path)
     
@@ -179,7 +522,7 @@ async def get_file_url(path: str) -> dict:
         'downloadable': True
     }
 
-async def save_to_downloads(path: str) -> dict:
+def save_to_downloads(path: str) -> dict:
     """Скопировать файл в папку Загрузки"""
     import shutil
     
@@ -214,47 +557,1021 @@ async def save_to_downloads(path: str) -> dict:
         'filename': dest.name
     }
 
+# ===== ДИСКОВЫЕ КЭШИ (ТЕКСТ ДОКУМЕНТОВ, ПРЕВЬЮ) =====
+
+class DiskCache:
+    """Файлы в папке по ключу; LRU в пределах max_bytes"""
+    
+    def __init__(self, folder: Path, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # файл кэша -> размер, от давно использованных к недавним
+        self.total = 0
+        self.loaded = False
+        self.lock = threading.Lock()
+    
+    def _load(self):
+        """Порядок LRU после перезапуска — по mtime файлов кэша (при попадании он обновляется)"""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.tmp'):
+                os.unlink(entry.path)  # недописанный файл от прошлого запуска
+            elif entry.is_file():
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total += size
+        self.loaded = True
+    
+    def read(self, key: str):
+        """Содержимое по ключу или None"""
+        with self.lock:
+            if not self.loaded:
+                self._load()
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            data = (self.folder / key).read_bytes()
+            os.utime(self.folder / key)
+            return data
+        except OSError:
+            with self.lock:
+                self._drop(key)
+            return None
+    
+    def store(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if not self.loaded:
+                self._load()
+        tmp = self.folder / f'{key}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            tmp.write_bytes(data)
+            os.replace(tmp, self.folder / key)
+        except OSError:
+            return  # кэш — не обязательная часть ответа
+        
+        with self.lock:
+            self.total += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                oldest = next(iter(self.entries))
+                self._drop(oldest)
+                try:
+                    os.unlink(self.folder / oldest)
+                except OSError:
+                    pass
+    
+    def _drop(self, key: str):
+        self.total -= self.entries.pop(key, 0)
+
+# Пул создаётся из потока fs_io: fork из многопоточного процесса небезопасен.
+# spawn, а не forkserver: дочерний процесс заново импортирует скрипт как __mp_main__ и видит его функции
+PROCESS_POOL_CONTEXT = 'spawn'
+
+process_pool = None
+process_pool_lock = threading.Lock()
+
+def run_in_process(func, *args):
+    """Выполнить тяжёлую функцию в пуле процессов (вызывается из потока fs_io)"""
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            process_pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context(PROCESS_POOL_CONTEXT)
+            )
+        pool = process_pool
+    try:
+        return pool.submit(func, *args).result()
+    except BrokenProcessPool:
+        # Процесс пула упал (например, на битом файле) — следующий вызов поднимет новый пул
+        with process_pool_lock:
+            if process_pool is pool:
+                process_pool = None
+        raise
+
+def shutdown_process_pool():
+    """Остановить пул процессов (при выходе), ожидающие задачи отменяются"""
+    global process_pool
+    with process_pool_lock:
+        pool, process_pool = process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+class TextCache(DiskCache):
+    """Текст docx/odt по ключу (путь, размер, mtime); разбор — в пуле процессов"""
+    
+    def __init__(self, folder: Path = TEXT_CACHE_DIR, max_bytes: int = TEXT_CACHE_MAX_BYTES):
+        super().__init__(folder, max_bytes)
+    
+    @staticmethod
+    def _key(target: Path, stat) -> str:
+        # Изменённый файл получает новый ключ, старая запись уйдёт по LRU
+        raw = f'{target}\0{stat.st_size}\0{stat.st_mtime_ns}'
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest() + '.txt'
+    
+    def get(self, target: Path) -> str:
+        key = self._key(target.resolve(), target.stat())
+        data = self.read(key)
+        if data is not None:
+            return data.decode('utf-8')
+        text = run_in_process(parse_document, str(target))
+        self.store(key, text.encode('utf-8'))
+        return text
+
+text_cache = TextCache()
+
+# ===== ПРЕВЬЮ =====
+
+def render_thumbnail(path: str, size: int, fmt: str) -> bytes:
+    """Уменьшенная картинка или первая страница PDF — выполняется в процессе пула"""
+    target = Path(path)
+    if target.suffix.lower() == '.pdf':
+        if pymupdf is None:
+            raise ImportError('PyMuPDF not installed')
+        with pymupdf.open(target) as doc:
+            page = doc[0]
+            zoom = size / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+            img = Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+    else:
+        img = Image.open(target)
+        img.draft('RGB', (size, size))  # JPEG сразу декодируется в уменьшенном масштабе
+        img = ImageOps.exif_transpose(img)
+    
+    img.thumbnail((size, size))
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        if fmt == 'jpeg':
+            # У JPEG нет прозрачности — кладём на белый фон
+            background = Image.new('RGB', img.size, 'white')
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+    elif img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    
+    out = io.BytesIO()
+    img.save(out, 'JPEG' if fmt == 'jpeg' else 'WEBP', quality=THUMB_QUALITY)
+    return out.getvalue()
+
+class ThumbnailCache(DiskCache):
+    """Превью по хэшу содержимого: переименованный или скопированный файл не пересчитывается"""
+    
+    def __init__(self, folder: Path = THUMB_CACHE_DIR, max_bytes: int = THUMB_CACHE_MAX_BYTES):
+        super().__init__(folder, max_bytes)
+        self.hashes = OrderedDict()  # путь -> (размер, mtime_ns, sha1)
+    
+    def content_hash(self, target: Path, stat) -> str:
+        """sha1 содержимого; пока размер и mtime те же — из памяти"""
+        key = str(target)
+        with self.lock:
+            known = self.hashes.get(key)
+        if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            return known[2]
+        
+        digest = hashlib.sha1()
+        with open(target, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        value = digest.hexdigest()
+        with self.lock:
+            self.hashes[key] = (stat.st_size, stat.st_mtime_ns, value)
+            self.hashes.move_to_end(key)
+            while len(self.hashes) > THUMB_HASH_MEMO:
+                self.hashes.popitem(last=False)
+        return value
+
+thumb_cache = ThumbnailCache()
+
+def make_thumbnail(path: str, size=None, fmt: str = 'jpeg', etag: str = '') -> dict:
+    """Превью файла в base64; etag совпал с текущим — без содержимого"""
+    target = safe_path(path)
+    
+    if not target.is_file():
+        return {'error': 'File not found'}
+    
+    ext = target.suffix.lower()
+    if ext not in IMAGE_EXTENSIONS and ext != '.pdf':
+        return {'error': 'Unsupported format', 'extension': ext}
+    if fmt not in ('jpeg', 'webp'):
+        return {'error': f'Unknown format: {fmt} (jpeg, webp)'}
+    
+    stat = target.stat()
+    if stat.st_size > THUMB_MAX_SOURCE:
+        return {'error': f'File too large (max {THUMB_MAX_SOURCE // 1_000_000}MB)'}
+    
+    size = next((s for s in THUMB_SIZES if s >= int(size or 256)), THUMB_SIZES[-1])
+    content_hash = thumb_cache.content_hash(target, stat)
+    result = {
+        'name': target.name,
+        'size': size,
+        'format': fmt,
+        'mime': f'image/{fmt}',
+        'etag': f'{content_hash[:16]}-{size}.{fmt}'
+    }
+    if etag == result['etag']:
+        return {**result, 'not_modified': True}
+    
+    key = f'{content_hash}_{size}.{fmt}'
+    data = thumb_cache.read(key)
+    if data is None:
+        data = run_in_process(render_thumbnail, str(target), size, fmt)
+        thumb_cache.store(key, data)
+    return {**result, 'content': base64.b64encode(data).decode('ascii')}
+
+if Image is not None:
+    FEATURES.append('thumbnail')
+
+# inotify: флаги событий (linux/inotify.h)
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+
+class Inotify:
+    """Минимальная обёртка над inotify через ctypes (без зависимостей)"""
+    
+    MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+            IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+    
+    def __init__(self, libc, fd: int):
+        self.libc = libc
+        self.fd = fd
+    
+    @classmethod
+    def create(cls):
+        """Inotify или None, если платформа не поддерживает"""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return cls(libc, fd) if fd >= 0 else None
+    
+    def add(self, target: Path) -> int:
+        return self.libc.inotify_add_watch(self.fd, os.fsencode(target), self.MASK)
+    
+    def remove(self, wd: int):
+        self.libc.inotify_rm_watch(self.fd, wd)
+    
+    def read_events(self) -> list:
+        """Прочитать накопившиеся события: [(wd, mask)]"""
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + self.EVENT.size <= len(buf):
+            wd, mask, _, name_len = self.EVENT.unpack_from(buf, offset)
+            events.append((wd, mask))
+            offset += self.EVENT.size + name_len
+        return events
+
+class FsWatcher:
+    """Наблюдение за недавно открытыми папками: inotify на Linux, опрос mtime в остальных случаях"""
+    
+    def __init__(self):
+        self.dirs: "OrderedDict[str, float]" = OrderedDict()  # путь -> mtime папки
+        self.pinned = {self.key(p) for p in WATCH_PATHS}
+        self.inotify = Inotify.create()
+        self.wd_to_key = {}
+        self.key_to_wd = {}
+        self.pending = set()
+        self.flush_handle = None
+        self.notify = None
+        self.lock = threading.RLock()  # watch() вызывается из потоков fs_io, события inotify — в event loop
+    
+    @staticmethod
+    def key(path: str) -> str:
+        return path.replace('\\', '/').strip('/')
+    
+    def watch(self, path: str, mtime: float):
+        """Поставить папку под наблюдение (после листинга)"""
+        key = self.key(path)
+        target = safe_path(key) if self.inotify else None
+        with self.lock:
+            if key in self.dirs:
+                self.dirs.move_to_end(key)
+                return
+            
+            self.dirs[key] = mtime
+            if self.inotify:
+                wd = self.inotify.add(target)
+                if wd >= 0:
+                    self.wd_to_key[wd] = key
+                    self.key_to_wd[key] = wd
+            
+            # Вытесняем самые давние, кроме закреплённых
+            for old in list(self.dirs):
+                if len(self.dirs) <= WATCH_MAX_DIRS:
+                    break
+                if old not in self.pinned:
+                    self.unwatch(old)
+    
+    def unwatch(self, key: str):
+        with self.lock:
+            self.dirs.pop(key, None)
+            wd = self.key_to_wd.pop(key, None)
+            if wd is not None:
+                self.wd_to_key.pop(wd, None)
+                self.inotify.remove(wd)
+    
+    def watch_pinned(self):
+        """Закреплённые папки (Загрузки и т.п.) наблюдаем с самого старта"""
+        for key in self.pinned:
+            try:
+                target = safe_path(key)
+                if target.is_dir():
+                    self.watch(key, target.stat().st_mtime)
+            except (PermissionError, OSError):
+                continue
+    
+    def changed(self, key: str):
+        """Склеить события за WATCH_COALESCE в одно уведомление"""
+        self.pending.add(key)
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(WATCH_COALESCE, self._flush)
+    
+    def _flush(self):
+        self.flush_handle = None
+        paths = sorted(self.pending)
+        self.pending.clear()
+        if paths and self.notify:
+            asyncio.create_task(self.notify({'type': 'fs_change', 'paths': paths}))
+    
+    def _on_inotify(self):
+        for wd, mask in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                with self.lock:
+                    keys = list(self.dirs)
+                for key in keys:
+                    self.changed(key)
+                continue
+            key = self.wd_to_key.get(wd)
+            if key is None:
+                continue
+            self.changed(key)
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                self.unwatch(key)
+    
+    def _poll(self, snapshot: list) -> dict:
+        """Сверить mtime папок (в потоке): {путь: новый mtime или None если пропала}"""
+        changes = {}
+        for key, mtime in snapshot:
+            try:
+                current = safe_path(key).stat().st_mtime
+            except (PermissionError, OSError):
+                changes[key] = None
+                continue
+            if current != mtime:
+                changes[key] = current
+        return changes
+    
+    async def run(self, notify):
+        """Следить за папками, пока открыто соединение с VPS"""
+        self.notify = notify
+        await run_blocking(self.watch_pinned)
+        loop = asyncio.get_running_loop()
+        try:
+            if self.inotify:
+                loop.add_reader(self.inotify.fd, self._on_inotify)
+                try:
+                    await asyncio.Event().wait()
+                finally:
+                    loop.remove_reader(self.inotify.fd)
+            else:
+                while True:
+                    await asyncio.sleep(WATCH_POLL_INTERVAL)
+                    with self.lock:
+                        snapshot = list(self.dirs.items())
+                    changes = await run_blocking(self._poll, snapshot)
+                    for key, mtime in changes.items():
+                        if mtime is None:
+                            self.unwatch(key)
+                        else:
+                            with self.lock:
+                                if key in self.dirs:
+                                    self.dirs[key] = mtime
+                        self.changed(key)
+        finally:
+            self.notify = None
+
+watcher = FsWatcher()
+
+def entry_sort_key(item: dict):
+    """Порядок как в листинге: папки, затем файлы, по имени"""
+    return (item['type'] != 'folder', item['name'].lower())
+
+class SoulScanner:
+    """Инкрементальный скан папки клиентов (глубина 2): перечитывает только изменившиеся папки"""
+    
+    def __init__(self, root: str = SOUL_ROOT):
+        self.root = root
+        self.items = {}  # имя -> элемент снимка
+        self.dir_mtimes = {}  # 'Клиент' / 'Клиент/Подпапка' -> mtime при последнем чтении
+        self.version = 0
+        self.scanned_at = None
+    
+    def _path(self, rel: str) -> Path:
+        return safe_path(f'{self.root}/{rel}')
+    
+    def _file_item(self, name: str, stat) -> dict:
+        return {
+            'name': name,
+            'type': 'file',
+            'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            'size': stat.st_size,
+            'ext': Path(name).suffix.lower().lstrip('.')
+        }
+    
+    def _child_item(self, rel: str, name: str, stat, is_dir: bool, old: dict = None) -> dict:
+        """Элемент второго уровня; число вложенных пересчитывается только при смене mtime"""
+        if not is_dir:
+            return self._file_item(name, stat)
+        
+        if old and old.get('type') == 'folder' and self.dir_mtimes.get(rel) == stat.st_mtime:
+            return old
+        
+        with os.scandir(self._path(rel)) as it:
+            count = sum(1 for _ in it)
+        self.dir_mtimes[rel] = stat.st_mtime
+        return {
+            'name': name,
+            'type': 'folder',
+            'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            'children_count': count
+        }
+    
+    def _client_item(self, name: str, stat) -> dict:
+        old = self.items.get(name)
+        old_children = {c['name']: c for c in old.get('children', [])} if old else {}
+        children = []
+        
+        if old is None or self.dir_mtimes.get(name) != stat.st_mtime:
+            # Состав папки клиента изменился — читаем её заново
+            with os.scandir(self._path(name)) as it:
+                for entry in it:
+                    try:
+                        children.append(self._child_item(
+                            f'{name}/{entry.name}', entry.name, entry.stat(),
+                            entry.is_dir(), old_children.get(entry.name)
+                        ))
+                    except (PermissionError, OSError):
+                        continue
+            self.dir_mtimes[name] = stat.st_mtime
+        else:
+            # Состав тот же — достаточно stat известных подпапок и файлов
+            for child_name, old_child in old_children.items():
+                rel = f'{name}/{child_name}'
+                try:
+                    child_stat = os.stat(self._path(rel))
+                except (PermissionError, OSError):
+                    continue
+                children.append(self._child_item(
+                    rel, child_name, child_stat, old_child['type'] == 'folder', old_child
+                ))
+        
+        children.sort(key=entry_sort_key)
+        return {
+            'name': name,
+            'type': 'folder',
+            'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            'children': children,
+            'children_count': len(children)
+        }
+    
+    def scan(self):
+        """Один проход (в потоке): (изменённые элементы, имена удалённых)"""
+        upsert = []
+        seen = set()
+        
+        with os.scandir(safe_path(self.root)) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                    if entry.is_dir():
+                        item = self._client_item(entry.name, stat)
+                    else:
+                        item = self._file_item(entry.name, stat)
+                except (PermissionError, OSError):
+                    continue
+                seen.add(entry.name)
+                if item != self.items.get(entry.name):
+                    self.items[entry.name] = item
+                    upsert.append(item)
+        
+        removed = [name for name in self.items if name not in seen]
+        for name in removed:
+            del self.items[name]
+            for rel in [r for r in self.dir_mtimes if r == name or r.startswith(name + '/')]:
+                del self.dir_mtimes[rel]
+        
+        self.scanned_at = datetime.now().isoformat()
+        return upsert, removed
+    
+    def snapshot(self) -> dict:
+        return {
+            'type': 'soul_snapshot',
+            'version': self.version,
+            'source': str(safe_path(self.root)),
+            'scanned_at': self.scanned_at,
+            'depth': 2,
+            'items': sorted(dict(self.items).values(), key=entry_sort_key)
+        }
+    
+    async def run(self, send):
+        """Полный снимок при подключении, дальше — только дельты"""
+        try:
+            if not await run_blocking(lambda: safe_path(self.root).is_dir()):
+                return
+        except PermissionError:
+            return
+        
+        await run_blocking(self.scan)
+        self.version += 1
+        await send(self.snapshot())
+        
+        while True:
+            await asyncio.sleep(SOUL_SCAN_INTERVAL)
+            try:
+                upsert, removed = await run_blocking(self.scan)
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Soul scan failed: {e}")
+                continue
+            if not upsert and not removed:
+                continue
+            self.version += 1
+            await send({
+                'type': 'soul_delta',
+                'base': self.version - 1,
+                'version': self.version,
+                'scanned_at': self.scanned_at,
+                'upsert': upsert,
+                'remove': removed
+            })
+
+soul_scanner = SoulScanner()
+
+# ===== ПОЛНОТЕКСТОВЫЙ ПОИСК =====
+
+class SearchIndex:
+    """Индекс по архиву (SQLite FTS5): путь, имя и извлечённый текст; проход переиндексирует только изменившиеся файлы"""
+    
+    def __init__(self, db_path: Path = SEARCH_INDEX_FILE, root: str = SEARCH_ROOT):
+        self.db_path = db_path
+        self.root = root
+        self.lock = threading.Lock()
+        self.db = None
+        self.ready = False  # первый полный проход завершён
+        self.scanned_at = None
+    
+    @staticmethod
+    def available() -> bool:
+        """FTS5 есть не в каждой сборке SQLite"""
+        try:
+            sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE t USING fts5(x)')
+            return True
+        except sqlite3.OperationalError:
+            return False
+    
+    def _connect(self):
+        if self.db is None:
+            db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime REAL)')
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(name, body, tokenize='unicode61 remove_diacritics 2')")
+            self.db = db
+        return self.db
+    
+    def _walk(self, unreadable: list):
+        """(относительный путь, stat) всех файлов под корнем поиска; непрочитанные папки — в unreadable.
+        Корень недоступен (диск или сетевая папка отвалились) — OSError"""
+        base = safe_path(self.root)
+        stack = [base]
+        while stack:
+            folder = stack.pop()
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                if folder == base:
+                    raise
+                unreadable.append(Path(folder).relative_to(FILES_ROOT.resolve()).as_posix() + '/')
+                continue
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        rel = Path(entry.path).relative_to(FILES_ROOT.resolve()).as_posix()
+                        yield rel, entry.stat()
+                except OSError:
+                    continue
+    
+    def _document(self, rel: str, size: int):
+        """(имя для индекса, текст): папки пути тоже ищутся — по ним находится клиент"""
+        name = rel.replace('/', ' ')
+        ext = Path(rel).suffix.lower()
+        body = ''
+        if size <= SEARCH_MAX_FILE_SIZE and (ext in TEXT_EXTENSIONS or ext in DOCUMENT_PARSERS):
+            try:
+                body = extract_text(safe_path(rel))[:SEARCH_MAX_TEXT]
+            except Exception:
+                pass  # не извлёкся текст — ищется только по имени
+        return name, body
+    
+    def scan(self) -> dict:
+        """Инкрементальный проход по mtime/size: новые и изменённые — в индекс, исчезнувшие — из индекса"""
+        with self.lock:
+            db = self._connect()
+            known = {path: (file_id, size, mtime) for file_id, path, size, mtime in db.execute('SELECT id, path, size, mtime FROM files')}
+        
+        seen = set()
+        unreadable = []  # Папки, которые не прочитались в этот проход: их файлы из индекса не удаляем
+        added = updated = pending = 0
+        for rel, stat in self._walk(unreadable):
+            seen.add(rel)
+            old = known.get(rel)
+            if old and old[1] == stat.st_size and old[2] == stat.st_mtime:
+                continue
+            name, body = self._document(rel, stat.st_size)
+            with self.lock:
+                if old:
+                    db.execute('UPDATE files SET size = ?, mtime = ? WHERE id = ?', (stat.st_size, stat.st_mtime, old[0]))
+                    db.execute('UPDATE docs SET name = ?, body = ? WHERE rowid = ?', (name, body, old[0]))
+                    updated += 1
+                else:
+                    cursor = db.execute('INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)', (rel, stat.st_size, stat.st_mtime))
+                    db.execute('INSERT INTO docs (rowid, name, body) VALUES (?, ?, ?)', (cursor.lastrowid, name, body))
+                    added += 1
+                pending += 1
+                if pending >= SEARCH_BATCH:
+                    db.commit()
+                    pending = 0
+        
+        removed = [
+            (old[0],) for path, old in known.items()
+            if path not in seen and not path.startswith(tuple(unreadable))
+        ]
+        with self.lock:
+            db.executemany('DELETE FROM files WHERE id = ?', removed)
+            db.executemany('DELETE FROM docs WHERE rowid = ?', removed)
+            db.commit()
+        
+        self.ready = True
+        self.scanned_at = datetime.now().isoformat()
+        return {'added': added, 'updated': updated, 'removed': len(removed), 'total': len(seen)}
+    
+    def search(self, query: str, prefix: str = '', limit: int = 20, offset: int = 0) -> dict:
+        """Ранжированные совпадения (bm25, имя весомее текста) со сниппетами"""
+        terms = re.findall(r'\w+', query.lower())
+        result = {'query': query, 'path': prefix, 'total': 0, 'hits': [], 'indexing': not self.ready}
+        if not terms:
+            return result
+        
+        # Каждое слово — по префиксу, все слова обязательны
+        match = ' '.join(f'"{term}"*' for term in terms)
+        where = 'docs MATCH ?'
+        params = [match]
+        prefix = prefix.replace('\\', '/').strip('/')
+        if prefix:
+            escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where += " AND (f.path = ? OR f.path LIKE ? ESCAPE '\\')"
+            params += [prefix, escaped + '/%']
+        
+        with self.lock:
+            db = self._connect()
+            result['total'] = db.execute(
+                f'SELECT count(*) FROM docs JOIN files f ON f.id = docs.rowid WHERE {where}', params
+            ).fetchone()[0]
+            rows = db.execute(
+                f"""SELECT f.path, f.size, f.mtime, snippet(docs, 1, '**', '**', '…', 12), bm25(docs, 10.0, 1.0) AS score
+                    FROM docs JOIN files f ON f.id = docs.rowid
+                    WHERE {where} ORDER BY score LIMIT ? OFFSET ?""",
+                params + [max(1, min(limit, 100)), max(0, offset)]
+            ).fetchall()
+        
+        for path, size, mtime, snippet, score in rows:
+            result['hits'].append({
+                'path': path,
+                'name': Path(path).name,
+                'size': size,
+                'modified': datetime.fromtimestamp(mtime).isoformat(),
+                'score': round(-score, 3),
+                'snippet': snippet
+            })
+        return result
+    
+    async def run(self):
+        """Фоновое обновление индекса (не зависит от подключения к VPS)"""
+        while True:
+            try:
+                stats = await run_blocking(self.scan)
+                if stats['added'] or stats['updated'] or stats['removed']:
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] 🔎 Index: +{stats['added']} "
+                          f"~{stats['updated']} -{stats['removed']} ({stats['total']} files)")
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Index error: {e}")
+            await asyncio.sleep(SEARCH_SCAN_INTERVAL)
+
+search_index = SearchIndex()
+if SearchIndex.available():
+    FEATURES.append('search')
+
+# ===== КОДЕК КАДРОВ =====
+
+# Ошибки библиотек сжатия и MessagePack на битом кадре — FrameCodec.decode отдаёт их как ValueError
+CODEC_ERRORS = (
+    (zlib.error, IndexError, TypeError)
+    + ((zstandard.ZstdError,) if zstandard else ())
+    + ((msgpack.UnpackException,) if msgpack else ())
+)
+
+class FrameCodec:
+    """Сообщения: JSON или MessagePack, большие — сжатые zstd/zlib; бинарный кадр = [0][флаги][тело]"""
+    
+    def __init__(self, compression=None, encoding='json'):
+        self.compression = compression
+        self.encoding = encoding or 'json'
+        if compression == 'zstd':
+            self._compress = zstandard.ZstdCompressor(level=3).compress
+            self._decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            self._compress, self._decompress = zlib.compress, zlib.decompress
+    
+    def encode(self, message: dict):
+        """str — обычный текстовый кадр, bytes — кодированный"""
+        flags = 0
+        if self.encoding == 'msgpack':
+            body = msgpack.packb(message, use_bin_type=True)
+            flags |= CODEC_MSGPACK
+        else:
+            body = json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode()
+        if self.compression and len(body) >= COMPRESS_MIN_SIZE:
+            packed = self._compress(body)
+            if len(packed) < len(body):
+                body, flags = packed, flags | CODEC_COMPRESSED
+        if not flags:
+            return body.decode()
+        return bytes((CODEC_MARKER, flags)) + body
+    
+    def decode(self, frame: bytes) -> dict:
+        """ValueError — кадр битый"""
+        try:
+            flags, body = frame[1], frame[2:]
+            if flags & CODEC_COMPRESSED:
+                body = self._decompress(body)
+            if flags & CODEC_MSGPACK:
+                message = msgpack.unpackb(body, raw=False)
+            else:
+                message = json.loads(body)
+        except CODEC_ERRORS as e:
+            raise ValueError(f'Invalid frame: {e}') from e
+        if not isinstance(message, dict):
+            raise ValueError('Invalid frame: not an object')
+        return message
+
+class RequestDispatcher:
+    """Очередь запросов VPS: приоритеты по действию и ограничение параллельности"""
+    
+    def __init__(self, ws, concurrency: int = MAX_CONCURRENT):
+        self.ws = ws
+        self.queue = asyncio.PriorityQueue()
+        self.counter = itertools.count()  # FIFO внутри одного приоритета
+        self.send_lock = asyncio.Lock()
+        self.codec = FrameCodec()  # до auth_ok — обычный JSON
+        self.stream_credits = {}  # request_id -> Semaphore окна
+        self.cancelled_streams = set()
+        self.stream_slots = asyncio.Semaphore(MAX_STREAMS)
+        self.streams = set()  # Задачи потоковых скачиваний
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(concurrency)]
+    
+    def submit(self, data: dict):
+        """Поставить запрос в очередь (потоковое скачивание — отдельной задачей, обработчики не занимает)"""
+        if data.get('action') == 'download' and data.get('stream'):
+            task = asyncio.create_task(self._stream(data))
+            self.streams.add(task)
+            task.add_done_callback(self.streams.discard)
+            return
+        priority = ACTION_PRIORITY.get(data.get('action'), DEFAULT_PRIORITY)
+        self.queue.put_nowait((priority, next(self.counter), data))
+    
+    async def send_json(self, payload: dict):
+        """Отправить сообщение в согласованном кодеке (ответы из разных задач не перемешиваются)"""
+        frame = self.codec.encode(payload)
+        async with self.send_lock:
+            if isinstance(frame, bytes):
+                await self.ws.send_bytes(frame)
+            else:
+                await self.ws.send_str(frame)
+    
+    async def send_bytes(self, payload: bytes):
+        async with self.send_lock:
+            await self.ws.send_bytes(payload)
+    
+    def grant(self, request_id: str, credits: int = 1):
+        """VPS отдал клиенту очередные чанки — можно слать следующие"""
+        semaphore = self.stream_credits.get(request_id)
+        if semaphore:
+            for _ in range(credits):
+                semaphore.release()
+    
+    def cancel_stream(self, request_id: str):
+        """Клиент на VPS отключился — прекратить чтение файла"""
+        if request_id in self.stream_credits:
+            self.cancelled_streams.add(request_id)
+            self.stream_credits[request_id].release()
+    
+    async def _worker(self):
+        while True:
+            _, _, data = await self.queue.get()
+            try:
+                result = await handle_request(data)
+                result['id'] = data.get('id')
+                result['type'] = 'response'
+                await self.send_json(result)
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Request {data.get('id')} failed: {e}")
+            finally:
+                self.queue.task_done()
+    
+    async def _stream(self, data: dict):
+        async with self.stream_slots:
+            try:
+                await self.stream_file(data)
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Stream {data.get('id')} failed: {e}")
+    
+    async def stream_file(self, data: dict):
+        """Отдать файл (или диапазон offset/length) бинарными кадрами [длина id][id][чанк]"""
+        request_id = data.get('id')
+        try:
+            target, size, mtime = await run_blocking(open_download, data.get('path', ''))
+        except Exception as e:
+            await self.send_json({'type': 'response', 'id': request_id, 'error': str(e)})
+            return
+        
+        offset = min(max(int(data.get('offset') or 0), 0), size)
+        remaining = size - offset
+        if data.get('length') is not None:
+            remaining = min(int(data['length']), remaining)
+        
+        id_bytes = request_id.encode('ascii')
+        prefix = bytes([len(id_bytes)]) + id_bytes
+        credits = asyncio.Semaphore(STREAM_WINDOW)
+        self.stream_credits[request_id] = credits
+        
+        try:
+            await self.send_json({
+                'type': 'stream_start',
+                'id': request_id,
+                'name': target.name,
+                'size': size,
+                'mtime': mtime,
+                'offset': offset,
+                'length': remaining,
+                'chunk_size': STREAM_CHUNK_SIZE
+            })
+            f = await run_blocking(open, target, 'rb')
+            try:
+                await run_blocking(f.seek, offset)
+                while remaining > 0:
+                    try:
+                        await asyncio.wait_for(credits.acquire(), timeout=STREAM_STALL_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        raise Exception('Stream stalled: no acknowledgements from VPS')
+                    if request_id in self.cancelled_streams:
+                        return
+                    chunk = await run_blocking(f.read, min(STREAM_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await self.send_bytes(prefix + chunk)
+            finally:
+                await run_blocking(f.close)
+            await self.send_json({'type': 'stream_end', 'id': request_id})
+        except Exception as e:
+            await self.send_json({'type': 'stream_error', 'id': request_id, 'error': str(e)})
+        finally:
+            self.stream_credits.pop(request_id, None)
+            self.cancelled_streams.discard(request_id)
+    
+    async def close(self):
+        """Остановить обработчики (при разрыве соединения)"""
+        tasks = self.workers + list(self.streams)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def stop_on_signal(task: asyncio.Task):
+    """SIGTERM: сразу закрыть пул процессов и завершить основной цикл"""
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] SIGTERM, stopping...")
+    shutdown_process_pool()
+    task.cancel()
+
 async def main():
     """Основной цикл подключения к VPS"""
+    if 'search' in FEATURES:
+        asyncio.create_task(search_index.run())
+    if os.name != 'nt':
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_on_signal, asyncio.current_task())
+    
+    try:
+        await connect_loop()
+    finally:
+        shutdown_process_pool()
+
+async def connect_loop():
+    """Подключение к VPS с переподключением после разрыва"""
     while True:
         try:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] Connecting to VPS...")
             
             async with aiohttp.ClientSession() as session:
-                async with session.ws_connect(VPS_URL) as ws:
+                # heartbeat: протокольные ping — мёртвое соединение с VPS обнаружится без ожидания TCP
+                async with session.ws_connect(VPS_URL, heartbeat=HEARTBEAT_INTERVAL) as ws:
                     print(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ Connected!")
                     
                     # Авторизация
                     await ws.send_json({
                         'type': 'auth',
-                        'secret': BRIDGE_SECRET
+                        'secret': BRIDGE_SECRET,
+                        'features': FEATURES,
+                        'bridge_id': BRIDGE_ID,
+                        'roots': BRIDGE_ROOTS,
+                        'codecs': CODECS
                     })
                     
-                    async for msg in ws:
-                        if msg.type == aiohttp.WSMsgType.TEXT:
-                            try:
-                                data = json.loads(msg.data)
-                                
-                                if data.get('type') == 'request':
-                                    # Обработка запроса
-                                    request_id = data.get('id')
-                                    result = await handle_request(data)
-                                    result['id'] = request_id
-                                    result['type'] = 'response'
-                                    await ws.send_json(result)
+                    dispatcher = RequestDispatcher(ws)
+                    watch_task = asyncio.create_task(watcher.run(dispatcher.send_json))
+                    soul_task = asyncio.create_task(soul_scanner.run(dispatcher.send_json))
+                    try:
+                        async for msg in ws:
+                            if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                                try:
+                                    if msg.type == aiohttp.WSMsgType.TEXT:
+                                        data = json.loads(msg.data)
+                                    else:
+                                        data = dispatcher.codec.decode(msg.data)
+                                    
+                                    if data.get('type') == 'auth_ok':
+                                        codec = data.get('codec') or {}
+                                        dispatcher.codec = FrameCodec(codec.get('compression'), codec.get('encoding'))
+                                        print(f"[{datetime.now().strftime('%H:%M:%S')}] Codec: "
+                                              f"{codec.get('compression') or 'none'}, {dispatcher.codec.encoding}")
+                                    
+                                    elif data.get('type') == 'request':
+                                        if data.get('action') == 'ping':
+                                            # Пинг отвечаем сразу, мимо очереди
+                                            result = await handle_request(data)
+                                            result['id'] = data.get('id')
+                                            result['type'] = 'response'
+                                            await dispatcher.send_json(result)
+                                        else:
+                                            # Каждый запрос — отдельная задача в очереди
+                                            dispatcher.submit(data)
+                                        
+                                    elif data.get('type') == 'stream_ack':
+                                        dispatcher.grant(data.get('id'), data.get('credits', 1))
+                                    
+                                    elif data.get('type') == 'stream_cancel':
+                                        dispatcher.cancel_stream(data.get('id'))
+                                    
+                                    elif data.get('type') == 'soul_resync':
+                                        await dispatcher.send_json(soul_scanner.snapshot())
                                     
-                                elif data.get('type') == 'ping':
-                                    await ws.send_json({'type': 'pong'})
+                                    elif data.get('type') == 'ping':
+                                        # seq — чтобы VPS сопоставил pong с ping и измерил RTT
+                                        await dispatcher.send_json({'type': 'pong', 'seq': data.get('seq'), 'io': fs_io.stats()})
+                                        
+                                except ValueError:
+                                    print(f"Invalid frame: {msg.data[:100]}")
                                     
-                            except json.JSONDecodeError:
-                                print(f"Invalid JSON: {msg.data[:100]}")
-                                
-                        elif msg.type == aiohttp.WSMsgType.ERROR:
-                            print(f"WebSocket error: {ws.exception()}")
-                            break
-                        elif msg.type == aiohttp.WSMsgType.CLOSED:
-                            print("WebSocket closed")
-                            break
+                            elif msg.type == aiohttp.WSMsgType.ERROR:
+                                print(f"WebSocket error: {ws.exception()}")
+                                break
+                            elif msg.type == aiohttp.WSMsgType.CLOSED:
+                                print("WebSocket closed")
+                                break
+                    finally:
+                        watch_task.cancel()
+                        soul_task.cancel()
+                        await dispatcher.close()
                             
         except aiohttp.ClientError as e:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] Connection error: {e}")
@@ -267,5 +1584,5 @@ async def main():
 if __name__ == '__main__':
     try:
         asyncio.run(main())
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
         print("\nStopped.")
@@ -0,0 +1,255 @@
+"""
+Pub/Sub шина для Fantasy Dashboard
+Именованные топики с фильтрами подписчиков; доставка между воркерами uvicorn — через бэкенд
+"""
+
+import asyncio
+import json
+import os
+import uuid
+from typing import Callable, Dict, Optional, Set
+
+if os.name != 'nt':
+    import fcntl
+
+TOPICS = ('chat', 'state', 'fs-changes', 'bridge-status')
+
+# Максимальный кадр между воркерами: с запасом на base64-ответ download от старого bridge (файл до 50 МБ)
+FRAME_LIMIT = int(os.getenv('PUBSUB_FRAME_LIMIT', str(96 * 1024 * 1024)))
+RECONNECT_DELAY = 0.5  # Секунд до повторного подключения к хабу
+READY_TIMEOUT = 2.0  # Секунд ждать хаб при старте воркера
+
+def match_filter(message: dict, filt: Optional[dict]) -> bool:
+    """Фильтр подписчика {поле: значение | [значения]}; строки совпадают и как префикс пути"""
+    if not filt:
+        return True
+    for key, expected in filt.items():
+        allowed = expected if isinstance(expected, list) else [expected]
+        actual = message.get(key)
+        values = actual if isinstance(actual, list) else [actual]
+        if not any(_matches(value, e) for value in values for e in allowed):
+            return False
+    return True
+
+def _matches(value, expected) -> bool:
+    if value == expected:
+        return True
+    if isinstance(value, str) and isinstance(expected, str):
+        prefix = expected.strip('/')
+        return not prefix or value.strip('/').startswith(prefix + '/')
+    return False
+
+class Subscription:
+    """Подписка: callback(message, remote) вызывается для подходящих под фильтр сообщений"""
+
+    def __init__(self, topic: str, callback: Callable, filt: Optional[dict] = None):
+        self.topic = topic
+        self.callback = callback
+        self.filter = filt
+
+class LocalBackend:
+    """Один процесс: доставлять между воркерами некуда"""
+
+    async def start(self, on_message: Callable, worker_id: str = ''):
+        pass
+
+    async def send(self, topic: str, message: dict):
+        pass
+
+    async def stop(self):
+        pass
+
+class UnixSocketBackend:
+    """Несколько воркеров: владелец файловой блокировки держит хаб на Unix-сокете, остальные подключаются к нему"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.on_message: Optional[Callable] = None
+        self.worker_id = ''
+        self.lock_file = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.peers: Set[asyncio.StreamWriter] = set()
+        self.peer_ids: Dict[str, asyncio.StreamWriter] = {}  # worker_id → соединение (для кадров с "to")
+        self.hub: Optional[asyncio.StreamWriter] = None
+        self.task: Optional[asyncio.Task] = None
+        self.ready = asyncio.Event()  # Хаб поднят или к нему есть подключение
+
+    async def start(self, on_message: Callable, worker_id: str = ''):
+        self.on_message = on_message
+        self.worker_id = worker_id
+        self.task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout=READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"[PubSub] Hub not reachable yet, continuing in background")
+
+    def _try_lock(self) -> bool:
+        """Хабом становится тот, кто взял блокировку; она снимается сама при смерти процесса"""
+        f = open(self.path + '.lock', 'a+')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self.lock_file = f
+        return True
+
+    async def _run(self):
+        while True:
+            if self._try_lock():
+                if os.path.exists(self.path):
+                    os.unlink(self.path)  # Сокет от умершего хаба
+                self.server = await asyncio.start_unix_server(self._on_peer, path=self.path, limit=FRAME_LIMIT)
+                print(f"[PubSub] Hub listening on {self.path}")
+                self.ready.set()
+                return
+
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=FRAME_LIMIT)
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+
+            # Первая строка — адрес воркера, чтобы хаб мог слать ему точечные кадры
+            writer.write(json.dumps({'hello': self.worker_id}).encode() + b'\n')
+            self.hub = writer
+            self.ready.set()
+            await self._read(reader, None)
+            self.hub = None
+            writer.close()
+            print(f"[PubSub] Hub connection lost, reconnecting")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _on_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.peers.add(writer)
+        try:
+            await self._read(reader, writer)
+        finally:
+            self.peers.discard(writer)
+            for worker_id, peer in list(self.peer_ids.items()):
+                if peer is writer:
+                    del self.peer_ids[worker_id]
+            writer.close()
+
+    async def _read(self, reader: asyncio.StreamReader, source: Optional[asyncio.StreamWriter]):
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                # Строка длиннее FRAME_LIMIT: буфер сброшен, её хвост отбросит разбор ниже
+                print(f"[PubSub] Frame over {FRAME_LIMIT} bytes dropped")
+                continue
+            except OSError:
+                return
+            if not line:
+                return
+            try:
+                frame = json.loads(line)
+                if 'hello' not in frame and not (isinstance(frame['topic'], str) and isinstance(frame['message'], dict)):
+                    raise TypeError('topic/message')
+            except (ValueError, KeyError, TypeError):
+                print(f"[PubSub] Invalid frame dropped: {line[:100]!r}")
+                continue
+            if 'hello' in frame:
+                if source is not None:
+                    self.peer_ids[frame['hello']] = source
+                continue
+            # Хаб пересылает кадр остальным воркерам (точечный — только адресату)
+            if self.server:
+                await self._write_peers(line, frame['message'], exclude=source)
+                to = frame['message'].get('to')
+                if to and to != self.worker_id:
+                    continue
+            self.on_message(frame['topic'], frame['message'])
+
+    async def _write_peers(self, line: bytes, message: dict, exclude=None):
+        to = message.get('to')
+        if to:
+            peer = self.peer_ids.get(to)
+            targets = [peer] if peer is not None else []
+        else:
+            targets = list(self.peers)
+        targets = [peer for peer in targets if peer is not exclude and not peer.is_closing()]
+        for peer in targets:
+            peer.write(line)
+        for peer in targets:
+            try:
+                await peer.drain()
+            except OSError:
+                pass
+
+    async def send(self, topic: str, message: dict):
+        """ValueError — кадр больше FRAME_LIMIT, другие воркеры его не примут"""
+        line = json.dumps({'topic': topic, 'message': message}, ensure_ascii=False).encode() + b'\n'
+        if len(line) > FRAME_LIMIT:
+            raise ValueError(f"Frame too large for the bus: {len(line)} bytes")
+        if self.server:
+            await self._write_peers(line, message)
+        elif self.hub and not self.hub.is_closing():
+            self.hub.write(line)
+            try:
+                await self.hub.drain()
+            except OSError:
+                pass
+        else:
+            print(f"[PubSub] No hub, '{topic}' delivered locally only")
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        for peer in list(self.peers):
+            peer.close()
+        if self.hub:
+            self.hub.close()
+        if self.server:
+            self.server.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self.lock_file:
+            self.lock_file.close()
+
+class PubSub:
+    """Шина событий: подписки живут в процессе, публикации расходятся по всем воркерам через бэкенд"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or LocalBackend()
+        self.worker_id = uuid.uuid4().hex[:8]  # Адрес воркера для точечных сообщений ({"to": worker_id})
+        self.subscriptions: Dict[str, Set[Subscription]] = {}
+
+    async def start(self):
+        await self.backend.start(lambda topic, message: self._deliver(topic, message, remote=True), self.worker_id)
+
+    async def stop(self):
+        await self.backend.stop()
+
+    def subscribe(self, topic: str, callback: Callable, filt: Optional[dict] = None) -> Subscription:
+        subscription = Subscription(topic, callback, filt)
+        self.subscriptions.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.get(subscription.topic, set()).discard(subscription)
+
+    async def publish(self, topic: str, message: dict, local: bool = False):
+        """Доставить подписчикам; local=True — только в этом воркере"""
+        self._deliver(topic, message, remote=False)
+        if not local:
+            await self.backend.send(topic, message)
+
+    def _deliver(self, topic: str, message: dict, remote: bool):
+        for subscription in list(self.subscriptions.get(topic, ())):
+            if not match_filter(message, subscription.filter):
+                continue
+            try:
+                subscription.callback(message, remote)
+            except Exception as e:
+                print(f"[PubSub] Subscriber error on '{topic}': {e}")
+
+def create_bus(backend: str = 'local', socket_path: str = '') -> PubSub:
+    """Шина с бэкендом local или unix (на Windows — всегда local)"""
+    if backend == 'unix':
+        if os.name == 'nt':
+            print("[PubSub] Unix socket backend is not available on Windows, using local")
+        else:
+            return PubSub(UnixSocketBackend(socket_path))
+    return PubSub(LocalBackend())
@@ -4,18 +4,50 @@ FastAPI бэкенд для Mini App с WebSocket чатом
 """
 
 import os
+import base64
+import copy
 import json
 import asyncio
+import bisect
+import functools
+import hashlib
+import heapq
+import time
+import zlib
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List, Dict
+from stat import S_ISREG
+from typing import List, Dict, Tuple, Optional, AsyncIterator, Awaitable, Callable
+from urllib.parse import quote
+from email.utils import formatdate, parsedate_to_datetime
 from datetime import datetime
 from fastapi import FastAPI, HTTPException, Header, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import httpx
 from skills_parser import parse_registry_md
+from pubsub import TOPICS, create_bus, match_filter
+from storage import JSONStore, file_lock, RevisionConflict, PatchError, REVISION_KEY, apply_json_patch, apply_merge_patch, diff_documents
+
+try:
+    import h2  # noqa: F401 — HTTP/2 для httpx, если установлен
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Необязательные кодеки протокола bridge
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # Конфигурация
 API_SECRET = os.getenv('API_SECRET', 'fantasy-secret-2026')
@@ -25,20 +57,130 @@ OWNER_CHAT_ID = os.getenv('OWNER_CHAT_ID', '')
 DATA_FILE = Path(__file__).parent / 'data.json'
 INDEX_FILE = Path(__file__).parent / 'index.html'
 VERSION_FILE = Path(__file__).parent / 'version.json'
-CHAT_FILE = Path(__file__).parent / 'chat_history.json'
+CHAT_FILE = Path(__file__).parent / 'chat_history.json'  # Старый формат, читается для миграции
+CHAT_LOG_FILE = Path(__file__).parent / 'chat_history.jsonl'
 SOUL_FILE = Path(__file__).parent / 'soul.json'
 
 # Файловый менеджер - базовая директория
 FILES_ROOT = Path(os.getenv('FILES_ROOT', 'C:/BRANDONLINE'))
 
+# История чата
+CHAT_HISTORY_SIZE = 100  # Сообщений в памяти и в файле после компакции
+CHAT_FLUSH_INTERVAL = 1.0  # Секунд между пакетными дозаписями
+CHAT_COMPACT_EVERY = 500  # Лишних строк в файле до компакции
+
+# Рассылка клиентам WebSocket
+CLIENT_QUEUE_SIZE = int(os.getenv('CLIENT_QUEUE_SIZE', '64'))  # Кадров в очереди одного клиента
+CLIENT_OVERFLOW = os.getenv('CLIENT_OVERFLOW', 'disconnect')  # disconnect | drop_oldest
+CLIENT_SEND_TIMEOUT = 10.0  # Секунд на один кадр, дольше — клиент отключается
+EPHEMERAL_TYPES = {"status"}  # Служебные кадры: не сохраняются, при переполнении выбрасываются первыми
+
+# Шина событий: для нескольких воркеров uvicorn — PUBSUB_BACKEND=unix
+PUBSUB_BACKEND = os.getenv('PUBSUB_BACKEND', 'local')  # local | unix
+PUBSUB_SOCKET = os.getenv('PUBSUB_SOCKET', '/tmp/fantasy-dashboard.sock')
+DEFAULT_TOPICS = ("chat", "fs-changes")  # Подписки нового клиента /ws/chat
+
+# Живые обновления data.json (топик "state")
+STATE_POLL_INTERVAL = 0.25  # Секунд между проверками файла (изменения от bot.py)
+
+# Постраничная выдача /api/soul
+SOUL_PAGE_LIMIT = 50
+SOUL_MAX_LIMIT = 200
+
+# Кэш листингов PC
+LISTING_CACHE_SIZE = int(os.getenv('LISTING_CACHE_SIZE', '256'))
+LISTING_FRESH_SECONDS = 5.0  # Без перепроверки отдаём из кэша
+LISTING_WATCHED_FRESH_SECONDS = 60.0  # Если bridge сам присылает изменения (fs_change)
+LISTING_PAGE_LIMIT = 200  # Элементов на страницу листинга по умолчанию
+LISTING_MAX_LIMIT = 1000
+LISTING_STREAM_PAGE = 200  # Элементов в одном запросе к PC при потоковой выдаче (NDJSON)
+LISTING_SORTS = ("name", "mtime", "size")
+SEARCH_MAX_LIMIT = 100  # Совпадений на страницу поиска
+
+# Превью файлов PC
+THUMB_CACHE_SIZE = int(os.getenv('THUMB_CACHE_SIZE', '512'))  # Превью в памяти VPS
+THUMB_FRESH_SECONDS = 300  # Без перепроверки на PC; столько же браузер держит превью (max-age)
+THUMB_FORMATS = ("jpeg", "webp")
+THUMB_SIZES = (64, 128, 256, 512, 1024)  # Как на PC: запрошенный размер округляется вверх
+
+# Несколько PC bridge: выбор по корню пути и нагрузке
+BRIDGE_LATENCY_INITIAL = 0.2  # Секунд — оценка задержки нового bridge
+BRIDGE_LATENCY_ALPHA = 0.2  # Вес нового замера в EWMA
+BRIDGE_RETRY_ACTIONS = {"list", "stat", "read", "download", "search", "thumbnail", "ping"}  # Можно повторить на другом bridge
+
+# Heartbeat и адаптивные таймауты запросов к bridge
+BRIDGE_HEARTBEAT_INTERVAL = float(os.getenv('BRIDGE_HEARTBEAT_INTERVAL', '5'))  # Секунд между ping
+BRIDGE_DEAD_AFTER = BRIDGE_HEARTBEAT_INTERVAL * 2.5  # Тишина дольше — соединение мёртвое
+RTT_WINDOW = 100  # Последних замеров для перцентилей
+BRIDGE_ACTION_TIMEOUTS = {  # Секунд, пока по действию нет замеров
+    "list": 30.0,
+    "stat": 15.0,
+    "read": 30.0,
+    "open": 15.0,
+    "download": 60.0,
+    "save_to_downloads": 30.0,
+    "search": 15.0,
+    "thumbnail": 30.0,
+}
+BRIDGE_DEFAULT_TIMEOUT = 30.0
+BRIDGE_TIMEOUT_FACTOR = 3.0  # Запас к p95 времени ответа
+BRIDGE_TIMEOUT_MIN = 5.0
+BRIDGE_TIMEOUT_SAMPLES = 20  # Замеров по действию, до которых таймаут не ниже BRIDGE_ACTION_TIMEOUTS
+BRIDGE_TIMEOUT_MAX = 120.0
+BRIDGE_THROUGHPUT_INITIAL = 1024 * 1024  # Байт/с — оценка канала до первых замеров
+
+# Сжатие кадров bridge (договариваются при авторизации; старые bridge — обычный JSON)
+BRIDGE_COMPRESSION = os.getenv('BRIDGE_COMPRESSION', '1') == '1'
+BRIDGE_ENCODING = os.getenv('BRIDGE_ENCODING', 'msgpack')  # msgpack | json
+CODEC_MARKER = 0  # Первый байт бинарного кадра-сообщения (у чанков потока там длина id, она > 0)
+CODEC_COMPRESSED = 1
+CODEC_MSGPACK = 2
+COMPRESS_MIN_SIZE = 1024  # Байт — меньшие кадры не сжимаем
+
 # Telegram API
 TELEGRAM_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
 
+# Clawdbot API через Tailscale
+CLAWDBOT_API_URL = "https://desktop-a857bb7.tail58eca6.ts.net/v1/chat/completions"
+
+# Пул исходящих HTTP-соединений
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '20'))
+HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', '10'))
+HTTP_KEEPALIVE_EXPIRY = 60.0  # Секунд держать простаивающее соединение
+TELEGRAM_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+AI_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+# Кэш ответов AI
+AI_CACHE_TTL = float(os.getenv('AI_CACHE_TTL', '300'))  # Секунд
+AI_CACHE_SIZE = int(os.getenv('AI_CACHE_SIZE', '128'))  # Ответов
+AI_COALESCE_TIMEOUT = 120.0  # Секунд ждать такой же запрос в полёте
+
+# Пул потоков для файловых операций
+FS_WORKERS = int(os.getenv('FS_WORKERS', '8'))  # Потоков
+FS_QUEUE_LIMIT = int(os.getenv('FS_QUEUE_LIMIT', '256'))  # Операций в очереди, дальше — ждут места
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск и остановка сервера"""
+    await fs_io.run(manager.history.load)
+    await bus.start()
+    await pc_bridge.discover()
+    http_clients.start()
+    state_feed.start()
+    yield
+    state_feed.stop()
+    # Дописать на диск хвост истории чата
+    await manager.history.flush()
+    await http_clients.close()
+    await bus.stop()
+    fs_io.shutdown()
+
 # Создаём приложение
 app = FastAPI(
     title="Fantasy Dashboard API",
     description="API для Telegram Mini App с Clawdbot чатом",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # CORS для Telegram
@@ -55,67 +197,342 @@ STATIC_DIR = Path(__file__).parent / 'static'
 if STATIC_DIR.exists():
     app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
+# ===== ФАЙЛОВЫЙ ВВОД-ВЫВОД =====
+
+class FsExecutor:
+    """Отдельный ограниченный пул потоков для диска: медленный диск не останавливает event loop"""
+    
+    def __init__(self, workers: int = FS_WORKERS, queue_limit: int = FS_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fs")
+        self.slots: Optional[asyncio.Semaphore] = None  # Создаётся в event loop при первом вызове
+        self.in_flight = 0  # Отправлено в пул (выполняются + ждут потока)
+        self.waiting = 0  # Ждут места в очереди
+        self.peak_depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_total = 0.0  # Суммарное ожидание потока, секунд
+    
+    @property
+    def depth(self) -> int:
+        """Операций в очереди пула (без выполняющихся)"""
+        return max(self.in_flight - self.workers, 0)
+    
+    async def run(self, func, *args):
+        """Выполнить блокирующую функцию в пуле; при переполненной очереди — дождаться места"""
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.workers + self.queue_limit)
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        
+        queued_at = time.monotonic()
+        
+        def call():
+            return time.monotonic(), func(*args)
+        
+        self.in_flight += 1
+        self.peak_depth = max(self.peak_depth, self.depth)
+        try:
+            started_at, result = await asyncio.get_running_loop().run_in_executor(self.pool, call)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.slots.release()
+        self.completed += 1
+        self.wait_total += started_at - queued_at
+        return result
+    
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": self.in_flight,
+            "queue_depth": self.depth,
+            "waiting": self.waiting,
+            "peak_queue_depth": self.peak_depth,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.wait_total / self.completed * 1000, 2) if self.completed else 0.0
+        }
+    
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+fs_io = FsExecutor()
+
 # ===== WEBSOCKET MANAGER =====
 
-class ConnectionManager:
-    """Менеджер WebSocket соединений"""
+class ChatLog:
+    """История чата: кольцевой буфер в памяти + дозапись в JSONL с периодической компакцией.
+    Счётчик id и сам файл общие для всех воркеров и меняются только под файловой блокировкой"""
     
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.chat_history: List[Dict] = []
-        self._load_history()
+    def __init__(self, path: Path = CHAT_LOG_FILE, size: int = CHAT_HISTORY_SIZE):
+        self.path = path
+        self.lock_path = path.with_name(path.name + '.lock')
+        self.seq_path = path.with_name(path.name + '.seq')  # {"last_id", "lines"}
+        self.messages: deque = deque(maxlen=size)
+        self.pending: List[Dict] = []  # Ещё не записанные на диск
+        self.flush_task: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
     
-    def _load_history(self):
-        """Загрузить историю чата"""
+    def load(self):
+        """Загрузить историю (при первом запуске — перенести из chat_history.json); вызывается при старте, в fs_io"""
         try:
-            if CHAT_FILE.exists():
-                with open(CHAT_FILE, 'r', encoding='utf-8') as f:
-                    self.chat_history = json.load(f)
-        except:
-            self.chat_history = []
+            with file_lock(self.lock_path):
+                if self.path.exists():
+                    self.messages.extend(self._read_file())
+                elif CHAT_FILE.exists():
+                    with open(CHAT_FILE, 'r', encoding='utf-8') as f:
+                        self.messages.extend(m for m in json.load(f) if m.get("type") not in EPHEMERAL_TYPES)
+                    self._append_lines(list(self.messages))
+                self._read_seq()
+        except Exception as e:
+            print(f"⚠️ Chat history load error: {e}")
     
-    def _save_history(self):
-        """Сохранить историю чата"""
+    def _read_file(self) -> List[Dict]:
+        messages = []
         try:
-            # Храним последние 100 сообщений
-            with open(CHAT_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.chat_history[-100:], f, ensure_ascii=False, indent=2)
-        except:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        messages.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue  # Оборванная последняя строка после сбоя
+        except FileNotFoundError:
             pass
+        return messages
+    
+    def _read_seq(self) -> dict:
+        """Счётчик (вызывать под блокировкой); если его нет — восстановить по файлу"""
+        try:
+            with open(self.seq_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            messages = self._read_file()
+            seq = {"last_id": max((m.get("id", 0) for m in messages), default=0), "lines": len(messages)}
+            self._write_seq(seq)
+            return seq
+    
+    def _write_seq(self, seq: dict):
+        tmp = self.seq_path.with_name(f".{self.seq_path.name}.{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(seq, f)
+        os.replace(tmp, self.seq_path)
+    
+    def _append_lines(self, batch: List[Dict]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(m, ensure_ascii=False) + '\n' for m in batch)
+    
+    def remember(self, message: dict):
+        """Сообщение из другого воркера: только в память, на диск его пишет тот воркер"""
+        self.messages.append(message)
+    
+    async def next_id(self) -> int:
+        """Следующий id — единый для всех воркеров (блокировка и файл — в потоке fs_io)"""
+        return await fs_io.run(self._next_id)
+    
+    def _next_id(self) -> int:
+        with file_lock(self.lock_path):
+            seq = self._read_seq()
+            seq["last_id"] += 1
+            self._write_seq(seq)
+        return seq["last_id"]
+    
+    def recent(self, limit: int) -> List[Dict]:
+        return list(self.messages)[-limit:]
+    
+    def append(self, message: dict):
+        """Добавить сообщение; запись на диск — пачкой, в фоне"""
+        self.messages.append(message)
+        self.pending.append(message)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        while True:
+            await asyncio.sleep(CHAT_FLUSH_INTERVAL)
+            await self.flush()
+            if not self.pending:
+                return
+    
+    async def flush(self):
+        """Дописать накопившиеся сообщения"""
+        async with self.lock:
+            batch, self.pending = self.pending, []
+            if batch:
+                await fs_io.run(self._write, batch)
+    
+    def _write(self, batch: List[Dict]):
+        """Дозапись и компакция — под той же блокировкой, что и счётчик id"""
+        try:
+            with file_lock(self.lock_path):
+                seq = self._read_seq()
+                self._append_lines(batch)
+                seq["lines"] += len(batch)
+                if seq["lines"] > self.messages.maxlen + CHAT_COMPACT_EVERY:
+                    # Хвост берём из файла, а не из буфера: там сообщения всех воркеров
+                    tail = self._read_file()[-self.messages.maxlen:]
+                    tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+                    with open(tmp, 'w', encoding='utf-8') as f:
+                        f.writelines(json.dumps(m, ensure_ascii=False) + '\n' for m in tail)
+                    os.replace(tmp, self.path)
+                    seq["lines"] = len(tail)
+                self._write_seq(seq)
+        except Exception as e:
+            print(f"⚠️ Chat history write error: {e}")
+
+class ClientConnection:
+    """Клиент WebSocket с собственной очередью отправки и задачей-писателем"""
+    
+    def __init__(self, websocket: WebSocket, on_close):
+        self.websocket = websocket
+        self.on_close = on_close
+        self.queue: deque = deque()  # (текст кадра, служебный ли)
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+        self.topics: Dict[str, Optional[dict]] = dict.fromkeys(DEFAULT_TOPICS)  # Топик → фильтр
+        self.writer = asyncio.create_task(self._writer())
+    
+    def enqueue(self, text: str, ephemeral: bool = False) -> bool:
+        """Поставить кадр в очередь; False — клиент не успевает и его нужно отключить"""
+        if self.closed:
+            return False
+        
+        if len(self.queue) >= CLIENT_QUEUE_SIZE:
+            if ephemeral:
+                self.dropped += 1
+                return True
+            # Место освобождаем в первую очередь за счёт служебных кадров
+            kept = deque(item for item in self.queue if not item[1])
+            self.dropped += len(self.queue) - len(kept)
+            self.queue = kept
+            if len(self.queue) >= CLIENT_QUEUE_SIZE:
+                if CLIENT_OVERFLOW != "drop_oldest":
+                    return False
+                self.queue.popleft()
+                self.dropped += 1
+        
+        self.queue.append((text, ephemeral))
+        self.wakeup.set()
+        return True
+    
+    async def _writer(self):
+        try:
+            while True:
+                while not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                text, _ = self.queue.popleft()
+                await asyncio.wait_for(self.websocket.send_text(text), timeout=CLIENT_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass  # Клиент отвалился или завис на отправке
+        finally:
+            if not self.closed:
+                # Писатель упал сам (а не отменён через close/disconnect) — сокет тоже закрываем
+                asyncio.create_task(self.close(code=1011, reason="Send failed"))
+            self.closed = True
+            self.on_close(self.websocket)
+    
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = True
+        self.writer.cancel()
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+def encode_frame(message: dict) -> str:
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+bus = create_bus(PUBSUB_BACKEND, PUBSUB_SOCKET)
+
+class ConnectionManager:
+    """Менеджер WebSocket соединений"""
+    
+    def __init__(self):
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        self.history = ChatLog()
+        for topic in TOPICS:
+            bus.subscribe(topic, lambda message, remote, topic=topic: self._fanout(topic, message, remote))
     
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections[websocket] = ClientConnection(websocket, self.disconnect)
         # Отправляем историю при подключении
-        if self.chat_history:
-            await websocket.send_json({
+        if self.history.messages:
+            self.send(websocket, {
                 "type": "history",
-                "messages": self.chat_history[-50:]  # Последние 50 сообщений
+                "messages": self.history.recent(50)  # Последние 50 сообщений
             })
     
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        client = self.active_connections.pop(websocket, None)
+        if client and not client.closed:
+            client.closed = True
+            client.writer.cancel()
+    
+    def send(self, websocket: WebSocket, message: dict):
+        """Отправить одному клиенту (через его очередь)"""
+        client = self.active_connections.get(websocket)
+        if client and not client.enqueue(encode_frame(message), message.get("type") in EPHEMERAL_TYPES):
+            self._drop_laggard(client)
+    
+    def subscribe(self, websocket: WebSocket, topics: List[str], filt: Optional[dict] = None):
+        """Подписать клиента на топики; filt — {поле: значение}, например {"paths": ["Загрузки"]}"""
+        client = self.active_connections.get(websocket)
+        if client:
+            for topic in topics:
+                if topic in TOPICS:
+                    client.topics[topic] = filt
+    
+    def unsubscribe(self, websocket: WebSocket, topics: List[str]):
+        client = self.active_connections.get(websocket)
+        if client:
+            for topic in topics:
+                client.topics.pop(topic, None)
+    
+    def _drop_laggard(self, client: ClientConnection):
+        self.active_connections.pop(client.websocket, None)
+        asyncio.create_task(client.close(code=1013, reason="Client too slow"))
     
     async def broadcast(self, message: dict):
-        """Отправить сообщение всем подключенным клиентам"""
-        self.chat_history.append(message)
-        self._save_history()
-        
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                disconnected.append(connection)
+        """Отправить сообщение всем подключенным клиентам и сохранить в историю"""
+        self.history.append(message)
+        await bus.publish("chat", message)
+    
+    async def notify(self, message: dict, topic: str = "chat"):
+        """Служебное событие подписчикам топика (без записи в историю)"""
+        await bus.publish(topic, message)
+    
+    def _fanout(self, topic: str, message: dict, remote: bool):
+        """Доставка из шины клиентам этого воркера"""
+        if remote and topic == "chat" and "role" in message:
+            self.history.remember(message)
         
-        for conn in disconnected:
-            self.disconnect(conn)
+        # Сериализуем один раз на всю рассылку
+        text = None
+        ephemeral = message.get("type") in EPHEMERAL_TYPES
+        for client in list(self.active_connections.values()):
+            if topic not in client.topics or not match_filter(message, client.topics[topic]):
+                continue
+            if text is None:
+                text = encode_frame(message)
+            if not client.enqueue(text, ephemeral):
+                self._drop_laggard(client)
     
-    def add_message(self, role: str, content: str, metadata: dict = None):
+    async def add_message(self, role: str, content: str, metadata: dict = None):
         """Добавить сообщение в историю"""
         msg = {
-            "id": len(self.chat_history) + 1,
+            "id": await self.history.next_id(),
             "role": role,  # "user" или "assistant"
             "content": content,
             "timestamp": datetime.now().isoformat(),
@@ -127,6 +544,31 @@ manager = ConnectionManager()
 
 # ===== УТИЛИТЫ =====
 
+class HttpClients:
+    """Общие httpx-клиенты на всё приложение: keep-alive и свои таймауты на каждый upstream"""
+    
+    def __init__(self):
+        self.telegram: Optional[httpx.AsyncClient] = None
+        self.ai: Optional[httpx.AsyncClient] = None
+    
+    def start(self):
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+        self.telegram = httpx.AsyncClient(
+            base_url=TELEGRAM_API, timeout=TELEGRAM_TIMEOUT, limits=limits, http2=HTTP2_AVAILABLE
+        )
+        self.ai = httpx.AsyncClient(timeout=AI_TIMEOUT, limits=limits, http2=HTTP2_AVAILABLE)
+    
+    async def close(self):
+        for client in (self.telegram, self.ai):
+            if client is not None:
+                await client.aclose()
+
+http_clients = HttpClients()
+
 async def send_to_telegram(text: str):
     """Отправить сообщение в Telegram чат владельца"""
     if not BOT_TOKEN or not OWNER_CHAT_ID:
@@ -134,33 +576,198 @@ async def send_to_telegram(text: str):
         return False
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{TELEGRAM_API}/sendMessage",
-                json={
-                    "chat_id": OWNER_CHAT_ID,
-                    "text": f"🎮 [MiniApp]\n{text}",
-                    "parse_mode": "HTML"
-                },
-                timeout=10
-            )
-            return response.status_code == 200
+        response = await http_clients.telegram.post(
+            "/sendMessage",
+            json={
+                "chat_id": OWNER_CHAT_ID,
+                "text": f"🎮 [MiniApp]\n{text}",
+                "parse_mode": "HTML"
+            }
+        )
+        return response.status_code == 200
     except Exception as e:
         print(f"❌ Telegram send error: {e}")
         return False
 
-def load_data() -> dict:
-    """Загрузить данные из JSON"""
+def content_disposition(filename: str) -> str:
+    """Content-Disposition с поддержкой кириллицы (RFC 5987)"""
+    return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+def file_validators(size: int, mtime: float) -> Tuple[str, str]:
+    """ETag и Last-Modified по размеру и времени изменения файла"""
+    etag = f'"{int(mtime * 1000):x}-{size:x}"'
+    return etag, formatdate(mtime, usegmt=True)
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Совпадает ли If-None-Match с текущим ETag"""
+    tags = [t.strip() for t in request.headers.get("if-none-match", "").split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Проверка If-None-Match / If-Modified-Since"""
+    if request.headers.get("if-none-match"):
+        return etag_matches(request, etag)
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def parse_range(request: Request, size: int, etag: str, last_modified: str) -> Optional[Tuple[int, int]]:
+    """Диапазон из заголовка Range: (start, end) включительно или None — отдать целиком"""
+    header = request.headers.get("range", "")
+    if not header.startswith("bytes=") or "," in header:
+        return None  # Несколько диапазонов не поддерживаем — отдаём файл целиком
+    
+    # If-Range: докачка только если файл не изменился
+    if_range = request.headers.get("if-range")
+    if if_range and if_range not in (etag, last_modified):
+        return None
+    
+    start_s, _, end_s = header[6:].strip().partition("-")
     try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
+        if not start_s:
+            start, end = max(size - int(end_s), 0), size - 1  # bytes=-N: последние N байт
+        else:
+            start = int(start_s)
+            end = min(int(end_s), size - 1) if end_s else size - 1
+    except ValueError:
+        return None
+    
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+def download_headers(filename: str, size: int, etag: str, last_modified: str,
+                     byte_range: Optional[Tuple[int, int]]) -> dict:
+    """Заголовки ответа на скачивание (полное или 206)"""
+    headers = {
+        "Content-Disposition": content_disposition(filename),
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Content-Length": str(size)
+    }
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+    return headers
+
+def iter_file(path: Path, start: int, length: int, chunk_size: int = 256 * 1024):
+    """Читать файл кусками (синхронный генератор — Starlette гоняет его в threadpool)"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+# Общее хранилище с bot.py: кэш в памяти, атомарная запись, блокировка между процессами
+data_store = JSONStore(DATA_FILE, default=dict)
+
+def load_data() -> dict:
+    """Загрузить данные (из памяти, диск — только если файл изменился)"""
+    if not DATA_FILE.exists():
         return {"error": "Data file not found"}
+    return data_store.read()
+
+def save_data(data: dict) -> int:
+    """Сохранить данные, вернуть новую ревизию"""
+    return data_store.write(data)
+
+def modify_data(mutate, expected_revision: int = None) -> Tuple[int, int, list]:
+    """Изменить данные под блокировкой; вернуть (старая ревизия, новая ревизия, diff)"""
+    with data_store.transaction(expected_revision) as data:
+        before = copy.deepcopy(data)
+        mutate(data)
+    ops = [op for op in diff_documents(before, data) if op["path"] != f"/{REVISION_KEY}"]
+    return before.get(REVISION_KEY, 0), data.get(REVISION_KEY, 0), ops
+
+def replace_document(data: dict, new_data: dict):
+    data.clear()
+    data.update(new_data)
+
+def parse_if_match(value: Optional[str]) -> Optional[int]:
+    """If-Match: "<ревизия>" → номер ревизии (None — без условия)"""
+    if not value or value.strip() == "*":
+        return None
+    tag = value.split(",")[0].strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid If-Match")
+
+class StateFeed:
+    """Версионированные изменения data.json для подписчиков топика "state" — от API, бота или правки руками"""
+    
+    def __init__(self):
+        self.data: Optional[dict] = None
+        self.revision = 0
+        self.fingerprint = None
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+    
+    def _read(self):
+        if not DATA_FILE.exists():
+            return None, None
+        fingerprint = data_store.fingerprint
+        if fingerprint == self.fingerprint:
+            return fingerprint, None
+        return fingerprint, data_store.read()
+    
+    async def sync(self):
+        """Сравнить с файлом и разослать diff, если документ изменился"""
+        async with self.lock:
+            fingerprint, data = await fs_io.run(self._read)
+            if data is None:
+                return
+            self.fingerprint = fingerprint
+            base, old = self.revision, self.data
+            self.data, self.revision = data, data.get(REVISION_KEY, 0)
+            if old is None:
+                return
+            ops = [op for op in diff_documents(old, data) if op["path"] != f"/{REVISION_KEY}"]
+            if ops:
+                # Каждый воркер следит за файлом сам, поэтому рассылает только своим клиентам
+                await bus.publish("state", {
+                    "type": "data_patch",
+                    "topic": "state",
+                    "base": base,
+                    "revision": self.revision,
+                    "patch": ops
+                }, local=True)
+    
+    def snapshot(self) -> dict:
+        return {"type": "state_snapshot", "topic": "state", "revision": self.revision, "data": self.data}
+    
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"⚠️ State feed error: {e}")
+            await asyncio.sleep(STATE_POLL_INTERVAL)
+    
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+    
+    def stop(self):
+        if self.task:
+            self.task.cancel()
 
-def save_data(data: dict):
-    """Сохранить данные в JSON"""
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+state_feed = StateFeed()
 
 # ===== ЭНДПОИНТЫ =====
 
@@ -242,8 +849,9 @@ async def dashboard():
 @app.get("/api/data")
 async def get_data():
     """Получить данные персонажа"""
-    data = load_data()
-    return JSONResponse(content=data)
+    data = await fs_io.run(load_data)
+    headers = None if "error" in data else {"ETag": f'"{data.get(REVISION_KEY, 0)}"'}
+    return JSONResponse(content=data, headers=headers)
 
 @app.post("/api/data")
 async def update_data(request: Request, authorization: str = Header(None)):
@@ -253,10 +861,50 @@ async def update_data(request: Request, authorization: str = Header(None)):
     
     try:
         new_data = await request.json()
-        save_data(new_data)
-        return {"status": "ok", "message": "Data updated"}
+        if not isinstance(new_data, dict):
+            raise ValueError("Document must be a JSON object")
+        base, revision, ops = await fs_io.run(
+            modify_data, lambda data: replace_document(data, new_data)
+        )
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    
+    await state_feed.sync()
+    return {"status": "ok", "message": "Data updated", "revision": revision}
+
+@app.patch("/api/data")
+async def patch_data(request: Request, authorization: str = Header(None), if_match: str = Header(None)):
+    """Частичное обновление: JSON Patch (RFC 6902) или Merge Patch (RFC 7396)"""
+    if authorization != f"Bearer {API_SECRET}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    expected = parse_if_match(if_match)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    try:
+        patch = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    
+    # Тип патча — по Content-Type, для application/json — по форме тела
+    if content_type == "application/json-patch+json" or (content_type != "application/merge-patch+json" and isinstance(patch, list)):
+        mutate = lambda data: apply_json_patch(data, patch)
+    elif isinstance(patch, dict):
+        mutate = lambda data: apply_merge_patch(data, patch)
+    else:
+        raise HTTPException(status_code=400, detail="Merge patch must be a JSON object")
+    
+    try:
+        base, revision, ops = await fs_io.run(modify_data, mutate, expected)
+    except RevisionConflict as e:
+        raise HTTPException(status_code=412, detail=str(e), headers={"ETag": f'"{e.current}"'})
+    except PatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    await state_feed.sync()
+    return JSONResponse(
+        content={"status": "ok", "revision": revision, "patch": ops},
+        headers={"ETag": f'"{revision}"'}
+    )
 
 @app.get("/api/health")
 async def health():
@@ -265,7 +913,9 @@ async def health():
         "status": "ok", 
         "service": "Fantasy Dashboard",
         "version": "2.0.0",
-        "connections": len(manager.active_connections)
+        "connections": len(manager.active_connections),
+        "ai_cache": ai_cache.stats(),
+        "fs_io": fs_io.stats()
     }
 
 @app.get("/api/version")
@@ -345,9 +995,8 @@ async def health_full():
     # 3. Проверка data.json
     try:
         if DATA_FILE.exists():
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            results["checks"]["data_file"] = {"status": "ok", "records": len(data.get("cards", []))}
+            data = await fs_io.run(data_store.read)
+            results["checks"]["data_file"] = {"status": "ok", "records": len(data.get("cards", [])), "revision": data_store.revision}
             results["summary"]["passed"] += 1
         else:
             results["checks"]["data_file"] = {"status": "error", "message": "File not found"}
@@ -400,7 +1049,20 @@ async def health_full():
         results["checks"]["ai_status"] = {"status": "error", "message": str(e)}
         results["summary"]["failed"] += 1
     
-    # 7. Response time (self-check)
+    # 7. AI cache
+    results["checks"]["ai_cache"] = {"status": "ok", **ai_cache.stats()}
+    results["summary"]["passed"] += 1
+    
+    # 8. Пул файловых операций
+    fs_stats = fs_io.stats()
+    fs_busy = fs_stats["waiting"] > 0
+    results["checks"]["fs_io"] = {"status": "warning" if fs_busy else "ok", **fs_stats}
+    if fs_busy:
+        results["summary"]["warnings"] += 1
+    else:
+        results["summary"]["passed"] += 1
+    
+    # 9. Response time (self-check)
     start = time.time()
     # Simple operation to measure
     _ = list(range(1000))
@@ -424,23 +1086,191 @@ async def health_full():
     
     return results
 
+# ===== ДУША (папка клиентов) =====
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class SoulIndex:
+    """Поиск по снимку: отсортированные имена для префикса и триграммы по именам клиентов и подпапок"""
+    
+    def __init__(self, items: List[dict]):
+        self.texts = []  # Имя клиента и имена вложенных, в нижнем регистре
+        self.modified = []  # Самое свежее изменение внутри клиента
+        self.trigrams: Dict[str, set] = defaultdict(set)
+        
+        for i, item in enumerate(items):
+            children = item.get("children", [])
+            text = "\n".join([item["name"]] + [c["name"] for c in children]).lower()
+            self.texts.append(text)
+            self.modified.append(max([item.get("modified") or ""] + [c.get("modified") or "" for c in children]))
+            for tri in trigrams(text):
+                self.trigrams[tri].add(i)
+        
+        self.names = sorted((item["name"].lower(), i) for i, item in enumerate(items))
+        self.name_keys = [name for name, _ in self.names]
+    
+    def search(self, q: str = "", prefix: str = "", modified_since: str = "") -> List[int]:
+        """Индексы подходящих клиентов в порядке снимка"""
+        candidates = range(len(self.texts))
+        
+        if prefix:
+            prefix = prefix.lower()
+            lo = bisect.bisect_left(self.name_keys, prefix)
+            hi = bisect.bisect_left(self.name_keys, prefix + "\uffff")
+            candidates = sorted(i for _, i in self.names[lo:hi])
+        
+        if q:
+            q = q.lower()
+            if len(q) >= 3:
+                # Кандидаты — пересечение триграмм, затем точная проверка подстроки
+                sets = sorted((self.trigrams.get(tri, set()) for tri in trigrams(q)), key=len)
+                hits = set.intersection(*sets)
+                candidates = [i for i in candidates if i in hits and q in self.texts[i]]
+            else:
+                candidates = [i for i in candidates if q in self.texts[i]]
+        
+        if modified_since:
+            candidates = [i for i in candidates if self.modified[i] >= modified_since]
+        
+        return list(candidates)
+
+class SoulStore:
+    """Снимок папки клиентов в памяти: дельты от PC, ETag, сохранение в soul.json"""
+    
+    def __init__(self, path: Path = SOUL_FILE):
+        self.path = path
+        self.meta: dict = {}
+        self.items: Dict[str, dict] = {}
+        self.version = 0  # Версия снимка на стороне PC
+        self.snapshot: Optional[dict] = None
+        self.body: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        self.file_mtime: Optional[float] = None
+        self.index: Optional[SoulIndex] = None
+        self.save_lock = asyncio.Lock()
+    
+    def _read_file(self) -> Optional[Tuple[float, dict]]:
+        """(mtime, данные) soul.json, если его обновили снаружи (в потоке)"""
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+        if mtime == self.file_mtime:
+            return None
+        
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return mtime, json.load(f)
+    
+    async def load_file(self):
+        """Подхватить soul.json с диска, если его обновили снаружи"""
+        loaded = await fs_io.run(self._read_file)
+        if loaded is None:
+            return
+        self.file_mtime, data = loaded
+        self.meta = {k: v for k, v in data.items() if k != "items"}
+        self.items = {item["name"]: item for item in data.get("items", [])}
+        self._render()
+    
+    def _render(self):
+        """Пересобрать ответ и ETag (один раз на изменение, а не на каждый запрос)"""
+        items = sorted(self.items.values(), key=lambda i: (i["type"] != "folder", i["name"].lower()))
+        self.snapshot = {**self.meta, "total_clients": len(items), "items": items}
+        self.body = json.dumps(self.snapshot, ensure_ascii=False).encode('utf-8')
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()[:16]}"'
+        self.index = SoulIndex(items)
+    
+    def apply_snapshot(self, data: dict):
+        """Полный снимок от PC (при подключении или по soul_resync)"""
+        self.meta = {
+            "source": data.get("source"),
+            "scanned_at": data.get("scanned_at"),
+            "depth": data.get("depth", 2)
+        }
+        self.items = {item["name"]: item for item in data.get("items", [])}
+        self.version = data.get("version", 0)
+        self._render()
+        self.save_later()
+    
+    def apply_delta(self, data: dict) -> bool:
+        """Применить дельту; False — версии разошлись, нужен полный снимок"""
+        if self.snapshot is None or data.get("base") != self.version:
+            return False
+        
+        for item in data.get("upsert", []):
+            self.items[item["name"]] = item
+        for name in data.get("remove", []):
+            self.items.pop(name, None)
+        self.meta["scanned_at"] = data.get("scanned_at")
+        self.version = data["version"]
+        self._render()
+        self.save_later()
+        return True
+    
+    def save_later(self):
+        asyncio.create_task(self._save())
+    
+    async def _save(self):
+        async with self.save_lock:
+            await fs_io.run(self._write, self.snapshot)
+    
+    def _write(self, snapshot: dict):
+        tmp = self.path.with_suffix('.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+        self.file_mtime = self.path.stat().st_mtime
+
+soul_store = SoulStore()
+
 @app.get("/api/soul")
-async def get_soul():
-    """Получить данные вкладки Душа (папка клиентов)"""
+async def get_soul(request: Request, offset: int = 0, limit: Optional[int] = None,
+                   q: str = "", prefix: str = "", modified_since: str = ""):
+    """Получить данные вкладки Душа (папка клиентов); с параметрами — страница и поиск"""
     try:
-        if SOUL_FILE.exists():
-            with open(SOUL_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            return {
-                "error": "Soul data not synced yet",
-                "items": []
-            }
+        await soul_store.load_file()
     except Exception as e:
         return {
             "error": str(e),
             "items": []
         }
+    
+    if soul_store.body is None:
+        return {
+            "error": "Soul data not synced yet",
+            "items": []
+        }
+    
+    paged = limit is not None or offset or q or prefix or modified_since
+    etag = soul_store.etag
+    if paged:
+        # Страница зависит и от снимка, и от параметров запроса
+        etag = f'{etag[:-1]}-{hashlib.sha1(request.url.query.encode()).hexdigest()[:8]}"'
+    
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    if not paged:
+        return Response(content=soul_store.body, media_type="application/json", headers=headers)
+    
+    matches = soul_store.index.search(q, prefix, modified_since)
+    offset = max(offset, 0)
+    limit = max(1, min(limit or SOUL_PAGE_LIMIT, SOUL_MAX_LIMIT))
+    items = soul_store.snapshot["items"]
+    
+    return JSONResponse(
+        content={
+            "source": soul_store.meta.get("source"),
+            "scanned_at": soul_store.meta.get("scanned_at"),
+            "total_clients": len(items),
+            "total": len(matches),
+            "offset": offset,
+            "limit": limit,
+            "items": [items[i] for i in matches[offset:offset + limit]]
+        },
+        headers=headers
+    )
 
 # AI Status tracking
 AI_STATUS_FILE = Path(__file__).parent / 'ai_status.json'
@@ -482,21 +1312,264 @@ async def ai_ping():
     except Exception as e:
         return {"status": "error", "error": str(e)}
 
-# Clawdbot API через Tailscale
-CLAWDBOT_API_URL = "https://desktop-a857bb7.tail58eca6.ts.net/v1/chat/completions"
+class AiResponseCache:
+    """Кэш ответов AI по хэшу запроса (TTL + LRU) и склейка одинаковых запросов в полёте"""
+    
+    def __init__(self, ttl: float = AI_CACHE_TTL, max_entries: int = AI_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[float, float, dict]]" = OrderedDict()  # expires, latency, ответ
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+        self.saved_seconds = 0.0
+    
+    @staticmethod
+    def key(data: dict) -> str:
+        """Канонический хэш: модель, сообщения и параметры генерации (stream не влияет)"""
+        payload = {k: v for k, v in data.items() if k != "stream"}
+        canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def cacheable(result: Optional[dict]) -> bool:
+        try:
+            return not result.get("error") and isinstance(result["choices"][0]["message"]["content"], str)
+        except (AttributeError, KeyError, IndexError, TypeError):
+            return False
+    
+    async def lookup(self, key: str) -> Tuple[Optional[dict], str]:
+        """(ответ, 'hit' | 'coalesced') или (None, 'miss') — тогда идти в upstream через begin()"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, latency, result = entry
+            if expires > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += latency
+                return result, "hit"
+            del self.entries[key]
+        
+        future = self.inflight.get(key)
+        if future is not None:
+            # Такой же запрос уже в пути — ждём его результат
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), timeout=AI_COALESCE_TIMEOUT)
+            except asyncio.TimeoutError:
+                result = None
+            if result is not None:
+                self.coalesced += 1
+                return result, "coalesced"
+        
+        self.misses += 1
+        return None, "miss"
+    
+    def begin(self, key: str):
+        if key not in self.inflight:
+            self.inflight[key] = asyncio.get_running_loop().create_future()
+    
+    def complete(self, key: str, result: Optional[dict], latency: float):
+        """Завершить запрос: None — неудача, ожидающие пойдут в upstream сами"""
+        if self.cacheable(result):
+            self.entries[key] = (time.monotonic() + self.ttl, latency, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            result = None
+        
+        future = self.inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 1)
+        }
+
+ai_cache = AiResponseCache()
+
+def ai_cache_bypassed(request: Request) -> bool:
+    """Отказ от кэша: X-AI-Cache: bypass или Cache-Control: no-cache / no-store"""
+    cache_control = request.headers.get("cache-control", "").lower()
+    return (request.headers.get("x-ai-cache", "").lower() == "bypass"
+            or "no-cache" in cache_control or "no-store" in cache_control)
+
+def completion_to_sse(result: dict) -> bytes:
+    """Готовый ответ из кэша в виде SSE-потока из одного чанка"""
+    choice = result["choices"][0]
+    chunk = {
+        "id": result.get("id"),
+        "object": "chat.completion.chunk",
+        "model": result.get("model"),
+        "choices": [{
+            "index": 0,
+            "delta": {"role": "assistant", "content": choice["message"]["content"]},
+            "finish_reason": choice.get("finish_reason", "stop")
+        }]
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\ndata: [DONE]\n\n".encode('utf-8')
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse с on_close, который вызывается всегда: и если клиент ушёл до начала тела"""
+    
+    def __init__(self, *args, on_close: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.on_close()
+
+async def ai_chat_stream(request: Request, data: dict, key: Optional[str]):
+    """Проксировать SSE-ответ AI без буферизации; ушёл клиент — обрываем upstream"""
+    started = time.monotonic()
+    try:
+        upstream = await http_clients.ai.send(
+            http_clients.ai.build_request(
+                "POST",
+                CLAWDBOT_API_URL,
+                json=data,
+                headers={"Content-Type": "application/json", "Accept": "text/event-stream"}
+            ),
+            stream=True
+        )
+    except Exception:
+        if key:
+            ai_cache.complete(key, None, 0)
+        raise
+    
+    if "text/event-stream" not in upstream.headers.get("content-type", ""):
+        # Upstream ответил обычным JSON (ошибка или без поддержки stream)
+        body = await upstream.aread()
+        await upstream.aclose()
+        try:
+            result = json.loads(body)
+        except ValueError:
+            result = {"error": {"message": f"AI ответил {upstream.status_code}", "type": "upstream_error"}}
+        if key:
+            ai_cache.complete(key, result, time.monotonic() - started)
+        return JSONResponse(
+            content=result,
+            status_code=upstream.status_code,
+            headers={"X-AI-Cache": "miss" if key else "bypass"}
+        )
+    
+    released = False
+    
+    async def release(result: Optional[dict] = None):
+        """Закрыть upstream и снять запрос из inflight (один раз; без результата — неудача)"""
+        nonlocal released
+        if released:
+            return
+        released = True
+        await upstream.aclose()
+        if key:
+            ai_cache.complete(key, result, time.monotonic() - started)
+    
+    async def relay():
+        # Попутно собираем полный ответ для кэша
+        buffer = ""
+        parts = []
+        meta = {}
+        finished = False
+        try:
+            async for chunk in upstream.aiter_raw():
+                if await request.is_disconnected():
+                    return
+                yield chunk
+                if not key:
+                    continue
+                buffer += chunk.decode('utf-8', errors='replace')
+                *lines, buffer = buffer.split("\n")
+                for line in lines:
+                    payload = line[5:].strip() if line.startswith("data:") else ""
+                    if payload == "[DONE]":
+                        finished = True
+                    elif payload:
+                        try:
+                            event = json.loads(payload)
+                        except ValueError:
+                            continue
+                        meta.setdefault("id", event.get("id"))
+                        meta.setdefault("model", event.get("model"))
+                        for choice in event.get("choices", []):
+                            parts.append(choice.get("delta", {}).get("content") or "")
+                            if choice.get("finish_reason"):
+                                meta["finish_reason"] = choice["finish_reason"]
+            finished = True
+        finally:
+            result = None
+            if key and finished:
+                result = {
+                    "id": meta.get("id"),
+                    "object": "chat.completion",
+                    "model": meta.get("model"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(parts)},
+                        "finish_reason": meta.get("finish_reason", "stop")
+                    }]
+                }
+            await release(result)
+    
+    # Генератор может не запуститься вовсе (клиент ушёл раньше) — тогда освобождает on_close
+    return ClosingStreamingResponse(
+        relay(),
+        on_close=release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-AI-Cache": "miss" if key else "bypass"}
+    )
 
 @app.post("/api/ai/chat")
 async def ai_chat(request: Request):
-    """Прокси для Clawdbot API (через Tailscale)"""
+    """Прокси для Clawdbot API (через Tailscale); stream: true — ответ по токенам (SSE)"""
     try:
         data = await request.json()
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
+        
+        key = None
+        if ai_cache_bypassed(request):
+            ai_cache.bypassed += 1
+        else:
+            key = ai_cache.key(data)
+            cached, status = await ai_cache.lookup(key)
+            if cached is not None:
+                if data.get("stream"):
+                    return Response(
+                        content=completion_to_sse(cached),
+                        media_type="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-AI-Cache": status}
+                    )
+                return JSONResponse(content=cached, headers={"X-AI-Cache": status})
+            ai_cache.begin(key)
+        
+        if data.get("stream"):
+            return await ai_chat_stream(request, data, key)
+        
+        started = time.monotonic()
+        result = None
+        try:
+            response = await http_clients.ai.post(
                 CLAWDBOT_API_URL,
                 json=data,
                 headers={"Content-Type": "application/json"}
             )
-            return response.json()
+            result = response.json()
+        finally:
+            if key:
+                ai_cache.complete(key, result, time.monotonic() - started)
+        return JSONResponse(content=result, headers={"X-AI-Cache": "miss" if key else "bypass"})
     except httpx.TimeoutException:
         return {"error": {"message": "AI не отвечает (timeout)", "type": "timeout"}}
     except httpx.ConnectError:
@@ -507,7 +1580,7 @@ async def ai_chat(request: Request):
 @app.get("/api/chat/history")
 async def get_chat_history(limit: int = 50):
     """Получить историю чата"""
-    return {"messages": manager.chat_history[-limit:]}
+    return {"messages": manager.history.recent(limit)}
 
 # ===== WEBSOCKET =====
 
@@ -525,7 +1598,7 @@ async def websocket_chat(websocket: WebSocket):
                 content = data.get("content", "")
                 
                 # Сообщение от пользователя
-                user_msg = manager.add_message(
+                user_msg = await manager.add_message(
                     role="user",
                     content=content,
                     metadata={"source": "miniapp"}
@@ -535,14 +1608,26 @@ async def websocket_chat(websocket: WebSocket):
                 # Отправляем в Telegram → Clawdbot
                 await send_to_telegram(content)
                 
-                # Отправляем статус "typing"
-                await manager.broadcast({
+                # Отправляем статус "typing" (не сохраняется в историю)
+                await manager.notify({
                     "type": "status",
                     "status": "typing"
                 })
             
+            elif data.get("type") == "subscribe":
+                topics = [t for t in data.get("topics", []) if isinstance(t, str)]
+                filt = data.get("filter") if isinstance(data.get("filter"), dict) else None
+                manager.subscribe(websocket, topics, filt)
+                if "state" in topics:
+                    # Сначала полный документ, дальше — только diff
+                    await state_feed.sync()
+                    manager.send(websocket, state_feed.snapshot())
+            
+            elif data.get("type") == "unsubscribe":
+                manager.unsubscribe(websocket, data.get("topics", []))
+            
             elif data.get("type") == "ping":
-                await websocket.send_json({"type": "pong"})
+                manager.send(websocket, {"type": "pong"})
     
     except WebSocketDisconnect:
         manager.disconnect(websocket)
@@ -556,7 +1641,7 @@ async def post_message(request: Request):
         content = data.get("content", "")
         metadata = data.get("metadata", {})
         
-        msg = manager.add_message(role, content, metadata)
+        msg = await manager.add_message(role, content, metadata)
         await manager.broadcast(msg)
         
         return {"status": "ok", "message_id": msg["id"]}
@@ -568,7 +1653,7 @@ async def post_status(request: Request):
     """Обновить статус (typing, online, etc)"""
     try:
         data = await request.json()
-        await manager.broadcast({
+        await manager.notify({
             "type": "status",
             "status": data.get("status", "online")
         })
@@ -578,73 +1663,792 @@ async def post_status(request: Request):
 
 # ===== PC BRIDGE =====
 
+# Ошибки библиотек сжатия и MessagePack на битом кадре — FrameCodec.decode отдаёт их как ValueError
+CODEC_ERRORS = (
+    (zlib.error, IndexError, TypeError)
+    + ((zstandard.ZstdError,) if zstandard else ())
+    + ((msgpack.UnpackException,) if msgpack else ())
+)
+
+class FrameCodec:
+    """Кадры bridge: JSON или MessagePack, большие — сжатые zstd/zlib; бинарный кадр = [0][флаги][тело]"""
+    
+    def __init__(self, compression: Optional[str] = None, encoding: str = "json"):
+        self.compression = compression
+        self.encoding = encoding
+        if compression == "zstd":
+            self._compress = zstandard.ZstdCompressor(level=3).compress
+            self._decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            self._compress, self._decompress = zlib.compress, zlib.decompress
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+    
+    @property
+    def name(self) -> str:
+        return "+".join(filter(None, [self.compression, self.encoding]))
+    
+    def encode(self, message: dict):
+        """str — обычный текстовый кадр, bytes — кодированный"""
+        flags = 0
+        if self.encoding == "msgpack":
+            body = msgpack.packb(message, use_bin_type=True)
+            flags |= CODEC_MSGPACK
+        else:
+            body = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode()
+        self.raw_bytes += len(body)
+        if self.compression and len(body) >= COMPRESS_MIN_SIZE:
+            packed = self._compress(body)
+            if len(packed) < len(body):
+                body, flags = packed, flags | CODEC_COMPRESSED
+        self.wire_bytes += len(body)
+        if not flags:
+            return body.decode()
+        return bytes((CODEC_MARKER, flags)) + body
+    
+    def decode(self, frame: bytes) -> dict:
+        """ValueError — кадр битый"""
+        try:
+            flags, body = frame[1], frame[2:]
+            self.wire_bytes += len(body)
+            if flags & CODEC_COMPRESSED:
+                body = self._decompress(body)
+            self.raw_bytes += len(body)
+            if flags & CODEC_MSGPACK:
+                message = msgpack.unpackb(body, raw=False)
+            else:
+                message = json.loads(body)
+        except CODEC_ERRORS as e:
+            raise ValueError(f"Invalid frame: {e}") from e
+        if not isinstance(message, dict):
+            raise ValueError("Invalid frame: not an object")
+        return message
+    
+    def count_plain(self, size: int):
+        """Обычный текстовый кадр от bridge — в статистику как есть"""
+        self.raw_bytes += size
+        self.wire_bytes += size
+    
+    def stats(self) -> dict:
+        return {
+            "codec": self.name,
+            "raw_bytes": self.raw_bytes,
+            "wire_bytes": self.wire_bytes,
+            "ratio": round(self.wire_bytes / self.raw_bytes, 4) if self.raw_bytes else None
+        }
+
+def negotiate_codec(offer: Optional[dict]) -> FrameCodec:
+    """Выбрать сжатие и кодировку из предложенных bridge (ничего не предложил — старый bridge, JSON)"""
+    if not offer:
+        return FrameCodec()
+    compression = None
+    if BRIDGE_COMPRESSION:
+        supported = {"zlib"} | ({"zstd"} if zstandard else set())
+        compression = next((c for c in offer.get("compression", []) if c in supported), None)
+    encoding = "json"
+    if BRIDGE_ENCODING == "msgpack" and msgpack and "msgpack" in offer.get("encoding", []):
+        encoding = "msgpack"
+    return FrameCodec(compression, encoding)
+
+class RttEstimator:
+    """Время ответа: сглаженное среднее и разброс (как RTO в TCP) + перцентили по последним замерам"""
+    
+    def __init__(self, window: int = RTT_WINDOW):
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.samples: deque = deque(maxlen=window)
+    
+    def add(self, seconds: float):
+        if self.srtt is None:
+            self.srtt, self.rttvar = seconds, seconds / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - seconds)
+            self.srtt = 0.875 * self.srtt + 0.125 * seconds
+        self.samples.append(seconds)
+    
+    @property
+    def rto(self) -> float:
+        return self.srtt + 4 * self.rttvar if self.srtt is not None else 0.0
+    
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+    
+    def summary(self) -> dict:
+        ms = lambda v: round(v * 1000, 1) if v is not None else None
+        return {
+            "samples": len(self.samples),
+            "srtt_ms": ms(self.srtt),
+            "p50_ms": ms(self.percentile(50)),
+            "p95_ms": ms(self.percentile(95))
+        }
+
+class BridgeLink:
+    """Один подключённый bridge: в своём воркере — с сокетом, в чужом — только адрес воркера-владельца"""
+    
+    def __init__(self, bridge_id: str, features: List[str] = None, roots: List[str] = None,
+                 websocket: WebSocket = None, worker: str = None):
+        self.id = bridge_id
+        self.websocket = websocket
+        self.worker = worker or bus.worker_id
+        self.features: set = set(features or [])
+        self.roots = [normalize_bridge_path(r) for r in (roots or [])]  # Пусто — обслуживает всё
+        self.send_lock = asyncio.Lock()
+        self.in_flight = 0
+        self.latency = BRIDGE_LATENCY_INITIAL  # EWMA времени ответа, секунд
+        self.rtt = RttEstimator()  # Heartbeat ping → pong
+        self.remote_rtt: Optional[dict] = None  # Сводка RTT от воркера-владельца
+        self.actions: Dict[str, RttEstimator] = defaultdict(RttEstimator)  # Время ответа по действиям
+        self.throughput = float(BRIDGE_THROUGHPUT_INITIAL)  # EWMA байт/с по потокам
+        self.last_seen = time.monotonic()
+        self.pings: "OrderedDict[int, float]" = OrderedDict()  # seq → время отправки
+        self.ping_seq = 0
+        self.heartbeat: Optional[asyncio.Task] = None
+        self.codec = FrameCodec()
+        self.io: Optional[dict] = None  # Очередь файловых операций на PC (приходит в pong)
+    
+    @property
+    def is_local(self) -> bool:
+        return self.websocket is not None
+    
+    def route_score(self, path: str) -> Optional[int]:
+        """Длина совпавшего корня (больше — точнее), None — путь не обслуживается"""
+        if not self.roots:
+            return 0
+        scores = [len(root) + 1 for root in self.roots if path == root or path.startswith(root + "/") or not root]
+        return max(scores) if scores else None
+    
+    def load(self) -> float:
+        return (self.in_flight + 1) * self.latency
+    
+    def observe(self, seconds: float):
+        self.latency += BRIDGE_LATENCY_ALPHA * (seconds - self.latency)
+    
+    def observe_throughput(self, size: int, seconds: float):
+        if size >= 256 * 1024 and seconds > 0:
+            self.throughput += BRIDGE_LATENCY_ALPHA * (size / seconds - self.throughput)
+    
+    def timeout_for(self, action: str, size: int = 0) -> float:
+        """Таймаут запроса: p95 по действию с запасом + RTO канала + время на передачу size байт"""
+        default = BRIDGE_ACTION_TIMEOUTS.get(action, BRIDGE_DEFAULT_TIMEOUT)
+        stats = self.actions.get(action)
+        if stats is None or not stats.samples:
+            base = default
+        else:
+            base = stats.percentile(95) * BRIDGE_TIMEOUT_FACTOR + self.rtt.rto
+            if len(stats.samples) < BRIDGE_TIMEOUT_SAMPLES:
+                # Пара быстрых ответов ещё ничего не говорит о тяжёлых (первый разбор docx, большой файл)
+                base = max(base, default)
+        base += size / self.throughput
+        return min(max(base, BRIDGE_TIMEOUT_MIN), BRIDGE_TIMEOUT_MAX)
+    
+    def chunk_timeout(self, chunk_size: int) -> float:
+        expected = self.rtt.rto + chunk_size / self.throughput
+        return min(max(expected * BRIDGE_TIMEOUT_FACTOR, BRIDGE_TIMEOUT_MIN), BRIDGE_TIMEOUT_MAX)
+    
+    def ping(self) -> dict:
+        self.ping_seq += 1
+        self.pings[self.ping_seq] = time.monotonic()
+        while len(self.pings) > 10:
+            self.pings.popitem(last=False)
+        return {"type": "ping", "seq": self.ping_seq}
+    
+    def pong(self, seq: Optional[int]):
+        # Старый bridge не возвращает seq — сопоставляем с самым старым ping
+        if seq is not None:
+            sent_at = self.pings.pop(seq, None)
+        else:
+            sent_at = self.pings.popitem(last=False)[1] if self.pings else None
+        if sent_at is not None:
+            self.rtt.add(time.monotonic() - sent_at)
+    
+    async def send(self, payload: dict):
+        """Кадр на PC: напрямую в сокет или через шину воркеру-владельцу"""
+        if not self.is_local:
+            await bus.publish("bridge-rpc", {"type": "bridge_frame", "to": self.worker, "bridge": self.id, "frame": payload})
+            return
+        frame = self.codec.encode(payload)
+        # Запросы из разных обработчиков не перемешиваются
+        async with self.send_lock:
+            if isinstance(frame, bytes):
+                await self.websocket.send_bytes(frame)
+            else:
+                await self.websocket.send_text(frame)
+    
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "worker": self.worker,
+            "local": self.is_local,
+            "roots": self.roots,
+            "features": sorted(self.features),
+            "in_flight": self.in_flight,
+            "latency_ms": round(self.latency * 1000, 1),
+            "rtt": self.rtt.summary() if self.is_local else self.remote_rtt,
+            "last_seen_s": round(time.monotonic() - self.last_seen, 1) if self.is_local else None,
+            "timeouts": {action: round(self.timeout_for(action), 1) for action in self.actions},
+            "traffic": self.codec.stats() if self.is_local else None,
+            "io": self.io
+        }
+
+def normalize_bridge_path(path: str) -> str:
+    return (path or "").replace("\\", "/").strip("/")
+
+class PendingRequest:
+    """Запрос в полёте: помнит кадр, чтобы переотправить его другому bridge при обрыве"""
+    
+    def __init__(self, payload: dict, stream: bool):
+        self.payload = payload
+        self.path = normalize_bridge_path(payload.get("path", ""))
+        self.future: Optional[asyncio.Future] = None if stream else asyncio.get_event_loop().create_future()
+        self.queue: Optional[asyncio.Queue] = asyncio.Queue() if stream else None
+        self.link: Optional[BridgeLink] = None
+        self.tried: set = set()  # Bridge, которые уже пробовали
+        self.sent_at = 0.0
+        self.started = False  # Для потока: stream_start получен, переотправлять уже нельзя
+        self.size = 0
+    
+    def fail(self, error: str):
+        if self.queue is not None:
+            self.queue.put_nowait({"type": "stream_error", "error": error})
+        elif not self.future.done():
+            self.future.set_exception(Exception(error))
+
 class PCBridge:
-    """Менеджер соединения с PC"""
+    """Менеджер соединений с PC
+    
+    Bridge может быть несколько (разные машины или корни). Запрос уходит bridge
+    с самым длинным совпавшим корнем, среди равных — наименее загруженному.
+    Сокет bridge живёт в одном воркере; остальные шлют кадры через шину
+    (топик bridge-rpc), ответы возвращаются по префиксу id запроса.
+    """
     
     def __init__(self):
-        self.pc_websocket: WebSocket = None
-        self.pending_requests: Dict[str, asyncio.Future] = {}
+        self.links: Dict[str, BridgeLink] = {}
+        self.pending: Dict[str, PendingRequest] = {}
         self.request_counter = 0
+        bus.subscribe("bridge-status", self._on_status)
+        bus.subscribe("bridge-rpc", self._on_rpc, {"to": bus.worker_id})
+        bus.subscribe("bridge-rpc", self._on_query, {"type": "bridge_query"})
     
     @property
     def is_connected(self):
-        return self.pc_websocket is not None
+        return bool(self.links)
     
-    async def connect(self, websocket: WebSocket):
-        self.pc_websocket = websocket
-        print(f"[PC Bridge] PC connected")
-    
-    def disconnect(self):
-        self.pc_websocket = None
-        # Cancel pending requests
-        for future in self.pending_requests.values():
-            if not future.done():
-                future.set_exception(Exception("PC disconnected"))
-        self.pending_requests.clear()
-        print(f"[PC Bridge] PC disconnected")
-    
-    async def request(self, action: str, path: str = "", timeout: float = 30.0) -> dict:
-        """Отправить запрос к PC и ждать ответа"""
-        if not self.is_connected:
-            return {"error": "PC not connected", "pc_online": False}
-        
+    def pick(self, path: str = "", exclude: set = frozenset()) -> Optional[BridgeLink]:
+        """Bridge для пути: самый точный корень, затем меньше (запросов в полёте + 1) × задержка"""
+        path = normalize_bridge_path(path)
+        scored = [(link.route_score(path), link) for link in self.links.values() if link not in exclude]
+        scored = [(score, link) for score, link in scored if score is not None]
+        if not scored:
+            return None
+        best = max(score for score, _ in scored)
+        return min((link for score, link in scored if score == best), key=lambda link: link.load())
+    
+    def supports(self, feature: str, path: str = "") -> bool:
+        """Поддерживает ли bridge, обслуживающий путь, возможность протокола"""
+        link = self.pick(path)
+        return link is not None and feature in link.features
+    
+    async def connect(self, websocket: WebSocket, auth: dict) -> BridgeLink:
+        link = BridgeLink(
+            auth.get("bridge_id") or "default",
+            auth.get("features"),
+            auth.get("roots"),
+            websocket=websocket
+        )
+        link.codec = negotiate_codec(auth.get("codecs"))
+        # Ответ на авторизацию — ещё обычным JSON; после него кадры идут в выбранном кодеке
+        await websocket.send_json({
+            "type": "auth_ok",
+            "bridge_id": link.id,
+            "codec": {"compression": link.codec.compression, "encoding": link.codec.encoding}
+        })
+        old = self.links.get(link.id)
+        self.links[link.id] = link
+        link.heartbeat = asyncio.create_task(self._heartbeat(link))
+        if old is not None:
+            await self._replace(old)
+        print(f"[PC Bridge] {link.id} connected (roots: {', '.join(link.roots) or '*'}; "
+              f"features: {', '.join(sorted(link.features)) or 'none'}; codec: {link.codec.name})")
+        await self.publish_status(link)
+        return link
+    
+    async def _replace(self, old: BridgeLink):
+        """Тот же bridge переподключился: старое соединение закрываем, его запросы — на новое"""
+        print(f"[PC Bridge] {old.id} reconnected, dropping previous connection")
+        if old.heartbeat:
+            old.heartbeat.cancel()
+        self._on_link_lost(old)
+        if old.is_local:
+            try:
+                await old.websocket.close(code=4000, reason="Replaced by new connection")
+            except Exception:
+                pass
+    
+    async def disconnect(self, link: BridgeLink):
+        if self.links.get(link.id) is not link:
+            return  # Уже заменён новым подключением
+        del self.links[link.id]
+        if link.heartbeat:
+            link.heartbeat.cancel()
+        print(f"[PC Bridge] {link.id} disconnected")
+        self._on_link_lost(link)
+        await self.publish_status(link, connected=False)
+    
+    def _on_link_lost(self, link: BridgeLink):
+        """Запросы оборвавшегося bridge: повторяемые — другому bridge, остальные — ошибка"""
+        for request_id, pending in list(self.pending.items()):
+            if pending.link is not link:
+                continue
+            self._release(pending)
+            retry = pending.payload["action"] in BRIDGE_RETRY_ACTIONS and not pending.started
+            other = self.pick(pending.path, exclude=pending.tried) if retry else None
+            if other is None:
+                pending.fail("PC disconnected")
+                continue
+            print(f"[PC Bridge] {request_id}: failover {link.id} → {other.id}")
+            asyncio.create_task(self._dispatch(pending, other))
+    
+    async def _heartbeat(self, link: BridgeLink):
+        """Ping раз в интервал; полутихое (half-open) соединение закрывается, запросы уходят на другие bridge"""
+        while True:
+            await asyncio.sleep(BRIDGE_HEARTBEAT_INTERVAL)
+            silence = time.monotonic() - link.last_seen
+            if silence > BRIDGE_DEAD_AFTER:
+                print(f"[PC Bridge] {link.id} silent for {silence:.0f}s, dropping link")
+                asyncio.create_task(self._close_dead(link))
+                await self.disconnect(link)
+                return
+            try:
+                await asyncio.wait_for(link.send(link.ping()), timeout=BRIDGE_HEARTBEAT_INTERVAL)
+            except Exception:
+                pass  # Отправка встала — решит проверка тишины на следующем шаге
+            # Сводка RTT для остальных воркеров и подписчиков bridge-status
+            await self.publish_status(link)
+    
+    async def _close_dead(self, link: BridgeLink):
+        try:
+            await asyncio.wait_for(link.websocket.close(code=4002, reason="Heartbeat timeout"), timeout=5)
+        except Exception:
+            pass
+    
+    def seen(self, link: BridgeLink, data: dict = None):
+        """Любой кадр от bridge — признак жизни; pong — ещё и замер RTT"""
+        link.last_seen = time.monotonic()
+        if data is not None and data.get("type") == "pong":
+            link.pong(data.get("seq"))
+            link.io = data.get("io", link.io)
+    
+    async def publish_status(self, link: BridgeLink, connected: bool = True):
+        """Сообщить всем воркерам (и подписчикам bridge-status), где bridge"""
+        await bus.publish("bridge-status", {
+            "type": "bridge_status",
+            "bridge": link.id,
+            "connected": connected,
+            "roots": link.roots,
+            "features": sorted(link.features),
+            "worker": link.worker,
+            "rtt": link.rtt.summary()
+        })
+    
+    async def discover(self):
+        """При старте воркера спросить, какие bridge подключены к другим воркерам"""
+        await bus.publish("bridge-rpc", {"type": "bridge_query"})
+    
+    def _on_query(self, message: dict, remote: bool):
+        if remote:
+            for link in self.links.values():
+                if link.is_local:
+                    asyncio.create_task(self.publish_status(link))
+    
+    def _on_status(self, message: dict, remote: bool):
+        if not remote:
+            return
+        bridge_id = message.get("bridge") or "default"
+        current = self.links.get(bridge_id)
+        if message.get("connected"):
+            if current is not None and not current.is_local and current.worker == message["worker"]:
+                # Повторный статус (ответ на bridge_query) — просто обновить
+                current.features = set(message.get("features", []))
+                current.roots = message.get("roots", [])
+                current.remote_rtt = message.get("rtt")
+                return
+            link = BridgeLink(bridge_id, message.get("features"), message.get("roots"), worker=message["worker"])
+            link.remote_rtt = message.get("rtt")
+            self.links[bridge_id] = link
+            if current is not None:
+                asyncio.create_task(self._replace(current))
+        elif current is not None and current.worker == message.get("worker") and not current.is_local:
+            del self.links[bridge_id]
+            self._on_link_lost(current)
+    
+    def _on_rpc(self, message: dict, remote: bool):
+        """Кадр для этого воркера: запрос к нашему bridge или ответ на наш запрос"""
+        if message["type"] == "bridge_frame":
+            frame = message["frame"]
+            link = self.links.get(message.get("bridge") or "default")
+            if link is not None and link.is_local:
+                asyncio.create_task(link.send(frame))
+            elif frame.get("type") == "request":
+                # Bridge уже ушёл от этого воркера — сразу отвечаем ошибкой
+                asyncio.create_task(self.handle_response({"type": "response", "id": frame["id"], "error": "PC disconnected"}))
+        elif message["type"] == "bridge_response":
+            self._deliver_response(message["frame"])
+        elif message["type"] == "bridge_chunk":
+            self._deliver_chunk(message["id"], base64.b64decode(message["data"]))
+    
+    def _next_id(self) -> str:
+        # Префикс — адрес воркера, которому владелец bridge вернёт ответ
         self.request_counter += 1
-        request_id = f"req_{self.request_counter}"
-        
-        future = asyncio.get_event_loop().create_future()
-        self.pending_requests[request_id] = future
+        return f"{bus.worker_id}:req_{self.request_counter}"
+    
+    async def _dispatch(self, pending: PendingRequest, link: BridgeLink):
+        pending.link = link
+        pending.tried.add(link)
+        pending.sent_at = time.monotonic()
+        link.in_flight += 1
+        try:
+            await link.send(pending.payload)
+        except Exception:
+            if pending.link is link:
+                self._on_link_lost(link)
+    
+    def _release(self, pending: PendingRequest):
+        if pending.link is not None:
+            pending.link.in_flight -= 1
+            pending.link = None
+    
+    def _start(self, action: str, path: str, stream: bool, size: int, params: dict) -> PendingRequest:
+        """Зарегистрировать запрос; отправляет его _dispatch"""
+        request_id = self._next_id()
+        payload = {"type": "request", "id": request_id, "action": action, "path": path, **params}
+        if stream:
+            payload["stream"] = True
+        pending = PendingRequest(payload, stream)
+        pending.size = size
+        self.pending[request_id] = pending
+        return pending
+    
+    def _finish(self, pending: PendingRequest):
+        self.pending.pop(pending.payload["id"], None)
+        self._release(pending)
+    
+    async def request(self, action: str, path: str = "", timeout: float = None, expected_bytes: int = 0, **params) -> dict:
+        """Отправить запрос к PC и ждать ответа (таймаут по умолчанию — по замерам, с учётом expected_bytes)"""
+        link = self.pick(path)
+        if link is None:
+            return {"error": "PC not connected", "pc_online": False}
         
+        # Таймаут — по bridge, выбранному до отправки: при ошибке отправки pending.link уже сброшен
+        pending = self._start(action, path, False, expected_bytes, params)
         try:
-            await self.pc_websocket.send_json({
-                "type": "request",
-                "id": request_id,
-                "action": action,
-                "path": path
-            })
-            
-            result = await asyncio.wait_for(future, timeout=timeout)
-            return result
+            timeout = timeout or link.timeout_for(action, expected_bytes)
+            await self._dispatch(pending, link)
+            return await asyncio.wait_for(pending.future, timeout=timeout)
         except asyncio.TimeoutError:
             return {"error": "Request timeout"}
         except Exception as e:
             return {"error": str(e)}
         finally:
-            self.pending_requests.pop(request_id, None)
+            self._finish(pending)
+    
+    async def stream(self, action: str, path: str = "", timeout: float = None,
+                     **params) -> Tuple[dict, Optional[AsyncIterator[bytes]]]:
+        """Запросить потоковую передачу: (заголовок stream_start, итератор чанков)"""
+        link = self.pick(path)
+        if link is None:
+            return {"error": "PC not connected", "pc_online": False}, None
+        
+        pending = self._start(action, path, True, 0, params)
+        try:
+            timeout = timeout or link.timeout_for(action)
+            await self._dispatch(pending, link)
+            header = await asyncio.wait_for(pending.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._finish(pending)
+            return {"error": "Request timeout"}, None
+        except BaseException:
+            self._finish(pending)
+            raise
+        
+        if header.get("type") != "stream_start":
+            self._finish(pending)
+            return {"error": header.get("error", "Stream failed")}, None
+        
+        # Ожидание следующего чанка — по оценке канала, а не общий таймаут запроса
+        chunk_timeout = (pending.link or link).chunk_timeout(header.get("chunk_size", 0))
+        return header, self._iter_stream(pending, chunk_timeout)
     
-    def handle_response(self, data: dict):
-        """Обработать ответ от PC"""
-        request_id = data.get("id")
-        if request_id and request_id in self.pending_requests:
-            future = self.pending_requests[request_id]
-            if not future.done():
-                future.set_result(data)
+    async def _iter_stream(self, pending: PendingRequest, timeout: float):
+        """Отдавать чанки по мере прихода; каждый отданный чанк возвращает PC один кредит окна"""
+        request_id = pending.payload["id"]
+        completed = False
+        started_at, received = time.monotonic(), 0
+        try:
+            while True:
+                item = await asyncio.wait_for(pending.queue.get(), timeout=timeout)
+                if isinstance(item, bytes):
+                    received += len(item)
+                    yield item
+                    if pending.link is not None:
+                        await pending.link.send({"type": "stream_ack", "id": request_id, "credits": 1})
+                elif item.get("type") == "stream_end":
+                    completed = True
+                    if pending.link is not None:
+                        pending.link.observe_throughput(received, time.monotonic() - started_at)
+                    return
+                else:
+                    raise Exception(item.get("error", "Stream failed"))
+        finally:
+            link = pending.link
+            self._finish(pending)
+            if not completed and link is not None and self.links.get(link.id) is link:
+                # Клиент ушёл или ошибка — PC прекращает чтение файла
+                try:
+                    await link.send({"type": "stream_cancel", "id": request_id})
+                except Exception:
+                    pass
+    
+    @staticmethod
+    def _origin(request_id: str) -> str:
+        return request_id.split(":", 1)[0]
+    
+    async def handle_response(self, data: dict):
+        """Обработать ответ от PC (чужой — переслать воркеру, который спрашивал)"""
+        origin = self._origin(data.get("id") or "")
+        if origin and origin != bus.worker_id:
+            try:
+                await bus.publish("bridge-rpc", {"type": "bridge_response", "to": origin, "frame": data})
+            except ValueError as e:
+                # Ответ не пролезает в шину (например, base64 большого файла) — спрашивающему уходит ошибка
+                print(f"[PC Bridge] {data.get('id')}: {e}")
+                error = {"type": data.get("type"), "id": data.get("id"), "error": "Response too large to relay"}
+                await bus.publish("bridge-rpc", {"type": "bridge_response", "to": origin, "frame": error})
+            return
+        self._deliver_response(data)
+    
+    def _deliver_response(self, data: dict):
+        pending = self.pending.get(data.get("id"))
+        if pending is None:
+            return
+        if pending.link is not None and not pending.started:
+            elapsed = time.monotonic() - pending.sent_at
+            pending.link.observe(elapsed)
+            pending.link.actions[pending.payload["action"]].add(elapsed)
+        if pending.queue is not None:
+            pending.started = pending.started or data.get("type") == "stream_start"
+            pending.queue.put_nowait(data)
+        elif not pending.future.done():
+            pending.future.set_result(data)
+    
+    async def handle_chunk(self, frame: bytes):
+        """Бинарный кадр потока: [длина id][id][данные]"""
+        id_len = frame[0]
+        request_id = frame[1:1 + id_len].decode('ascii')
+        origin = self._origin(request_id)
+        if origin != bus.worker_id:
+            await bus.publish("bridge-rpc", {
+                "type": "bridge_chunk",
+                "to": origin,
+                "id": request_id,
+                "data": base64.b64encode(frame[1 + id_len:]).decode('ascii')
+            })
+            return
+        self._deliver_chunk(request_id, frame[1 + id_len:])
+    
+    def _deliver_chunk(self, request_id: str, chunk: bytes):
+        pending = self.pending.get(request_id)
+        if pending is not None and pending.queue is not None:
+            pending.queue.put_nowait(chunk)
+    
+    def status(self) -> List[dict]:
+        return [link.info() for link in self.links.values()]
 
 pc_bridge = PCBridge()
 
+class ListingCache:
+    """LRU-кэш листингов папок PC с перепроверкой по mtime папки"""
+    
+    def __init__(self, max_entries: int = LISTING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.tasks: set = set()  # Ссылки на фоновые перепроверки
+        self.revalidating: set = set()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(path: str) -> str:
+        return path.replace('\\', '/').strip('/')
+    
+    def get(self, path: str) -> Optional[dict]:
+        key = self.key(path)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+    
+    def put(self, path: str, listing: dict):
+        key = self.key(path)
+        listing = {k: v for k, v in listing.items() if k not in ("id", "type")}
+        self.entries[key] = {
+            "listing": listing,
+            "mtime": listing.get("mtime"),
+            "checked_at": time.monotonic()
+        }
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def invalidate(self, path: str):
+        self.entries.pop(self.key(path), None)
+    
+    def revalidate_later(self, path: str):
+        """Stale-while-revalidate: обновить запись в фоне"""
+        key = self.key(path)
+        if key in self.revalidating:
+            return
+        self.revalidating.add(key)
+        task = asyncio.create_task(self._revalidate(path))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+    
+    async def _revalidate(self, path: str):
+        key = self.key(path)
+        try:
+            entry = self.entries.get(key)
+            # Дешёвая проверка: изменился ли mtime папки
+            info = await pc_bridge.request("stat", path)
+            if entry and entry["mtime"] is not None and info.get("mtime") == entry["mtime"]:
+                entry["checked_at"] = time.monotonic()
+                return
+            
+            result = await pc_bridge.request("list", path)
+            if not result.get("error"):
+                self.put(path, result)
+            elif result.get("pc_online") is not False:
+                self.invalidate(path)
+        finally:
+            self.revalidating.discard(key)
+    
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+listing_cache = ListingCache()
+
+def invalidate_listings(message: dict, remote: bool):
+    """Изменения в папках PC (из любого воркера) сбрасывают кэш листингов"""
+    for path in message.get("paths", []):
+        listing_cache.invalidate(path)
+
+bus.subscribe("fs-changes", invalidate_listings)
+
+# ===== ПОСТРАНИЧНЫЕ ЛИСТИНГИ =====
+
+def listing_sort_key(item: dict, sort: str) -> list:
+    """Ключ сортировки внутри группы (папки / файлы); имя — для однозначного порядка"""
+    if sort == "mtime":
+        value = item.get("modified") or ""
+    elif sort == "size":
+        value = item.get("size") or 0
+    else:
+        value = item["name"].lower()
+    return [value, item["name"].lower(), item["name"]]
+
+def listing_group(item: dict) -> int:
+    return 0 if item["type"] == "folder" else 1  # Папки всегда впереди
+
+def sort_listing(items: List[dict], sort: str = "name", order: str = "asc") -> List[dict]:
+    desc = order == "desc"
+    key = lambda item: listing_sort_key(item, sort)
+    folders = sorted((i for i in items if listing_group(i) == 0), key=key, reverse=desc)
+    files = sorted((i for i in items if listing_group(i) == 1), key=key, reverse=desc)
+    return folders + files
+
+def encode_cursor(item: dict, sort: str, order: str) -> str:
+    raw = json.dumps([sort, order, listing_group(item), listing_sort_key(item, sort)], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, sort: str, order: str) -> Tuple[int, list]:
+    """(группа, ключ) последнего отданного элемента; ValueError — курсор битый или от другой сортировки"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_order, group, key = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError("Cursor belongs to another sort order")
+    return group, key
+
+def page_listing(listing: dict, limit: int, cursor: str = "", sort: str = "name", order: str = "asc") -> dict:
+    """Страница листинга после курсора: выбор limit элементов без сортировки всей папки"""
+    desc = order == "desc"
+    key = lambda item: listing_sort_key(item, sort)
+    select = heapq.nlargest if desc else heapq.nsmallest
+    items = listing.get("items", [])
+    groups = ([i for i in items if listing_group(i) == 0], [i for i in items if listing_group(i) == 1])
+    start, after = decode_cursor(cursor, sort, order) if cursor else (0, None)
+    
+    page: List[dict] = []
+    more = False
+    for group in range(start, len(groups)):
+        candidates = groups[group]
+        if after is not None and group == start:
+            candidates = [i for i in candidates if (key(i) < after if desc else key(i) > after)]
+        need = limit - len(page)
+        chosen = select(need + 1, candidates, key=key) if need else candidates[:1]
+        page.extend(chosen[:need])
+        if len(chosen) > need:
+            more = True
+            break
+    
+    return {
+        **{k: v for k, v in listing.items() if k not in ("items", "id", "type")},
+        "items": page,
+        "total": len(items),
+        "sort": sort,
+        "order": order,
+        "limit": limit,
+        "next_cursor": encode_cursor(page[-1], sort, order) if more and page else None
+    }
+
+def ndjson_line(obj: dict) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
+
+def listing_lines(listing: dict, sort: str, order: str):
+    """NDJSON готового листинга: строка метаданных, затем по элементу на строку"""
+    if listing.get("error"):
+        yield ndjson_line({k: v for k, v in listing.items() if k not in ("id", "type")})
+        return
+    items = sort_listing(listing.get("items", []), sort, order)
+    meta = {k: v for k, v in listing.items() if k not in ("items", "id", "type")}
+    yield ndjson_line({**meta, "total": len(items), "sort": sort, "order": order})
+    for start in range(0, len(items), LISTING_STREAM_PAGE):
+        yield b"".join(ndjson_line(item) for item in items[start:start + LISTING_STREAM_PAGE])
+
+def check_listing_params(sort: str, order: str, limit: Optional[int]) -> int:
+    if sort not in LISTING_SORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort: {sort} (name, mtime, size)")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail=f"Unknown order: {order} (asc, desc)")
+    return max(1, min(limit or LISTING_PAGE_LIMIT, LISTING_MAX_LIMIT))
+
+async def handle_fs_change(paths: List[str]):
+    """PC сообщил об изменениях в папках: сбросить кэш и оповестить Mini App"""
+    await bus.publish("fs-changes", {"type": "fs_change", "paths": paths})
+
+
 @app.websocket("/ws/pc-bridge")
 async def websocket_pc_bridge(websocket: WebSocket):
     """WebSocket для подключения PC"""
     await websocket.accept()
+    link = None
     
     try:
         # Ждём авторизацию
@@ -654,42 +2458,288 @@ async def websocket_pc_bridge(websocket: WebSocket):
             await websocket.close(code=4001, reason="Unauthorized")
             return
         
-        await pc_bridge.connect(websocket)
-        await websocket.send_json({"type": "auth_ok"})
+        link = await pc_bridge.connect(websocket, auth_data)
         
         while True:
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            
+            if message.get("bytes") is not None:
+                frame = message["bytes"]
+                if frame[0] != CODEC_MARKER:
+                    pc_bridge.seen(link)
+                    await pc_bridge.handle_chunk(frame)
+                    continue
+                try:
+                    data = link.codec.decode(frame)
+                except ValueError as e:
+                    print(f"[PC Bridge] {link.id}: {e}")
+                    continue
+            else:
+                link.codec.count_plain(len(message["text"]))
+                data = json.loads(message["text"])
+            pc_bridge.seen(link, data)
             
-            if data.get("type") == "response":
-                pc_bridge.handle_response(data)
+            if data.get("type") in ("response", "stream_start", "stream_end", "stream_error"):
+                await pc_bridge.handle_response(data)
+            elif data.get("type") == "soul_snapshot":
+                soul_store.apply_snapshot(data)
+            elif data.get("type") == "soul_delta":
+                if not soul_store.apply_delta(data):
+                    await link.send({"type": "soul_resync"})
+            elif data.get("type") == "fs_change":
+                await handle_fs_change(data.get("paths", []))
             elif data.get("type") == "pong":
                 pass  # Keep-alive response
                 
     except WebSocketDisconnect:
-        pc_bridge.disconnect()
+        if link is not None:
+            await pc_bridge.disconnect(link)
     except Exception as e:
         print(f"[PC Bridge] Error: {e}")
-        pc_bridge.disconnect()
+        if link is not None:
+            await pc_bridge.disconnect(link)
 
 @app.get("/api/pc/status")
 async def pc_status():
     """Статус подключения PC"""
-    return {"connected": pc_bridge.is_connected}
+    return {
+        "connected": pc_bridge.is_connected,
+        "worker": bus.worker_id,
+        "bridges": pc_bridge.status(),
+        "listing_cache": listing_cache.stats(),
+        "thumb_cache": thumb_cache.stats()
+    }
+
+def cached_listing(path: str) -> Optional[dict]:
+    """Листинг из кэша, если его можно отдать без ожидания PC (с пометками cached/stale/offline)"""
+    entry = listing_cache.get(path)
+    if entry is None:
+        return None
+    
+    if not pc_bridge.is_connected:
+        # PC офлайн — просмотр в режиме только чтения
+        return {**entry["listing"], "cached": True, "stale": True, "offline": True}
+    fresh_for = LISTING_WATCHED_FRESH_SECONDS if pc_bridge.supports("watch", path) else LISTING_FRESH_SECONDS
+    if time.monotonic() - entry["checked_at"] < fresh_for:
+        return {**entry["listing"], "cached": True}
+    listing_cache.revalidate_later(path)
+    return {**entry["listing"], "cached": True, "stale": True}
+
+async def full_pc_listing(path: str) -> dict:
+    listing = cached_listing(path)
+    if listing is not None:
+        return listing
+    result = await pc_bridge.request("list", path)
+    if not result.get("error"):
+        listing_cache.put(path, result)
+    return result
+
+async def pc_file_size(path: str) -> int:
+    """Размер файла на PC (для таймаута): из кэша листинга папки, иначе stat"""
+    parent, _, name = normalize_bridge_path(path).rpartition("/")
+    entry = listing_cache.entries.get(listing_cache.key(parent))
+    if entry is not None:
+        for item in entry["listing"].get("items", []):
+            if item["name"] == name:
+                return item.get("size") or 0
+    info = await pc_bridge.request("stat", path)
+    return info.get("size") or 0
+
+async def stream_pc_listing(path: str, sort: str, order: str):
+    """NDJSON: первая страница уходит клиенту, пока PC собирает следующие"""
+    listing = cached_listing(path)
+    if listing is None and not pc_bridge.supports("page", path):
+        listing = await full_pc_listing(path)
+    if listing is not None:
+        for line in listing_lines(listing, sort, order):
+            yield line
+        return
+    
+    cursor = ""
+    first = True
+    collected: List[dict] = []  # Весь листинг — в кэш, когда придёт последняя страница
+    while True:
+        page = await pc_bridge.request("list", path, limit=LISTING_STREAM_PAGE, cursor=cursor, sort=sort, order=order)
+        if page.get("error"):
+            yield ndjson_line({k: v for k, v in page.items() if k not in ("id", "type")})
+            return
+        if first:
+            meta = {k: v for k, v in page.items() if k not in ("items", "id", "type", "limit", "next_cursor")}
+            yield ndjson_line(meta)
+            first = False
+        if page["items"]:
+            yield b"".join(ndjson_line(item) for item in page["items"])
+        collected.extend(page["items"])
+        cursor = page.get("next_cursor")
+        if not cursor:
+            if len(collected) == page.get("total", len(collected)):  # Папка не менялась между страницами
+                listing = {k: v for k, v in meta.items() if k not in ("total", "sort", "order")}
+                listing_cache.put(path, {**listing, "items": sort_listing(collected)})
+            return
 
 @app.get("/api/pc/files")
-async def pc_list_files(path: str = ""):
-    """Список файлов на PC (через bridge)"""
-    return await pc_bridge.request("list", path)
+async def pc_list_files(path: str = "", limit: Optional[int] = None, cursor: str = "",
+                        sort: str = "name", order: str = "asc", stream: bool = False):
+    """Список файлов на PC (через bridge, с кэшем на VPS); limit/cursor — по страницам, stream — NDJSON"""
+    page_size = check_listing_params(sort, order, limit)
+    
+    if stream:
+        return StreamingResponse(stream_pc_listing(path, sort, order), media_type="application/x-ndjson")
+    
+    if limit is None and not cursor and sort == "name" and order == "asc":
+        return await full_pc_listing(path)
+    
+    # Страница из кэша, с PC (bridge режет сам) или из полного листинга от старого bridge
+    listing = cached_listing(path)
+    if listing is None and pc_bridge.supports("page", path):
+        page = await pc_bridge.request("list", path, limit=page_size, cursor=cursor, sort=sort, order=order)
+        return {k: v for k, v in page.items() if k not in ("id", "type")}  # Как у page_listing
+    if listing is None:
+        listing = await full_pc_listing(path)
+    if listing.get("error"):
+        return listing
+    try:
+        return page_listing(listing, page_size, cursor, sort, order)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/api/pc/file")
 async def pc_read_file(path: str):
     """Прочитать файл на PC"""
-    return await pc_bridge.request("read", path)
+    return await pc_bridge.request("read", path, expected_bytes=await pc_file_size(path))
+
+@app.get("/api/pc/search")
+async def pc_search(q: str, path: str = "", limit: int = 20, offset: int = 0):
+    """Полнотекстовый поиск по архиву PC (имена и текст документов)"""
+    if not pc_bridge.supports("search", path):
+        raise HTTPException(status_code=501, detail="PC Bridge does not support search")
+    
+    result = await pc_bridge.request(
+        "search", path,
+        query=q, limit=max(1, min(limit, SEARCH_MAX_LIMIT)), offset=max(0, offset)
+    )
+    if result.get("error"):
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+class ThumbnailCache:
+    """LRU превью в памяти VPS: отдаются без PC, пока свежие; потом — перепроверка по ETag"""
+    
+    def __init__(self, max_entries: int = THUMB_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(path: str, size: int, fmt: str) -> tuple:
+        return normalize_bridge_path(path), size, fmt
+    
+    def get(self, key: tuple) -> Optional[dict]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+    
+    def put(self, key: tuple, etag: str, body: bytes, mime: str) -> dict:
+        entry = {"etag": etag, "body": body, "mime": mime, "checked_at": time.monotonic()}
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+    
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+thumb_cache = ThumbnailCache()
+
+def thumbnail_response(request: Request, etag: str, entry: Optional[dict] = None) -> Response:
+    headers = {"ETag": f'"{etag}"', "Cache-Control": f"private, max-age={THUMB_FRESH_SECONDS}"}
+    if entry is None or etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type=entry["mime"], headers=headers)
+
+@app.get("/api/pc/thumb")
+async def pc_thumbnail(path: str, request: Request, size: int = 256, format: str = "jpeg"):
+    """Превью картинки или PDF с PC (JPEG/WebP): кэш на VPS и в браузере"""
+    if format not in THUMB_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format} (jpeg, webp)")
+    
+    size = next((s for s in THUMB_SIZES if s >= size), THUMB_SIZES[-1])
+    key = thumb_cache.key(path, size, format)
+    entry = thumb_cache.get(key)
+    if entry is not None and (not pc_bridge.is_connected or time.monotonic() - entry["checked_at"] < THUMB_FRESH_SECONDS):
+        return thumbnail_response(request, entry["etag"], entry)
+    
+    if not pc_bridge.supports("thumbnail", path):
+        if entry is not None:
+            return thumbnail_response(request, entry["etag"], entry)
+        raise HTTPException(status_code=501, detail="PC Bridge does not support thumbnails")
+    
+    # PC сверяет ETag из кэша VPS (или браузера) и не присылает превью, если файл тот же
+    known = entry["etag"] if entry is not None else request.headers.get("if-none-match", "").strip('"')
+    result = await pc_bridge.request(
+        "thumbnail", path, expected_bytes=await pc_file_size(path), thumb_size=size, format=format, etag=known
+    )
+    
+    if result.get("error"):
+        if entry is not None and result.get("pc_online") is False:
+            return thumbnail_response(request, entry["etag"], entry)
+        raise HTTPException(status_code=400, detail=result["error"])
+    
+    if result.get("not_modified"):
+        if entry is None:
+            return thumbnail_response(request, result["etag"])
+        entry["checked_at"] = time.monotonic()
+    else:
+        entry = thumb_cache.put(key, result["etag"], base64.b64decode(result["content"]), result["mime"])
+    return thumbnail_response(request, entry["etag"], entry)
 
 @app.get("/api/pc/file/download")
-async def pc_download_file(path: str):
-    """Скачать файл с PC через bridge"""
-    result = await pc_bridge.request("download", path, timeout=60.0)
+async def pc_download_file(path: str, request: Request):
+    """Скачать файл с PC через bridge (с поддержкой Range и докачки)"""
+    if pc_bridge.supports("stream", path):
+        byte_range = None
+        conditional = any(h in request.headers for h in ("range", "if-none-match", "if-modified-since"))
+        
+        if conditional:
+            # Валидаторы нужны до начала передачи — короткий запрос stat
+            info = await pc_bridge.request("stat", path)
+            if info.get("error"):
+                raise HTTPException(status_code=400, detail=info["error"])
+            if info.get("is_dir"):
+                raise HTTPException(status_code=400, detail="Not a file")
+            
+            etag, last_modified = file_validators(info["size"], info["mtime"])
+            if is_not_modified(request, etag, info["mtime"]):
+                return Response(status_code=304, headers={"ETag": etag, "Last-Modified": last_modified})
+            byte_range = parse_range(request, info["size"], etag, last_modified)
+        
+        # Потоковая передача бинарными кадрами: постоянная память, первый байт сразу
+        params = {}
+        if byte_range:
+            params = {"offset": byte_range[0], "length": byte_range[1] - byte_range[0] + 1}
+        header, chunks = await pc_bridge.stream("download", path, **params)
+        if header.get("error"):
+            raise HTTPException(status_code=400, detail=header["error"])
+        
+        etag, last_modified = file_validators(header["size"], header["mtime"])
+        return StreamingResponse(
+            chunks,
+            status_code=206 if byte_range else 200,
+            media_type="application/octet-stream",
+            headers=download_headers(header.get("name", "file"), header["size"], etag, last_modified, byte_range)
+        )
+    
+    # Старый bridge: файл целиком в base64
+    # base64 в JSON — примерно на треть больше файла
+    result = await pc_bridge.request("download", path, expected_bytes=await pc_file_size(path) * 4 // 3)
     
     if result.get("error"):
         raise HTTPException(status_code=400, detail=result["error"])
@@ -698,21 +2748,21 @@ async def pc_download_file(path: str):
     content = base64.b64decode(result.get("content", ""))
     filename = result.get("name", "file")
     
-    from fastapi.responses import Response
     return Response(
         content=content,
         media_type="application/octet-stream",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        headers={"Content-Disposition": content_disposition(filename)}
     )
 
 @app.post("/api/pc/save-to-downloads")
 async def pc_save_to_downloads(path: str):
     """Сохранить файл в папку Загрузки на PC"""
-    result = await pc_bridge.request("save_to_downloads", path, timeout=30.0)
+    result = await pc_bridge.request("save_to_downloads", path)
     
     if result.get("error"):
         raise HTTPException(status_code=400, detail=result["error"])
     
+    listing_cache.invalidate("Загрузки")
     return result
 
 # ===== SKILLS API (из _REGISTRY.md) =====
@@ -751,92 +2801,121 @@ def safe_path(relative_path: str) -> Path:
     
     return full_path
 
-@app.get("/api/files")
-async def list_files(path: str = ""):
-    """Список файлов и папок"""
-    try:
-        target = safe_path(path)
-        
-        if not target.exists():
-            raise HTTPException(status_code=404, detail="Path not found")
-        
-        if not target.is_dir():
-            raise HTTPException(status_code=400, detail="Not a directory")
-        
-        items = []
-        for item in sorted(target.iterdir(), key=lambda x: (not x.is_dir(), x.name.lower())):
+def scan_directory(target: Path) -> List[dict]:
+    """Элементы папки через os.scandir: тип берётся из записи каталога, stat — один на элемент"""
+    items = []
+    with os.scandir(target) as it:
+        for entry in it:
             try:
-                stat = item.stat()
-                items.append({
-                    "name": item.name,
-                    "type": "folder" if item.is_dir() else "file",
-                    "size": stat.st_size if item.is_file() else None,
-                    "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "extension": item.suffix.lower() if item.is_file() else None
-                })
+                is_dir = entry.is_dir()
+                stat = entry.stat()
             except (PermissionError, OSError):
                 continue
-        
-        return {
-            "path": path,
-            "parent": str(Path(path).parent) if path else None,
-            "items": items
-        }
+            items.append({
+                "name": entry.name,
+                "type": "folder" if is_dir else "file",
+                "size": None if is_dir else stat.st_size,
+                "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                "extension": None if is_dir else os.path.splitext(entry.name)[1].lower()
+            })
+    return sort_listing(items)
+
+def list_directory(path: str) -> dict:
+    target = safe_path(path)
+    
+    if not target.exists():
+        raise HTTPException(status_code=404, detail="Path not found")
+    
+    if not target.is_dir():
+        raise HTTPException(status_code=400, detail="Not a directory")
+    
+    return {
+        "path": path,
+        "parent": str(Path(path).parent) if path else None,
+        "items": scan_directory(target)
+    }
+
+@app.get("/api/files")
+async def list_files(path: str = "", limit: Optional[int] = None, cursor: str = "",
+                     sort: str = "name", order: str = "asc", stream: bool = False):
+    """Список файлов и папок; limit/cursor — по страницам, stream — NDJSON"""
+    page_size = check_listing_params(sort, order, limit)
+    try:
+        listing = await fs_io.run(list_directory, path)
+        if stream:
+            return StreamingResponse(listing_lines(listing, sort, order), media_type="application/x-ndjson")
+        if limit is None and not cursor and sort == "name" and order == "asc":
+            return listing
+        return page_listing(listing, page_size, cursor, sort, order)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/file")
-async def read_file(path: str):
-    """Прочитать содержимое файла"""
-    try:
-        target = safe_path(path)
-        
-        if not target.exists():
-            raise HTTPException(status_code=404, detail="File not found")
-        
-        if not target.is_file():
-            raise HTTPException(status_code=400, detail="Not a file")
-        
-        # Проверяем размер (макс 1MB для текстовых)
-        if target.stat().st_size > 1_000_000:
-            raise HTTPException(status_code=413, detail="File too large (max 1MB)")
-        
-        # Определяем тип файла
-        text_extensions = {'.txt', '.md', '.json', '.py', '.js', '.html', '.css', '.yaml', '.yml', '.xml', '.csv', '.log', '.bat', '.sh', '.ps1', '.env', '.gitignore', '.toml', '.ini', '.cfg'}
-        
-        if target.suffix.lower() in text_extensions or target.suffix == '':
-            try:
-                content = target.read_text(encoding='utf-8')
-                return {
-                    "path": path,
-                    "name": target.name,
-                    "content": content,
-                    "type": "text",
-                    "size": len(content)
-                }
-            except UnicodeDecodeError:
-                return {
-                    "path": path,
-                    "name": target.name,
-                    "content": None,
-                    "type": "binary",
-                    "message": "Binary file, cannot display"
-                }
-        else:
+def read_text_file(path: str) -> dict:
+    target = safe_path(path)
+    
+    if not target.exists():
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    if not target.is_file():
+        raise HTTPException(status_code=400, detail="Not a file")
+    
+    # Проверяем размер (макс 1MB для текстовых)
+    if target.stat().st_size > 1_000_000:
+        raise HTTPException(status_code=413, detail="File too large (max 1MB)")
+    
+    # Определяем тип файла
+    text_extensions = {'.txt', '.md', '.json', '.py', '.js', '.html', '.css', '.yaml', '.yml', '.xml', '.csv', '.log', '.bat', '.sh', '.ps1', '.env', '.gitignore', '.toml', '.ini', '.cfg'}
+    
+    if target.suffix.lower() in text_extensions or target.suffix == '':
+        try:
+            content = target.read_text(encoding='utf-8')
+            return {
+                "path": path,
+                "name": target.name,
+                "content": content,
+                "type": "text",
+                "size": len(content)
+            }
+        except UnicodeDecodeError:
             return {
                 "path": path,
                 "name": target.name,
                 "content": None,
                 "type": "binary",
-                "message": f"Binary file ({target.suffix})"
+                "message": "Binary file, cannot display"
             }
+    else:
+        return {
+            "path": path,
+            "name": target.name,
+            "content": None,
+            "type": "binary",
+            "message": f"Binary file ({target.suffix})"
+        }
+
+@app.get("/api/file")
+async def read_file(path: str):
+    """Прочитать содержимое файла"""
+    try:
+        return await fs_io.run(read_text_file, path)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def write_text_file(path: str, content: str):
+    target = safe_path(path)
+    
+    # Создаём родительские директории если нужно
+    target.parent.mkdir(parents=True, exist_ok=True)
+    
+    # Сохраняем
+    target.write_text(content, encoding='utf-8')
+
 @app.put("/api/file")
 async def save_file(request: Request):
     """Сохранить файл"""
@@ -845,13 +2924,7 @@ async def save_file(request: Request):
         path = data.get("path", "")
         content = data.get("content", "")
         
-        target = safe_path(path)
-        
-        # Создаём родительские директории если нужно
-        target.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Сохраняем
-        target.write_text(content, encoding='utf-8')
+        await fs_io.run(write_text_file, path, content)
         
         return {"status": "ok", "path": path, "size": len(content)}
     except HTTPException:
@@ -867,7 +2940,7 @@ async def create_folder(request: Request):
         path = data.get("path", "")
         
         target = safe_path(path)
-        target.mkdir(parents=True, exist_ok=True)
+        await fs_io.run(functools.partial(target.mkdir, parents=True, exist_ok=True))
         
         return {"status": "ok", "path": path}
     except HTTPException:
@@ -875,6 +2948,21 @@ async def create_folder(request: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def remove_path(path: str):
+    target = safe_path(path)
+    
+    if not target.exists():
+        raise HTTPException(status_code=404, detail="Path not found")
+    
+    if target.is_file():
+        target.unlink()
+    else:
+        # Удаляем только пустые папки для безопасности
+        with os.scandir(target) as it:
+            if any(True for _ in it):
+                raise HTTPException(status_code=400, detail="Folder not empty")
+        target.rmdir()
+
 @app.delete("/api/file")
 async def delete_file(path: str, confirm: bool = False):
     """Удалить файл или папку"""
@@ -882,18 +2970,7 @@ async def delete_file(path: str, confirm: bool = False):
         raise HTTPException(status_code=400, detail="Confirmation required (confirm=true)")
     
     try:
-        target = safe_path(path)
-        
-        if not target.exists():
-            raise HTTPException(status_code=404, detail="Path not found")
-        
-        if target.is_file():
-            target.unlink()
-        else:
-            # Удаляем только пустые папки для безопасности
-            if any(target.iterdir()):
-                raise HTTPException(status_code=400, detail="Folder not empty")
-            target.rmdir()
+        await fs_io.run(remove_path, path)
         
         return {"status": "ok", "deleted": path}
     except HTTPException:
@@ -902,21 +2979,31 @@ async def delete_file(path: str, confirm: bool = False):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/files/open")
-async def open_file(path: str):
-    """Открыть/скачать файл"""
+async def open_file(path: str, request: Request):
+    """Открыть/скачать файл (с поддержкой Range и докачки)"""
     try:
         target = safe_path(path)
         
-        if not target.exists():
+        try:
+            stat = await fs_io.run(target.stat)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="File not found")
         
-        if not target.is_file():
+        if not S_ISREG(stat.st_mode):
             raise HTTPException(status_code=400, detail="Not a file")
         
-        return FileResponse(
-            path=target,
-            filename=target.name,
-            media_type='application/octet-stream'
+        etag, last_modified = file_validators(stat.st_size, stat.st_mtime)
+        if is_not_modified(request, etag, stat.st_mtime):
+            return Response(status_code=304, headers={"ETag": etag, "Last-Modified": last_modified})
+        
+        byte_range = parse_range(request, stat.st_size, etag, last_modified)
+        start, end = byte_range or (0, stat.st_size - 1)
+        
+        return StreamingResponse(
+            iter_file(target, start, end - start + 1),
+            status_code=206 if byte_range else 200,
+            media_type='application/octet-stream',
+            headers=download_headers(target.name, stat.st_size, etag, last_modified, byte_range)
         )
     except HTTPException:
         raise
@@ -22,6 +22,7 @@ document.addEventListener('DOMContentLoaded', () => {
     updateDate();
     setInterval(updateDate, 60000);
     loadVersionInfo();
+    connectEvents();
     
     if (window.Telegram?.WebApp) {
         Telegram.WebApp.ready();
@@ -151,19 +152,21 @@ async function openFolder(path) {
     pathHistory.push(path);
 
     try {
-        const response = await fetch(`${API_BASE}/api/pc/files?path=${encodeURIComponent(path)}`);
-        const data = await response.json();
+        // Папку показываем по первой строке, элементы дорисовываются по мере прихода
+        const meta = await streamFolder(path, 'fileList', path, () => {
+            document.getElementById('currentPath').textContent = path.split('/').pop() || path;
+            updateFileBreadcrumb();
+            showView('fileBrowser');
+            showLoading(false);
+        });
 
-        if (data.error) {
-            alert(data.pc_online === false ? 'ПК не подключён' : 'Ошибка: ' + data.error);
+        if (meta.error) {
+            alert(meta.pc_online === false ? 'ПК не подключён' : 'Ошибка: ' + meta.error);
             showLoading(false);
             return;
         }
 
-        renderFiles(data.items || [], 'fileList');
-        document.getElementById('currentPath').textContent = path.split('/').pop() || path;
-        updateFileBreadcrumb();
-        showView('fileBrowser');
+        if (meta.offline) showToast('📴 ПК офлайн — сохранённая копия');
     } catch (e) {
         alert('Ошибка: ' + e.message);
     }
@@ -171,6 +174,49 @@ async function openFolder(path) {
     showLoading(false);
 }
 
+// NDJSON-листинг: первая строка — сведения о папке, дальше по элементу на строку
+async function streamFolder(path, listId, basePath, onStart) {
+    const response = await fetch(`${API_BASE}/api/pc/files?path=${encodeURIComponent(path)}&stream=true`);
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const list = document.getElementById(listId);
+    let buffer = '';
+    let meta = null;
+    let count = 0;
+
+    while (true) {
+        const { done, value } = await reader.read();
+        buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+        const lines = buffer.split('\n');
+        buffer = done ? '' : lines.pop();
+
+        const items = [];
+        for (const line of lines) {
+            if (!line) continue;
+            const entry = JSON.parse(line);
+            if (!meta) {
+                meta = entry;
+                if (meta.error) return meta;
+                list.innerHTML = '';
+                onStart && onStart(meta);
+            } else if (entry.error) {
+                showToast('Ошибка: ' + entry.error);
+            } else {
+                items.push(entry);
+            }
+        }
+        if (items.length) {
+            appendFileItems(list, items, basePath);
+            count += items.length;
+        }
+        if (done) break;
+    }
+
+    if (!meta) return { error: 'Empty response' };
+    if (count === 0) renderFiles([], listId, basePath);
+    return meta;
+}
+
 function updateFileBreadcrumb() {
     const bc = document.getElementById('fileBreadcrumb');
     const relativePath = currentPath.replace(archiveRootPath, '').replace(/^\//, '');
@@ -208,6 +254,78 @@ function goBack() {
     }
 }
 
+async function refreshFolder() {
+    try {
+        const response = await fetch(`${API_BASE}/api/pc/files?path=${encodeURIComponent(currentPath)}`);
+        const data = await response.json();
+        if (!data.error) renderFiles(data.items || [], 'fileList');
+    } catch (e) {
+        console.log('Refresh failed:', e.message);
+    }
+}
+
+// ===== LIVE EVENTS =====
+let characterState = null;  // { revision, data } — живая копия data.json
+
+function connectEvents() {
+    const proto = location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${proto}://${location.host}/ws/chat`);
+    socket.onopen = () => socket.send(JSON.stringify({ type: 'subscribe', topics: ['state'] }));
+    socket.onmessage = (event) => {
+        const msg = JSON.parse(event.data);
+        if (msg.type === 'fs_change') handleFsChange(msg.paths || []);
+        else if (msg.type === 'state_snapshot') setCharacterState(msg.revision, msg.data);
+        else if (msg.type === 'data_patch') handleStatePatch(socket, msg);
+    };
+    socket.onclose = () => setTimeout(connectEvents, 5000);
+}
+
+function setCharacterState(revision, data) {
+    characterState = { revision, data };
+    document.dispatchEvent(new CustomEvent('statechange', { detail: characterState }));
+}
+
+function handleStatePatch(socket, msg) {
+    if (!characterState) return;  // Ждём state_snapshot
+    if (msg.base !== characterState.revision) {
+        // Пропустили изменение — запрашиваем документ заново
+        socket.send(JSON.stringify({ type: 'subscribe', topics: ['state'] }));
+        return;
+    }
+    const data = structuredClone(characterState.data);
+    msg.patch.forEach(op => applyPatchOp(data, op));
+    setCharacterState(msg.revision, data);
+}
+
+function applyPatchOp(doc, op) {
+    const tokens = op.path.split('/').slice(1).map(t => t.replace(/~1/g, '/').replace(/~0/g, '~'));
+    const key = tokens.pop();
+    const parent = tokens.reduce((node, t) => node[t], doc);
+    if (Array.isArray(parent)) {
+        const index = key === '-' ? parent.length : Number(key);
+        if (op.op === 'add') parent.splice(index, 0, op.value);
+        else if (op.op === 'remove') parent.splice(index, 1);
+        else parent[index] = op.value;
+    } else if (op.op === 'remove') {
+        delete parent[key];
+    } else {
+        parent[key] = op.value;
+    }
+}
+
+function handleFsChange(paths) {
+    const norm = p => (p || '').replace(/^\/+|\/+$/g, '');
+    const changed = new Set(paths.map(norm));
+    const isActive = id => document.getElementById(id)?.classList.contains('active');
+
+    if (isActive('fileBrowser') && changed.has(norm(currentPath))) {
+        refreshFolder();
+    }
+    if (isActive('downloadsView') && changed.has(norm(downloadsCurrentPath))) {
+        loadDownloadsFolder(downloadsCurrentPath);
+    }
+}
+
 // ===== DOWNLOADS TAB =====
 let downloadsCurrentPath = '';
 let downloadsRootPath = '';
@@ -233,6 +351,7 @@ async function loadDownloadsFolder(folder) {
         } else {
             renderDownloadsFiles(data.items || []);
             updateBreadcrumb();
+            if (data.offline) showToast('📴 ПК офлайн — сохранённая копия');
         }
     } catch (e) {
         document.getElementById('downloadsFileList').innerHTML = 
@@ -315,6 +434,11 @@ function renderFiles(items, listId, basePath = currentPath) {
         return;
     }
 
+    appendFileItems(list, items, basePath);
+}
+
+function appendFileItems(list, items, basePath) {
+    const fragment = document.createDocumentFragment();
     items.forEach(file => {
         const isFolder = file.type === 'folder';
         const item = document.createElement('div');
@@ -334,8 +458,13 @@ function renderFiles(items, listId, basePath = currentPath) {
                 <div class="file-meta">${isFolder ? 'Папка' : formatSize(file.size || 0)}</div>
             </div>
         `;
-        list.appendChild(item);
+        if (!isFolder && hasThumbnail(file.name)) {
+            item.dataset.thumb = `${API_BASE}/api/pc/thumb?path=${encodeURIComponent(basePath + '/' + file.name)}&size=128`;
+            thumbObserver ? thumbObserver.observe(item) : loadThumbnail(item);
+        }
+        fragment.appendChild(item);
     });
+    list.appendChild(fragment);
 }
 
 // ===== HELPER =====
@@ -899,6 +1028,28 @@ function showLoading(show) {
     document.getElementById('loading').classList.toggle('active', show);
 }
 
+// Превью запрашиваются, только когда строка показалась на экране
+const thumbObserver = 'IntersectionObserver' in window
+    ? new IntersectionObserver(entries => entries.forEach(entry => {
+        if (!entry.isIntersecting) return;
+        thumbObserver.unobserve(entry.target);
+        loadThumbnail(entry.target);
+    }), { rootMargin: '200px' })
+    : null;
+
+function loadThumbnail(item) {
+    const img = new Image();
+    img.className = 'file-thumb';
+    img.alt = '';
+    img.onload = () => item.querySelector('.file-icon').replaceChildren(img);  // Не получилось — остаётся значок
+    img.src = item.dataset.thumb;
+}
+
+function hasThumbnail(name) {
+    const ext = name.split('.').pop().toLowerCase();
+    return ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'tif', 'tiff', 'pdf'].includes(ext);
+}
+
 function getFileIcon(name) {
     const ext = name.split('.').pop().toLowerCase();
     const icons = {
@@ -1086,10 +1237,20 @@ async function sendAiMessage() {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 model: 'anthropic/claude-opus-4-5',
-                messages: aiChatHistory
+                messages: aiChatHistory,
+                stream: true
             })
         });
 
+        if ((response.headers.get('Content-Type') || '').includes('text/event-stream')) {
+            const reply = await readAiStream(response, thinkingId);
+            if (reply) {
+                aiChatHistory.push({ role: 'assistant', content: reply });
+                speakText(reply);
+            }
+            return;
+        }
+
         const data = await response.json();
         
         // Remove thinking message
@@ -1111,6 +1272,47 @@ async function sendAiMessage() {
     }
 }
 
+// Ответ приходит по токенам (SSE) — показываем текст по мере поступления
+async function readAiStream(response, thinkingId) {
+    const container = document.getElementById('aiChatMessages');
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let reply = '';
+    let contentEl = null;
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+
+        for (const line of lines) {
+            if (!line.startsWith('data:')) continue;
+            const payload = line.slice(5).trim();
+            if (!payload || payload === '[DONE]') continue;
+            try {
+                const delta = JSON.parse(payload).choices?.[0]?.delta?.content;
+                if (!delta) continue;
+                if (!contentEl) {
+                    document.getElementById(thinkingId)?.remove();
+                    const msgId = addChatMessage('', 'assistant');
+                    contentEl = document.querySelector(`#${msgId} .message-content`);
+                }
+                reply += delta;
+                contentEl.textContent = reply;
+                container.scrollTop = container.scrollHeight;
+            } catch (e) {
+                console.log('SSE parse error:', e.message);
+            }
+        }
+    }
+
+    document.getElementById(thinkingId)?.remove();
+    return reply;
+}
+
 function addChatMessage(text, type) {
     const container = document.getElementById('aiChatMessages');
     const msgId = 'msg-' + Date.now();
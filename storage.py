@@ -0,0 +1,315 @@
+"""
+JSON Store для Fantasy Dashboard
+Общий data.json для bot.py и server.py: кэш в памяти, атомарная запись, межпроцессная блокировка
+"""
+
+import copy
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+REVISION_KEY = '_rev'  # Номер ревизии хранится в самом документе
+
+@contextmanager
+def file_lock(lock_path):
+    """Эксклюзивная блокировка файла между процессами (flock / msvcrt)"""
+    with open(lock_path, 'a+') as f:
+        if os.name == 'nt':
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+class JSONStore:
+    """JSON-документ: чтение из памяти, запись через temp + rename, ревизия растёт с каждой записью"""
+
+    def __init__(self, path, default=None):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self.default = default  # Функция, возвращающая документ по умолчанию
+        self._data = None
+        self._stat = None  # (inode, mtime_ns, size) файла, из которого взят кэш
+        self._lock = threading.RLock()
+
+    def _file_lock(self):
+        """Эксклюзивная блокировка между процессами (bot.py и server.py)"""
+        return file_lock(self.lock_path)
+
+    def _disk_stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        """Перечитать файл, только если его изменил кто-то другой"""
+        stat = self._disk_stat()
+        if self._data is not None and stat == self._stat:
+            return
+
+        if stat is None:
+            if self.default is None:
+                raise FileNotFoundError(str(self.path))
+            self._data = self.default()
+        else:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+        self._stat = stat
+
+    def _current_revision(self) -> int:
+        """Ревизия на диске (0, если файла ещё нет)"""
+        try:
+            self._refresh()
+        except FileNotFoundError:
+            return 0
+        return self._data.get(REVISION_KEY, 0)
+
+    def _write(self, data: dict, revision: int):
+        data[REVISION_KEY] = revision + 1
+        tmp = self.path.with_name(f'.{self.path.name}.{os.getpid()}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._data = data
+        self._stat = self._disk_stat()
+
+    @property
+    def fingerprint(self):
+        """Отпечаток файла на диске: меняется при любой записи (в т.ч. из другого процесса)"""
+        with self._lock:
+            self._refresh()
+            return self._stat
+
+    @property
+    def revision(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._data.get(REVISION_KEY, 0)
+
+    def read(self) -> dict:
+        """Текущий документ (копия; диск читается только после чужой записи)"""
+        with self._lock:
+            self._refresh()
+            return copy.deepcopy(self._data)
+
+    @contextmanager
+    def transaction(self, expected_revision: int = None):
+        """Прочитать-изменить-записать под блокировкой: with store.transaction() as data: ..."""
+        with self._lock, self._file_lock():
+            self._refresh()
+            current = self._data.get(REVISION_KEY, 0)
+            if expected_revision is not None and expected_revision != current:
+                raise RevisionConflict(current)
+            data = copy.deepcopy(self._data)
+            yield data
+            if data != self._data:
+                self._write(data, self._data.get(REVISION_KEY, 0))
+
+    def write(self, data: dict, expected_revision: int = None) -> int:
+        """Заменить документ целиком; expected_revision — защита от потерянных обновлений"""
+        with self._lock, self._file_lock():
+            current = self._current_revision()
+            if expected_revision is not None and expected_revision != current:
+                raise RevisionConflict(current)
+            self._write(copy.deepcopy(data), current)
+            return current + 1
+
+class RevisionConflict(Exception):
+    """Документ изменился с момента чтения"""
+
+    def __init__(self, current: int):
+        super().__init__(f'Revision conflict (current: {current})')
+        self.current = current
+
+# ===== JSON PATCH (RFC 6902) / MERGE PATCH (RFC 7396) =====
+
+class PatchError(ValueError):
+    """Патч некорректен или не применим к документу"""
+
+def _pointer(path: str) -> list:
+    """JSON Pointer → список токенов"""
+    if path == '':
+        return []
+    if not path.startswith('/'):
+        raise PatchError(f'Invalid pointer: {path}')
+    return [t.replace('~1', '/').replace('~0', '~') for t in path[1:].split('/')]
+
+def _escape(token) -> str:
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+def _index(container: list, token: str, allow_end: bool = False) -> int:
+    if allow_end and token == '-':
+        return len(container)
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise PatchError(f'Invalid array index: {token}')
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise PatchError(f'Array index out of range: {token}')
+    return index
+
+def _parent(doc, tokens: list):
+    """Контейнер, в котором лежит последний токен пути"""
+    if not tokens:
+        raise PatchError('Operation on document root is not allowed')
+    node = doc
+    for token in tokens[:-1]:
+        if isinstance(node, dict):
+            if token not in node:
+                raise PatchError(f'Path not found: /{"/".join(map(_escape, tokens))}')
+            node = node[token]
+        elif isinstance(node, list):
+            node = node[_index(node, token)]
+        else:
+            raise PatchError(f'Path not found: /{"/".join(map(_escape, tokens))}')
+    return node, tokens[-1]
+
+def _get(doc, path: str):
+    node = doc
+    for token in _pointer(path):
+        if isinstance(node, dict) and token in node:
+            node = node[token]
+        elif isinstance(node, list):
+            node = node[_index(node, token)]
+        else:
+            raise PatchError(f'Path not found: {path}')
+    return node
+
+def _add(doc, path: str, value):
+    parent, token = _parent(doc, _pointer(path))
+    if isinstance(parent, dict):
+        parent[token] = value
+    elif isinstance(parent, list):
+        parent.insert(_index(parent, token, allow_end=True), value)
+    else:
+        raise PatchError(f'Path not found: {path}')
+
+def _remove(doc, path: str):
+    parent, token = _parent(doc, _pointer(path))
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise PatchError(f'Path not found: {path}')
+        return parent.pop(token)
+    if isinstance(parent, list):
+        return parent.pop(_index(parent, token))
+    raise PatchError(f'Path not found: {path}')
+
+def _equal(a, b) -> bool:
+    """Равенство для "test" по RFC 6902: как ==, но true не равно 1, а "1" — не 1"""
+    if isinstance(a, bool) or isinstance(b, bool):
+        return type(a) is type(b) and a == b
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a == b  # 1 и 1.0 — одно и то же число JSON
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_equal(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    return type(a) is type(b) and a == b
+
+def apply_json_patch(doc: dict, operations: list) -> dict:
+    """Применить JSON Patch на месте; при ошибке документ может быть изменён частично"""
+    if not isinstance(operations, list):
+        raise PatchError('JSON Patch must be an array of operations')
+
+    for op in operations:
+        if not isinstance(op, dict) or 'path' not in op:
+            raise PatchError(f'Invalid operation: {op}')
+        name, path = op.get('op'), op['path']
+
+        if name in ('add', 'replace', 'test') and 'value' not in op:
+            raise PatchError(f'"{name}" requires "value"')
+        if name in ('move', 'copy') and 'from' not in op:
+            raise PatchError(f'"{name}" requires "from"')
+
+        if name == 'add':
+            _add(doc, path, copy.deepcopy(op['value']))
+        elif name == 'remove':
+            _remove(doc, path)
+        elif name == 'replace':
+            _remove(doc, path)
+            _add(doc, path, copy.deepcopy(op['value']))
+        elif name == 'move':
+            if path.startswith(op['from'] + '/'):
+                raise PatchError('Cannot move a value into its own child')
+            _add(doc, path, _remove(doc, op['from']))
+        elif name == 'copy':
+            _add(doc, path, copy.deepcopy(_get(doc, op['from'])))
+        elif name == 'test':
+            if not _equal(_get(doc, path), op['value']):
+                raise PatchError(f'Test failed: {path}')
+        else:
+            raise PatchError(f'Unknown operation: {name}')
+    return doc
+
+def apply_merge_patch(target, patch):
+    """Применить Merge Patch: null удаляет ключ, объекты сливаются, остальное заменяется"""
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    if not isinstance(target, dict):
+        target = {}
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = apply_merge_patch(target.get(key), value)
+    return target
+
+def diff_documents(old, new, path: str = '') -> list:
+    """Минимальный JSON Patch, превращающий old в new (для рассылки клиентам)"""
+    if type(old) is not type(new):
+        return [{'op': 'replace', 'path': path, 'value': new}]
+
+    if isinstance(old, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': f'{path}/{_escape(key)}'})
+        for key, value in new.items():
+            child = f'{path}/{_escape(key)}'
+            if key not in old:
+                ops.append({'op': 'add', 'path': child, 'value': value})
+            else:
+                ops.extend(diff_documents(old[key], value, child))
+        return ops
+
+    if isinstance(old, list):
+        # Частый случай — дописали в конец (новый квест, заклинание)
+        common = min(len(old), len(new))
+        ops = []
+        for i in range(common):
+            ops.extend(diff_documents(old[i], new[i], f'{path}/{i}'))
+        if len(new) > len(old):
+            ops.extend({'op': 'add', 'path': f'{path}/{i}', 'value': new[i]} for i in range(common, len(new)))
+        else:
+            ops.extend({'op': 'remove', 'path': f'{path}/{i}'} for i in reversed(range(common, len(old))))
+        if len(ops) > len(new):
+            return [{'op': 'replace', 'path': path, 'value': new}]
+        return ops
+
+    if old != new:
+        return [{'op': 'replace', 'path': path, 'value': new}]
+    return []
@@ -0,0 +1,8 @@
+"""
+Тесты Fantasy Dashboard: модули лежат в корне репозитория
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
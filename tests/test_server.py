@@ -0,0 +1,209 @@
+"""
+Тесты вспомогательных функций server.py: Range/If-Range, курсоры листинга, кодек кадров bridge
+"""
+
+import json
+import zlib
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import server
+from server import (
+    CODEC_COMPRESSED, CODEC_MSGPACK, COMPRESS_MIN_SIZE, FrameCodec,
+    decode_cursor, encode_cursor, file_validators, page_listing, parse_range, sort_listing
+)
+
+# ===== RANGE / IF-RANGE =====
+
+SIZE = 1000
+ETAG, LAST_MODIFIED = file_validators(SIZE, 1700000000.0)
+
+def make_request(**headers) -> Request:
+    raw = [(name.replace("_", "-").lower().encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw})
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, SIZE - 1)),
+    ("bytes=-100", (SIZE - 100, SIZE - 1)),
+    ("bytes=-5000", (0, SIZE - 1)),
+    ("bytes=990-5000", (990, SIZE - 1)),
+    ("bytes=999-999", (999, 999)),
+])
+def test_range(header, expected):
+    assert parse_range(make_request(range=header), SIZE, ETAG, LAST_MODIFIED) == expected
+
+@pytest.mark.parametrize("header", ["", "items=0-1", "bytes=0-1,5-6", "bytes=a-b", "bytes=-"])
+def test_range_ignored(header):
+    assert parse_range(make_request(range=header), SIZE, ETAG, LAST_MODIFIED) is None
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=1000-2000", "bytes=50-10", "bytes=-0"])
+def test_range_not_satisfiable(header):
+    with pytest.raises(HTTPException) as exc:
+        parse_range(make_request(range=header), SIZE, ETAG, LAST_MODIFIED)
+    assert exc.value.status_code == 416
+    assert exc.value.headers["Content-Range"] == f"bytes */{SIZE}"
+
+@pytest.mark.parametrize("validator", [ETAG, LAST_MODIFIED])
+def test_if_range_matches(validator):
+    request = make_request(range="bytes=10-19", if_range=validator)
+    assert parse_range(request, SIZE, ETAG, LAST_MODIFIED) == (10, 19)
+
+@pytest.mark.parametrize("validator", ['"other"', f"W/{ETAG}", "Tue, 01 Jan 2000 00:00:00 GMT"])
+def test_if_range_mismatch_sends_whole_file(validator):
+    request = make_request(range="bytes=10-19", if_range=validator)
+    assert parse_range(request, SIZE, ETAG, LAST_MODIFIED) is None
+
+def test_if_range_mismatch_skips_416():
+    request = make_request(range="bytes=5000-", if_range='"other"')
+    assert parse_range(request, SIZE, ETAG, LAST_MODIFIED) is None
+
+# ===== КУРСОРЫ ЛИСТИНГА =====
+
+def make_listing(folders: int, files: int) -> dict:
+    items = [
+        {"name": f"Папка {i:02d}", "type": "folder", "size": None, "modified": f"2026-01-{i % 28 + 1:02d}T00:00:00"}
+        for i in range(folders)
+    ] + [
+        {"name": f"file{i:03d}.txt", "type": "file", "size": (i * 37) % 11, "modified": f"2026-02-{i % 28 + 1:02d}T00:00:00"}
+        for i in range(files)
+    ]
+    return {"path": "/x", "id": "req_1", "type": "response", "items": items[::-1]}
+
+def walk_pages(listing: dict, limit: int, sort: str, order: str) -> list:
+    names, cursor = [], ""
+    while True:
+        page = page_listing(listing, limit, cursor, sort, order)
+        assert len(page["items"]) <= limit
+        names.extend(item["name"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            return names
+
+@pytest.mark.parametrize("sort", ["name", "mtime", "size"])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+@pytest.mark.parametrize("folders, files, limit", [
+    (3, 7, 3),  # Граница страницы внутри группы папок
+    (4, 4, 4),  # Страница кончается ровно на последней папке
+    (5, 0, 2),
+    (0, 5, 2),
+    (10, 25, 1),
+    (2, 3, 100),
+])
+def test_pages_cover_listing_in_order(sort, order, folders, files, limit):
+    listing = make_listing(folders, files)
+    expected = [item["name"] for item in sort_listing(listing["items"], sort, order)]
+    assert walk_pages(listing, limit, sort, order) == expected
+
+def test_page_strips_internal_fields():
+    page = page_listing(make_listing(1, 1), 10)
+    assert "id" not in page and "type" not in page
+    assert page["total"] == 2 and page["next_cursor"] is None
+
+def test_folders_come_first_in_both_orders():
+    listing = make_listing(2, 2)
+    for order in ("asc", "desc"):
+        page = page_listing(listing, 2, "", "name", order)
+        assert all(item["type"] == "folder" for item in page["items"])
+
+def test_cursor_round_trip():
+    item = {"name": "Отчёт.docx", "type": "file", "size": 10, "modified": "2026-01-01T00:00:00"}
+    cursor = encode_cursor(item, "size", "desc")
+    assert "=" not in cursor
+    assert decode_cursor(cursor, "size", "desc") == (1, [10, "отчёт.docx", "Отчёт.docx"])
+
+@pytest.mark.parametrize("cursor, sort, order", [
+    ("!!!", "name", "asc"),
+    ("e30", "name", "asc"),
+    (None, "mtime", "asc"),
+    (None, "name", "desc"),
+])
+def test_cursor_rejected(cursor, sort, order):
+    if cursor is None:
+        cursor = encode_cursor({"name": "a", "type": "file"}, "name", "asc")
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, sort, order)
+
+# ===== КОДЕК КАДРОВ =====
+
+BIG = {"type": "response", "id": "req_1", "items": [{"name": f"file{i}.txt", "size": i} for i in range(200)]}
+SMALL = {"type": "pong", "seq": 1}
+
+def codecs():
+    params = [(None, "json"), ("zlib", "json")]
+    if server.zstandard is not None:
+        params.append(("zstd", "json"))
+    if server.msgpack is not None:
+        params += [(None, "msgpack"), ("zlib", "msgpack")]
+        if server.zstandard is not None:
+            params.append(("zstd", "msgpack"))
+    return params
+
+def decode_any(codec: FrameCodec, frame) -> dict:
+    return json.loads(frame) if isinstance(frame, str) else codec.decode(frame)
+
+@pytest.mark.parametrize("compression, encoding", codecs())
+@pytest.mark.parametrize("message", [SMALL, BIG])
+def test_codec_round_trip(compression, encoding, message):
+    sender, receiver = FrameCodec(compression, encoding), FrameCodec(compression, encoding)
+    assert decode_any(receiver, sender.encode(message)) == message
+
+def test_plain_json_stays_text():
+    frame = FrameCodec().encode(BIG)
+    assert isinstance(frame, str) and json.loads(frame) == BIG
+
+def test_large_frames_are_compressed():
+    codec = FrameCodec("zlib")
+    frame = codec.encode(BIG)
+    assert isinstance(frame, bytes) and frame[1] == CODEC_COMPRESSED
+    assert codec.stats()["ratio"] < 1
+
+def test_small_frames_are_not_compressed():
+    assert len(json.dumps(SMALL)) < COMPRESS_MIN_SIZE
+    assert isinstance(FrameCodec("zlib").encode(SMALL), str)
+
+@pytest.mark.skipif(server.msgpack is None, reason="msgpack не установлен")
+def test_msgpack_flag():
+    frame = FrameCodec(None, "msgpack").encode(SMALL)
+    assert frame[1] == CODEC_MSGPACK
+
+def test_zlib_frame_from_bridge():
+    body = json.dumps(BIG).encode()
+    frame = bytes((0, CODEC_COMPRESSED)) + zlib.compress(body)
+    assert FrameCodec("zlib").decode(frame) == BIG
+
+@pytest.mark.parametrize("compression, encoding", codecs())
+def test_bridge_frames_decode_on_server(compression, encoding):
+    import pc_bridge
+    frame = pc_bridge.FrameCodec(compression, encoding).encode(BIG)
+    assert decode_any(FrameCodec(compression, encoding), frame) == BIG
+
+def broken_frames():
+    frames = [
+        b"\x00",  # Нет байта флагов
+        bytes((0, CODEC_COMPRESSED)) + b"not zlib",
+        bytes((0, 0)) + b"{broken",
+        bytes((0, 0)) + b"\xff\xfe",
+        bytes((0, 0)) + b"[1, 2]",  # Не объект
+    ]
+    if server.msgpack is not None:
+        frames += [bytes((0, CODEC_MSGPACK)) + b"\xc1", bytes((0, CODEC_MSGPACK)) + b"\x93\x01"]
+    return frames
+
+@pytest.mark.parametrize("compression", [None, "zlib"] + (["zstd"] if server.zstandard is not None else []))
+@pytest.mark.parametrize("frame", broken_frames())
+def test_broken_frames_raise_value_error(compression, frame):
+    import pc_bridge
+    for codec in (FrameCodec(compression), pc_bridge.FrameCodec(compression)):
+        with pytest.raises(ValueError):
+            codec.decode(frame)
+
+@pytest.mark.skipif(server.zstandard is None, reason="zstandard не установлен")
+def test_broken_zstd_frame_raises_value_error():
+    import pc_bridge
+    frame = bytes((0, CODEC_COMPRESSED)) + b"\x28\xb5\x2f\xfd garbage"
+    for codec in (FrameCodec("zstd"), pc_bridge.FrameCodec("zstd")):
+        with pytest.raises(ValueError):
+            codec.decode(frame)
@@ -0,0 +1,134 @@
+"""
+Тесты storage.py: JSON Patch (RFC 6902), Merge Patch (RFC 7396) и diff_documents
+"""
+
+import copy
+
+import pytest
+
+from storage import PatchError, apply_json_patch, apply_merge_patch, diff_documents
+
+# ===== JSON PATCH =====
+
+def test_move_into_own_child_is_rejected():
+    doc = {"a": {"b": 1}}
+    with pytest.raises(PatchError):
+        apply_json_patch(doc, [{"op": "move", "from": "/a", "path": "/a/c"}])
+    assert doc == {"a": {"b": 1}}
+
+def test_move_to_sibling_with_common_prefix():
+    doc = {"a": 1, "ab": {}}
+    apply_json_patch(doc, [{"op": "move", "from": "/a", "path": "/ab/x"}])
+    assert doc == {"ab": {"x": 1}}
+
+def test_copy_into_own_child():
+    doc = {"a": {"b": 1}}
+    apply_json_patch(doc, [{"op": "copy", "from": "/a", "path": "/a/c"}])
+    assert doc == {"a": {"b": 1, "c": {"b": 1}}}
+
+def test_copy_is_deep():
+    doc = {"a": {"list": [1]}}
+    apply_json_patch(doc, [{"op": "copy", "from": "/a", "path": "/b"}])
+    doc["b"]["list"].append(2)
+    assert doc["a"] == {"list": [1]}
+
+def test_dash_appends_to_array():
+    doc = {"items": [1, 2]}
+    apply_json_patch(doc, [{"op": "add", "path": "/items/-", "value": 3}])
+    assert doc == {"items": [1, 2, 3]}
+
+@pytest.mark.parametrize("op", [
+    {"op": "remove", "path": "/items/-"},
+    {"op": "replace", "path": "/items/-", "value": 0},
+    {"op": "test", "path": "/items/-", "value": 2},
+])
+def test_dash_only_valid_for_add(op):
+    with pytest.raises(PatchError):
+        apply_json_patch({"items": [1, 2]}, [op])
+
+@pytest.mark.parametrize("index", ["01", "00", "-1", "1.0", " 1"])
+def test_invalid_array_indices(index):
+    with pytest.raises(PatchError):
+        apply_json_patch({"items": [1, 2]}, [{"op": "replace", "path": f"/items/{index}", "value": 0}])
+
+def test_index_zero_and_end():
+    doc = {"items": [1, 2]}
+    apply_json_patch(doc, [
+        {"op": "add", "path": "/items/0", "value": 0},
+        {"op": "add", "path": "/items/3", "value": 3},
+    ])
+    assert doc == {"items": [0, 1, 2, 3]}
+    with pytest.raises(PatchError):
+        apply_json_patch(doc, [{"op": "add", "path": "/items/5", "value": 5}])
+
+def test_escaped_pointer_tokens():
+    doc = {"a/b": 1, "m~n": 2}
+    apply_json_patch(doc, [
+        {"op": "test", "path": "/a~1b", "value": 1},
+        {"op": "test", "path": "/m~0n", "value": 2},
+    ])
+
+@pytest.mark.parametrize("actual, expected", [
+    (True, 1),
+    (1, True),
+    (False, 0),
+    (0, None),
+    ("1", 1),
+    ([True], [1]),
+    ({"a": 1}, {"a": True}),
+    ({"a": 1}, {"a": 1, "b": 2}),
+])
+def test_test_is_type_strict(actual, expected):
+    with pytest.raises(PatchError):
+        apply_json_patch({"v": actual}, [{"op": "test", "path": "/v", "value": expected}])
+
+@pytest.mark.parametrize("actual, expected", [
+    (1, 1.0),
+    (True, True),
+    (None, None),
+    ({"a": [1, {"b": "x"}]}, {"a": [1.0, {"b": "x"}]}),
+])
+def test_test_passes_on_equal_values(actual, expected):
+    apply_json_patch({"v": actual}, [{"op": "test", "path": "/v", "value": expected}])
+
+def test_root_operations_are_rejected():
+    with pytest.raises(PatchError):
+        apply_json_patch({}, [{"op": "replace", "path": "", "value": {}}])
+
+# ===== MERGE PATCH =====
+
+def test_merge_null_deletes_keys():
+    target = {"a": 1, "b": {"c": 2, "d": 3}}
+    result = apply_merge_patch(target, {"a": None, "b": {"c": None}, "missing": None})
+    assert result == {"b": {"d": 3}}
+
+def test_merge_replaces_non_objects():
+    assert apply_merge_patch({"a": [1, 2]}, {"a": [3]}) == {"a": [3]}
+    assert apply_merge_patch({"a": 1}, {"a": {"b": None, "c": 1}}) == {"a": {"c": 1}}
+
+# ===== DIFF → APPLY =====
+
+ROUND_TRIPS = [
+    ({"a": 1}, {"a": 2}),
+    ({"a": 1}, {"b": 1}),
+    ({"a": True}, {"a": 1}),
+    ({"a": 1}, {"a": 1.5}),
+    ({"list": [1, 2, 3]}, {"list": [1, 2, 3, 4, 5]}),
+    ({"list": [1, 2, 3, 4, 5]}, {"list": [1]}),
+    ({"list": [1, 2, 3]}, {"list": ["x", "y", "z"]}),
+    ({"list": [{"a": 1}]}, {"list": [{"a": 2}, {"b": 3}]}),
+    ({"a/b": {"m~n": 1}}, {"a/b": {"m~n": 2}}),
+    ({"a": {"b": 1}}, {"a": None}),
+    ({"quests": [], "character": {"level": 1}}, {"quests": [{"id": 1}], "character": {"level": 2}}),
+]
+
+@pytest.mark.parametrize("old, new", ROUND_TRIPS)
+def test_diff_apply_round_trip(old, new):
+    ops = diff_documents(old, new)
+    result = apply_json_patch(copy.deepcopy(old), ops)
+    assert result == new
+    assert diff_documents(result, new) == []
+
+def test_diff_of_equal_documents_is_empty():
+    doc = {"a": [1, {"b": None}]}
+    assert diff_documents(doc, copy.deepcopy(doc)) == []